@@ -0,0 +1,216 @@
+import html
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import Date, Float, and_, case, cast, func, inspect, literal_column, select
+from sqlalchemy.orm import aliased
+
+from . import models
+
+
+# Общие фильтры аналитических эндпоинтов.
+# Период задается полуоткрытым диапазоном по самой колонке reviews.date:
+# [start_date 00:00, end_date + 1 день 00:00) — то же, что cast(date AS Date) BETWEEN start AND end,
+# но без выражения над колонкой, поэтому Postgres может использовать индекс по reviews.date.
+
+
+def parse_products(products: str | None) -> list | None:
+    """Список тем из параметра products ("Вклады, Ипотека") или None, если фильтра нет"""
+    return [p.strip() for p in products.split(',')] if products else None
+
+
+def period_bounds(start_date: date, end_date: date) -> tuple:
+    """Границы полуоткрытого диапазона [начало, конец) для периода с start_date по end_date включительно"""
+    return datetime.combine(start_date, time.min), datetime.combine(end_date + timedelta(days=1), time.min)
+
+
+def period_condition(start_date: date, end_date: date):
+    period_start, period_end = period_bounds(start_date, end_date)
+    return and_(models.Review.date >= period_start, models.Review.date < period_end)
+
+
+def has_topics(topic_ids: list):
+    """Условие на отзыв: есть связь хотя бы с одной из тем topic_ids (EXISTS, без выгрузки id отзывов).
+
+    Связи в подзапросе — под псевдонимом, чтобы он не коррелировал с reviews_topics внешнего запроса.
+    """
+    link = aliased(models.ReviewTopicLink)
+    return select(link.id).where(link.review_id == models.Review.id, link.topic_id.in_(topic_ids)).exists()
+
+
+# --- Запросы к дневному агрегату sentiment_daily (app/rollup.py) ---
+# День в агрегате — обычная дата, поэтому период фильтруется по ней напрямую (day BETWEEN start AND end).
+
+def rollup_count():
+    """Число связей отзыв-тема по строкам агрегата"""
+    return func.sum(models.SentimentDaily.count)
+
+
+def rollup_query(db, *entities, topic_ids: list | None = None, start_date: date | None = None, end_date: date | None = None):
+    """SELECT entities FROM sentiment_daily с фильтрами по темам (id из resolve_topic_ids) и периоду"""
+    query = db.query(*entities).select_from(models.SentimentDaily)
+    if topic_ids is not None:
+        query = query.filter(models.SentimentDaily.topic_id.in_(topic_ids))
+    if start_date and end_date:
+        query = query.filter(models.SentimentDaily.day >= start_date, models.SentimentDaily.day <= end_date)
+    return query
+
+
+def resolve_topic_ids(db, topic_list: list | None) -> list | None:
+    """id тем по названиям из фильтра products; None — фильтра нет.
+
+    Фильтр разрешается один раз, дальше все запросы панели (или всего дашборда) используют готовые id.
+    """
+    if not topic_list:
+        return None
+    return [row.id for row in db.query(models.Topic.id).filter(models.Topic.name.in_(topic_list))]
+
+
+def empty_counts() -> dict:
+    return {"positive": 0, "neutral": 0, "negative": 0}
+
+
+def period_sum(start_date: date, end_date: date):
+    """Сумма строк агрегата, попавших в период (границы включительно) — для условной агрегации"""
+    day = models.SentimentDaily.day
+    return func.sum(case((and_(day >= start_date, day <= end_date), models.SentimentDaily.count), else_=0))
+
+
+def period_counts(db, periods: dict, topic_ids: list | None = None) -> dict:
+    """Число упоминаний по тональностям для нескольких периодов одним запросом.
+
+    periods: {имя: (начало, конец)}, границы включительно; период без одной из границ дает нули.
+    """
+    result = {name: empty_counts() for name in periods}
+    bounded = {name: bounds for name, bounds in periods.items() if bounds[0] and bounds[1]}
+    if not bounded:
+        return result
+
+    columns = [period_sum(period_start, period_end).label(name) for name, (period_start, period_end) in bounded.items()]
+    rows = rollup_query(
+        db,
+        models.SentimentDaily.sentiment,
+        *columns,
+        topic_ids=topic_ids,
+        start_date=min(bounds[0] for bounds in bounded.values()),
+        end_date=max(bounds[1] for bounds in bounded.values()),
+    ).group_by(models.SentimentDaily.sentiment).all()
+    for row in rows:
+        for name in bounded:
+            result[name][row.sentiment.lower()] = getattr(row, name)
+    return result
+
+
+def aspect_rows(db, topic_ids: list | None, start_date: date | None, end_date: date | None, periods: dict, top_n: int) -> list:
+    """Топ тем по позитивным и негативным упоминаниям одним запросом.
+
+    Строки: aspect, sentiment, count (за весь период), по колонке на каждый период из periods и rank.
+    Упоминания считаются условной агрегацией, топ по каждой тональности отбирает row_number().
+    """
+    sentiment = func.lower(models.SentimentDaily.sentiment)
+    # Основное значение — за весь выбранный период (без дат — за все время)
+    total = period_sum(start_date, end_date) if start_date and end_date else rollup_count()
+    columns = [total.label("count")]
+    columns += [period_sum(*bounds).label(name) for name, bounds in periods.items()]
+
+    # Периоды тренда могут начинаться раньше start_date — читаем агрегат с запасом
+    range_start = min([start_date] + [bounds[0] for bounds in periods.values()]) if start_date and end_date else None
+    per_topic = rollup_query(
+        db,
+        models.SentimentDaily.topic_id,
+        sentiment.label("sentiment"),
+        *columns,
+        topic_ids=topic_ids,
+        start_date=range_start,
+        end_date=end_date,
+    ).filter(sentiment.in_(["positive", "negative"])).group_by(
+        models.SentimentDaily.topic_id, sentiment
+    ).having(total > 0).subquery()
+
+    ranked = select(
+        models.Topic.name.label("aspect"),
+        per_topic,
+        func.row_number().over(
+            partition_by=per_topic.c.sentiment, order_by=(per_topic.c.count.desc(), models.Topic.name)
+        ).label("rank"),
+    ).join(models.Topic, models.Topic.id == per_topic.c.topic_id).subquery()
+    return db.execute(select(ranked).where(ranked.c.rank <= top_n)).all()
+
+
+def dynamics_rows(db, topic_ids: list | None, start_date: date | None, end_date: date | None, unit: str) -> list:
+    """Строки group_date, sentiment, count по интервалам unit (day/week/month)"""
+    # Недели и месяцы собираются из дневных строк агрегата
+    group_date = func.date_trunc(unit, models.SentimentDaily.day).cast(Date).label("group_date")
+    return rollup_query(
+        db,
+        group_date,
+        models.SentimentDaily.sentiment,
+        rollup_count().label("count"),
+        topic_ids=topic_ids,
+        start_date=start_date,
+        end_date=end_date,
+    ).group_by("group_date", models.SentimentDaily.sentiment).having(rollup_count() > 0).order_by("group_date").all()
+
+
+# --- Курсор ленты отзывов: позиция последнего отзыва страницы (ключ сортировки, id) ---
+# Ключ сортировки — дата отзыва, а при поиске — релевантность (float8, repr восстанавливает ее точно).
+
+def encode_cursor(sort_key: datetime | float, review_id: int) -> str:
+    value = sort_key.isoformat() if isinstance(sort_key, datetime) else repr(sort_key)
+    return f"{value}_{review_id}"
+
+
+def decode_cursor(cursor: str, parse=datetime.fromisoformat) -> tuple | None:
+    """(ключ сортировки, id) из курсора или None, если курсор поврежден; parse — разбор ключа (float для поиска)"""
+    sort_key, _, review_id = cursor.rpartition("_")
+    try:
+        return parse(sort_key), int(review_id)
+    except ValueError:
+        return None
+
+
+# --- Полнотекстовый поиск (PostgreSQL, колонка reviews.search_vector из models.REVIEW_SEARCH_DDL) ---
+# Отбор идет по GIN-индексу (search_vector @@ запрос), релевантность считается только для найденных отзывов.
+
+SEARCH_CONFIG = "russian"
+# Маркеры совпадений в ts_headline: управляющие символы не встречаются в тексте отзывов,
+# поэтому текст можно экранировать целиком и только потом превратить маркеры в <mark>
+_MARK_START, _MARK_STOP = "\x02", "\x03"
+SNIPPET_OPTIONS = f"StartSel={_MARK_START}, StopSel={_MARK_STOP}, MaxWords=35, MinWords=15, MaxFragments=2"
+
+_search_ready = False
+
+
+def search_available(db) -> bool:
+    """Есть ли в базе колонка search_vector (PostgreSQL после миграции 002_reviews_search)"""
+    global _search_ready
+    bind = db.get_bind()
+    if not _search_ready and bind.dialect.name == "postgresql":
+        _search_ready = "search_vector" in {column["name"] for column in inspect(bind).get_columns("reviews")}
+    return _search_ready
+
+
+def search_query(q: str):
+    """Запрос в синтаксисе веб-поиска: слова, "фраза", OR, -исключение"""
+    return func.websearch_to_tsquery(literal_column(f"'{SEARCH_CONFIG}'"), q)
+
+
+def search_condition(q: str):
+    return literal_column("reviews.search_vector").op("@@")(search_query(q))
+
+
+def search_rank(q: str):
+    return cast(func.ts_rank_cd(literal_column("reviews.search_vector"), search_query(q)), Float)
+
+
+def search_snippets(db, q: str, review_ids: list) -> dict:
+    """Фрагменты текста с подсвеченными совпадениями (<mark>) для отзывов страницы"""
+    if not review_ids:
+        return {}
+    snippet = func.ts_headline(
+        literal_column(f"'{SEARCH_CONFIG}'"), models.Review.review_text, search_query(q), SNIPPET_OPTIONS
+    )
+    rows = db.execute(select(models.Review.id, snippet.label("snippet")).where(models.Review.id.in_(review_ids)))
+    return {
+        row.id: html.escape(row.snippet or "").replace(_MARK_START, "<mark>").replace(_MARK_STOP, "</mark>")
+        for row in rows
+    }
@@ -0,0 +1,195 @@
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import date
+
+from sqlalchemy import delete, insert, select
+
+try:
+    import brotli
+except ImportError:  # brotli есть в requirements.txt; без него ответы сжимаются только gzip
+    brotli = None
+
+from . import models
+from . import database
+
+
+# Кэш готовых ответов аналитических эндпоинтов (JSON-байты, в том числе сжатые).
+# Ключ — эндпоинт и нормализованные фильтры, значение действительно только для поколения данных
+# (models.DataVersion), при котором посчитано. Поколение читается из БД на каждый запрос, поэтому
+# запись через любой процесс (другой воркер, фоновая задача, seed_db) сбрасывает кэш сразу после commit.
+
+
+def current_generation(db) -> int:
+    return db.execute(select(models.DataVersion.generation).where(models.DataVersion.id == 1)).scalar() or 0
+
+
+# Сколько последних поколений хранится в журнале data_changes. Копия данных, отставшая сильнее, строится заново.
+# Копия догоняет журнал перед каждым запросом панели, так что обычно отстает на единицы поколений
+CHANGE_LOG_GENERATIONS = 1000
+
+
+def bump_generation(db, review_ids: list | None = None) -> int:
+    """Увеличивает поколение данных в транзакции записи (без commit) и возвращает новое значение.
+
+    review_ids записываются в журнал data_changes; None — одна строка «изменено неизвестно что»
+    (массовая перезагрузка или запись без колоночной копии), по ней копия строится заново.
+    Журнал хранит последние CHANGE_LOG_GENERATIONS поколений.
+    Вызывается в конце транзакции: строка поколения блокируется до commit, поэтому поколения и журнал
+    фиксируются строго по порядку (сами записи связей сериализует rollup.lock_writes).
+    """
+    stmt = database.dialect_insert(models.DataVersion).values(id=1, generation=1)
+    generation = db.execute(stmt.on_conflict_do_update(
+        index_elements=["id"], set_={"generation": models.DataVersion.generation + 1}
+    ).returning(models.DataVersion.generation)).scalar()
+    db.execute(insert(models.DataChange), [
+        {"generation": generation, "review_id": review_id} for review_id in (review_ids or [None])
+    ])
+    db.execute(delete(models.DataChange).where(models.DataChange.generation <= generation - CHANGE_LOG_GENERATIONS))
+    return generation
+
+
+def changes_since(db, generation: int) -> tuple:
+    """(текущее поколение, id измененных отзывов) после generation; id = None — нужна полная перезагрузка"""
+    current = current_generation(db)
+    if current <= generation:
+        return current, set()
+    rows = db.execute(
+        select(models.DataChange.generation, models.DataChange.review_id).where(models.DataChange.generation > generation)
+    ).all()
+    # Журнал обрезан дальше, чем нужно (или пуст) — изменения восстановить нельзя
+    if not rows or min(row.generation for row in rows) > generation + 1:
+        return max([current] + [row.generation for row in rows]), None
+    review_ids = {row.review_id for row in rows}
+    return max([current] + [row.generation for row in rows]), None if None in review_ids else review_ids
+
+
+def filter_key(products: str | None, start_date: date | None, end_date: date | None, granularity: str | None = None) -> tuple:
+    """Нормализованные фильтры: порядок и повторы продуктов не важны, гранулярность — одна из day/week/month.
+
+    Период учитывается, только если заданы обе границы (как в запросах), иначе он не влияет на ответ.
+    """
+    topics = tuple(sorted({p.strip() for p in products.split(',')})) if products else None
+    period = (start_date, end_date) if start_date and end_date else None
+    if granularity is not None and granularity not in ('day', 'week'):
+        granularity = 'month'
+    return topics, period, granularity
+
+
+# --- Условные запросы и сжатие ответов ---
+
+def make_etag(key: tuple, generation: int) -> str:
+    """ETag по фильтрам и поколению данных: известен до расчета ответа, одинаков во всех воркерах.
+
+    Слабый (W/), так как одно и то же содержимое отдается в разных Content-Encoding.
+    """
+    digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:20]
+    return f'W/"{generation}-{digest}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Сравнение If-None-Match с ETag (слабое сравнение, как требует RFC 9110 для If-None-Match)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in if_none_match.split(","))
+
+
+def choose_encoding(accept_encoding: str) -> str | None:
+    """br, если клиент его принимает и модуль brotli установлен, иначе gzip; None — без сжатия"""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        quality = params.strip().removeprefix("q=") if params.strip().startswith("q=") else "1"
+        try:
+            accepted[name.strip()] = float(quality)
+        except ValueError:
+            continue
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    # Средние уровни: ответ сжимается один раз на поколение данных и дальше отдается из кэша
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+class AnalyticsCache:
+    """LRU ответов с ограничением по числу записей и суммарному размеру.
+
+    Хранит записи одного поколения данных: увидев более новое поколение, кэш очищается,
+    а результат, посчитанный при старом поколении, не сохраняется.
+    """
+
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.generation = None
+        self._entries: OrderedDict[tuple, bytes] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def _sync(self, generation: int) -> bool:
+        """Переходит на более новое поколение; False, если generation устарело"""
+        if self.generation is not None and generation < self.generation:
+            return False
+        if generation != self.generation:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._size = 0
+            self.generation = generation
+        return True
+
+    def get(self, key: tuple, generation: int, record: bool = True) -> bytes | None:
+        """Ответ из кэша; record=False — не учитывать обращение в статистике (повторный поиск того же ответа)"""
+        with self._lock:
+            value = self._entries.get(key) if self._sync(generation) else None
+            if value is None:
+                self.misses += record
+                return None
+            self._entries.move_to_end(key)
+            self.hits += record
+            return value
+
+    def set(self, key: tuple, generation: int, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if not self._sync(generation):
+                return
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = value
+            self._size += len(value)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self._size,
+            "generation": self.generation,
+        }
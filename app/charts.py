@@ -0,0 +1,95 @@
+import json
+
+import orjson
+import plotly.graph_objects as go
+
+
+# Графики собираются сразу в JSON-байты, без объектной модели Plotly на каждый запрос.
+# Результат совпадает с json.loads(fig.to_json()) для тех же данных: layout (с полным шаблоном
+# plotly_white) сериализуется через Plotly один раз при импорте, на запрос сериализуются только трейсы.
+
+COLORS = {'positive': '#00875A', 'negative': '#DE350B', 'neutral': '#FFA500'}
+NAMES = {'positive': 'Позитивные', 'negative': 'Негативные', 'neutral': 'Нейтральные'}
+SENTIMENTS_ORDER = ['positive', 'neutral', 'negative']
+
+_COMMON_LAYOUT = dict(
+    template="plotly_white",
+    margin=dict(t=10, b=10, l=40, r=10),
+    legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+)
+
+
+def _layout_bytes(**layout) -> bytes:
+    return orjson.dumps(json.loads(go.Figure(layout=layout).to_json())["layout"])
+
+
+SHARE_LAYOUT = _layout_bytes(yaxis_title="Доля, %", **_COMMON_LAYOUT)
+COUNT_LAYOUT = _layout_bytes(barmode='stack', yaxis_title="Количество отзывов", **_COMMON_LAYOUT)
+
+
+def _figure_bytes(traces: list, layout: bytes) -> bytes:
+    return b'{"data":' + orjson.dumps(traces) + b',"layout":' + layout + b'}'
+
+
+def embed(payload: dict, **figures: bytes) -> bytes:
+    """JSON-объект из payload и уже сериализованных фигур (без повторного разбора их байтов)"""
+    body = orjson.dumps(payload)
+    parts = [body[:-1]]
+    separator = b"," if payload else b""
+    for name, figure in figures.items():
+        parts.append(separator + orjson.dumps(name) + b":" + figure)
+        separator = b","
+    parts.append(b"}")
+    return b"".join(parts)
+
+
+def share_series(data: dict, raw_categories_dates: list) -> dict:
+    """Доли тональностей (%) по датам из результата create_dynamics_data"""
+    series_data = {s: [] for s in ['positive', 'negative', 'neutral']}
+    for date_key in raw_categories_dates:
+        total = sum(data.get(date_key, {}).values())
+        for sentiment in series_data:
+            count = data.get(date_key, {}).get(sentiment, 0)
+            series_data[sentiment].append((count / total) * 100 if total > 0 else 0)
+    return series_data
+
+
+def count_series(data: dict, raw_categories_dates: list) -> dict:
+    """Количество упоминаний по тональностям и датам из результата create_dynamics_data"""
+    return {
+        sentiment: [data.get(date_key, {}).get(sentiment, 0) for date_key in raw_categories_dates]
+        for sentiment in SENTIMENTS_ORDER
+    }
+
+
+def share_chart(formatted_categories: list, series_data: dict) -> bytes:
+    """График долей (%) — stacked area по тональностям"""
+    traces = [
+        {
+            "fillcolor": COLORS[sentiment],
+            "line": {"color": COLORS[sentiment], "width": 0.5},
+            "mode": "lines",
+            "name": NAMES[sentiment],
+            "stackgroup": "one",
+            "x": formatted_categories,
+            "y": series_data[sentiment],
+            "type": "scatter",
+        }
+        for sentiment in SENTIMENTS_ORDER
+    ]
+    return _figure_bytes(traces, SHARE_LAYOUT)
+
+
+def count_chart(formatted_categories: list, series_counts: dict) -> bytes:
+    """График количества — stacked bar по тональностям"""
+    traces = [
+        {
+            "marker": {"color": COLORS[sentiment]},
+            "name": NAMES[sentiment],
+            "x": formatted_categories,
+            "y": series_counts[sentiment],
+            "type": "bar",
+        }
+        for sentiment in SENTIMENTS_ORDER
+    ]
+    return _figure_bytes(traces, COUNT_LAYOUT)
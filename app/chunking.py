@@ -0,0 +1,62 @@
+import re
+
+
+# Грубая оценка для токенизатора Qwen на русском тексте: ~3 символа на токен.
+# Берем с запасом, чтобы оценка не оказывалась меньше реального числа токенов.
+CHARS_PER_TOKEN = 2.5
+
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?…])\s+|\n+")
+
+
+def estimate_tokens(text: str) -> int:
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+def _split_long_piece(piece: str, max_chars: int) -> list:
+    """Делит одно слишком длинное предложение по словам, а слишком длинное слово — по символам"""
+    parts = []
+    current = ""
+    for word in piece.split():
+        while len(word) > max_chars:
+            if current:
+                parts.append(current)
+                current = ""
+            parts.append(word[:max_chars])
+            word = word[max_chars:]
+        candidate = f"{current} {word}" if current else word
+        if len(candidate) > max_chars:
+            parts.append(current)
+            current = word
+        else:
+            current = candidate
+    if current:
+        parts.append(current)
+    return parts
+
+
+def split_text(text: str, max_tokens: int) -> list:
+    """Делит текст на куски не длиннее max_tokens (по оценке), стараясь резать по границам предложений.
+
+    Текст, укладывающийся в бюджет, возвращается как есть одним куском.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+
+    max_chars = max(1, int((max_tokens - 1) * CHARS_PER_TOKEN))
+    chunks = []
+    current = ""
+    for sentence in _SENTENCE_END_RE.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        pieces = [sentence] if len(sentence) <= max_chars else _split_long_piece(sentence, max_chars)
+        for piece in pieces:
+            candidate = f"{current} {piece}" if current else piece
+            if len(candidate) > max_chars:
+                chunks.append(current)
+                current = piece
+            else:
+                current = candidate
+    if current:
+        chunks.append(current)
+    return [chunk for chunk in chunks if chunk]
@@ -0,0 +1,205 @@
+import threading
+import time
+from datetime import date
+from types import SimpleNamespace
+
+import pandas as pd
+from sqlalchemy import func, select
+
+from . import models
+from . import analytics_cache
+
+try:
+    import duckdb
+except ImportError:  # Движок необязательный: duckdb нужен только при ANALYTICS_ENGINE=duckdb
+    duckdb = None
+
+
+# Колоночная копия аналитических данных в DuckDB (ANALYTICS_ENGINE=duckdb).
+# Денормализованная таблица фактов — одна строка на связь отзыв-тема: (review_id, day, topic_id, sentiment,
+# source, rating) — и справочник тем. Источник истины — основная БД: перед запросом копия догоняет ее
+# по журналу data_changes (перечитываются только измененные отзывы), после массовой загрузки или
+# слишком большого отставания строится заново. id отзывов журналируют только процессы с ANALYTICS_ENGINE=duckdb:
+# запись из процесса без копии отмечается в журнале как полная перезагрузка.
+#
+# DuckDB-файл открывается одним процессом: с несколькими воркерами uvicorn каждому нужна своя копия
+# (COLUMNAR_PATH пустой — копия в памяти).
+
+FACT_COLUMNS = ["review_id", "day", "topic_id", "sentiment", "source", "rating"]
+
+
+def _facts_query(review_ids: list | None = None):
+    query = select(
+        models.ReviewTopicLink.review_id,
+        func.date(models.Review.date).label("day"),
+        models.ReviewTopicLink.topic_id,
+        func.lower(models.ReviewTopicLink.sentiment).label("sentiment"),
+        models.Review.source,
+        models.Review.rating,
+    ).select_from(models.ReviewTopicLink).join(models.Review).where(models.Review.date.is_not(None))
+    if review_ids is not None:
+        query = query.where(models.ReviewTopicLink.review_id.in_(review_ids))
+    return query
+
+
+def _rows(cursor) -> list:
+    names = [column[0] for column in cursor.description]
+    return [SimpleNamespace(**dict(zip(names, row))) for row in cursor.fetchall()]
+
+
+class ColumnarStore:
+    """Колоночная копия фактов с теми же запросами панелей, что у агрегата в app/analytics.py.
+
+    period_counts, aspect_rows и dynamics_rows повторяют одноименные функции analytics
+    (первый аргумент db не используется: копия синхронизируется заранее методом sync).
+    """
+
+    def __init__(self, path: str = "", chunk_size: int = 100_000, refresh_batch_size: int = 10_000):
+        if duckdb is None:
+            raise RuntimeError("ANALYTICS_ENGINE=duckdb требует пакет duckdb (pip install duckdb)")
+        self.chunk_size = chunk_size
+        self.refresh_batch_size = refresh_batch_size
+        self._connection = duckdb.connect(path or ":memory:")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS facts (review_id INTEGER, day DATE, topic_id INTEGER, sentiment VARCHAR, "
+            "source VARCHAR, rating DOUBLE)"
+        )
+        self._connection.execute("CREATE TABLE IF NOT EXISTS topics (id INTEGER, name VARCHAR)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS snapshot (generation INTEGER)")
+        row = self._connection.execute("SELECT max(generation) FROM snapshot").fetchone()
+        # Новая копия: -1, чтобы первая синхронизация точно построила ее целиком
+        self.generation = row[0] if row[0] is not None else -1
+        self._lock = threading.Lock()
+
+        self.full_loads = 0
+        self.incremental_loads = 0
+        self.refreshed_reviews = 0
+        self.last_load_seconds = 0.0
+
+    # --- Синхронизация с основной БД ---
+
+    def sync(self, db):
+        """Догоняет основную БД: инкрементально по журналу изменений или полной перезагрузкой"""
+        if analytics_cache.current_generation(db) == self.generation:
+            return
+        with self._lock:
+            generation, review_ids = analytics_cache.changes_since(db, self.generation)
+            if generation == self.generation:
+                return
+            started_at = time.perf_counter()
+            connection = self._connection.cursor()
+            connection.execute("BEGIN TRANSACTION")
+            try:
+                if review_ids is None or self.generation < 0:
+                    connection.execute("DELETE FROM facts")
+                    self._load(connection, db, _facts_query())
+                    self.full_loads += 1
+                else:
+                    ids = sorted(review_ids)
+                    for start in range(0, len(ids), self.refresh_batch_size):
+                        batch = ids[start:start + self.refresh_batch_size]
+                        # Полусоединение с таблицей id, а не list_contains: без сравнения каждой строки со всем списком
+                        connection.register("changed_reviews", pd.DataFrame({"review_id": batch}))
+                        connection.execute("DELETE FROM facts WHERE review_id IN (SELECT review_id FROM changed_reviews)")
+                        connection.unregister("changed_reviews")
+                        self._load(connection, db, _facts_query(batch))
+                    self.incremental_loads += 1
+                    self.refreshed_reviews += len(ids)
+                connection.execute("DELETE FROM topics")
+                topics = pd.DataFrame(db.execute(select(models.Topic.id, models.Topic.name)).all(), columns=["id", "name"])
+                connection.register("topics_chunk", topics)
+                connection.execute("INSERT INTO topics SELECT id, name FROM topics_chunk")
+                connection.unregister("topics_chunk")
+                connection.execute("DELETE FROM snapshot")
+                connection.execute("INSERT INTO snapshot VALUES (?)", [generation])
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+            self.generation = generation
+            self.last_load_seconds = time.perf_counter() - started_at
+
+    def _load(self, connection, db, query):
+        """Потоковая выгрузка фактов из основной БД порциями по chunk_size строк"""
+        # Через Core-соединение сессии: ORM-обработка строк здесь не нужна и заметно медленнее
+        result = db.connection().execute(query.execution_options(yield_per=self.chunk_size))
+        for partition in result.partitions():
+            chunk = pd.DataFrame(partition, columns=FACT_COLUMNS)
+            connection.register("facts_chunk", chunk)
+            connection.execute(f"INSERT INTO facts SELECT {', '.join(FACT_COLUMNS)} FROM facts_chunk")
+            connection.unregister("facts_chunk")
+
+    # --- Запросы панелей ---
+
+    @staticmethod
+    def _filters(topic_ids: list | None, start_date: date | None, end_date: date | None) -> tuple:
+        conditions, params = [], []
+        if topic_ids is not None:
+            conditions.append("list_contains(?, topic_id)")
+            params.append(list(topic_ids))
+        if start_date and end_date:
+            conditions.append("day BETWEEN ? AND ?")
+            params += [start_date, end_date]
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+    def _query(self, sql: str, params: list) -> list:
+        # Отдельный курсор на запрос: соединение DuckDB не используется из нескольких потоков сразу
+        return _rows(self._connection.cursor().execute(sql, params))
+
+    def period_counts(self, db, periods: dict, topic_ids: list | None = None) -> dict:
+        result = {name: {"positive": 0, "neutral": 0, "negative": 0} for name in periods}
+        bounded = {name: bounds for name, bounds in periods.items() if bounds[0] and bounds[1]}
+        if not bounded:
+            return result
+        where, params = self._filters(
+            topic_ids, min(bounds[0] for bounds in bounded.values()), max(bounds[1] for bounds in bounded.values())
+        )
+        columns = ", ".join(f'count(*) FILTER (WHERE day BETWEEN ? AND ?) AS "{name}"' for name in bounded)
+        column_params = [bound for bounds in bounded.values() for bound in bounds]
+        for row in self._query(f"SELECT sentiment, {columns} FROM facts{where} GROUP BY sentiment", column_params + params):
+            for name in bounded:
+                result[name][row.sentiment] = getattr(row, name)
+        return result
+
+    def aspect_rows(self, db, topic_ids: list | None, start_date: date | None, end_date: date | None, periods: dict, top_n: int) -> list:
+        bounded = start_date and end_date
+        total = "count(*) FILTER (WHERE day BETWEEN ? AND ?)" if bounded else "count(*)"
+        column_params = [start_date, end_date] if bounded else []
+        columns = [f"{total} AS count"]
+        for name, bounds in periods.items():
+            columns.append(f'count(*) FILTER (WHERE day BETWEEN ? AND ?) AS "{name}"')
+            column_params += list(bounds)
+        range_start = min([start_date] + [bounds[0] for bounds in periods.values()]) if bounded else None
+        where, params = self._filters(topic_ids, range_start, end_date)
+        where += (" AND " if where else " WHERE ") + "sentiment IN ('positive', 'negative')"
+        sql = f"""
+            WITH per_topic AS (
+                SELECT topic_id, sentiment, {', '.join(columns)}
+                FROM facts{where}
+                GROUP BY topic_id, sentiment
+                HAVING {total} > 0
+            )
+            SELECT topics.name AS aspect, per_topic.*,
+                   row_number() OVER (PARTITION BY per_topic.sentiment ORDER BY per_topic.count DESC, topics.name) AS rank
+            FROM per_topic JOIN topics ON topics.id = per_topic.topic_id
+            QUALIFY rank <= ?
+        """
+        return self._query(sql, column_params + params + column_params[:2 if bounded else 0] + [top_n])
+
+    def dynamics_rows(self, db, topic_ids: list | None, start_date: date | None, end_date: date | None, unit: str) -> list:
+        where, params = self._filters(topic_ids, start_date, end_date)
+        sql = (
+            f"SELECT CAST(date_trunc(?, day) AS DATE) AS group_date, sentiment, count(*) AS count FROM facts{where} "
+            "GROUP BY group_date, sentiment ORDER BY group_date"
+        )
+        return self._query(sql, [unit] + params)
+
+    def stats(self) -> dict:
+        return {
+            "generation": self.generation,
+            "facts": self._query("SELECT count(*) AS n FROM facts", [])[0].n,
+            "full_loads": self.full_loads,
+            "incremental_loads": self.incremental_loads,
+            "refreshed_reviews": self.refreshed_reviews,
+            "last_load_seconds": round(self.last_load_seconds, 3),
+        }
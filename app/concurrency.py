@@ -0,0 +1,147 @@
+import asyncio
+import math
+import time
+from collections import deque
+
+
+class AdaptiveLimiter:
+    """Адаптивный лимит одновременных запросов к vLLM (AIMD).
+
+    - Аддитивное увеличение: каждый успешный ответ с нормальной задержкой добавляет 1/limit,
+      т.е. примерно +1 к лимиту за одно полное «окно» запросов (только если лимит реально используется);
+    - Мультипликативное уменьшение: таймаут, 429 или 5xx умножают лимит на backoff,
+      а рост задержки выше tolerance * обычной — на latency_backoff.
+      Обычная задержка (медленная EWMA) ведется отдельно по корзинам длины запроса (полуоктавы
+      prompt-токенов), сигналом служит короткая EWMA отношения задержки к обычной для своей корзины:
+      волна длинных отзывов при здоровом бэкенде лимит не снижает.
+      Уменьшение происходит не чаще одного раза за текущую задержку, чтобы одна волна ошибок
+      из одного окна не обрушила лимит до минимума.
+
+    При min_limit == max_limit ведет себя как обычный семафор.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 32,
+        min_limit: int = 4,
+        max_limit: int = 100,
+        backoff: float = 0.75,
+        latency_backoff: float = 0.9,
+        latency_tolerance: float = 2.0,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.backoff = backoff
+        self.latency_backoff = latency_backoff
+        self.latency_tolerance = latency_tolerance
+
+        self.in_flight = 0
+        self.waiting = 0
+        self._waiters: deque[asyncio.Future] = deque()
+
+        self.short_latency: float | None = None  # EWMA задержки по последним ответам (для паузы между уменьшениями)
+        self.latency_ratio: float | None = None  # EWMA отношения задержки к обычной для длины запроса
+        self._baselines: dict[int, float] = {}   # Корзина длины -> медленная EWMA задержки, «нормальная» задержка
+        self._last_decrease = 0.0
+
+        self.successes = 0
+        self.overloads = 0
+        self.decreases = 0
+
+    # --- Слоты ---
+
+    def _available(self) -> bool:
+        return self.in_flight < int(self.limit)
+
+    def _wake(self):
+        while self._waiters and self._available():
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    async def acquire(self):
+        if not self._waiters and self._available():
+            self.in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.waiting += 1
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Слот успели выдать, но задача отменена — возвращаем его
+                self.release()
+            raise
+        finally:
+            self.waiting -= 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+    # --- Обратная связь ---
+
+    def _decrease(self, factor: float):
+        now = time.monotonic()
+        cooldown = min(self.short_latency or 1.0, 5.0)
+        if now - self._last_decrease < cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.min_limit), self.limit * factor)
+        self.decreases += 1
+
+    @staticmethod
+    def _bucket(prompt_tokens: int) -> int:
+        return int(2 * math.log2(max(prompt_tokens, 1)))
+
+    def record_success(self, latency: float, prompt_tokens: int = 1):
+        self.successes += 1
+        bucket = self._bucket(prompt_tokens)
+        baseline = self._baselines.get(bucket)
+        if baseline is None:
+            # Первый ответ такой длины: сравнивать не с чем, он и задает обычную задержку
+            self._baselines[bucket] = baseline = latency
+        else:
+            self._baselines[bucket] += 0.02 * (latency - baseline)
+        ratio = latency / baseline if baseline > 0 else 1.0
+        if self.short_latency is None:
+            self.short_latency, self.latency_ratio = latency, ratio
+        else:
+            self.short_latency += 0.2 * (latency - self.short_latency)
+            self.latency_ratio += 0.2 * (ratio - self.latency_ratio)
+
+        if self.latency_ratio > self.latency_tolerance:
+            self._decrease(self.latency_backoff)
+        elif self.in_flight >= self.limit / 2:
+            self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+            self._wake()
+
+    def record_overload(self):
+        """Таймаут, 429 или 5xx от бэкенда"""
+        self.overloads += 1
+        self._decrease(self.backoff)
+
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "in_flight": self.in_flight,
+            "backlog": self.waiting,
+            "short_latency_seconds": self.short_latency,
+            "latency_ratio": self.latency_ratio,
+            "latency_buckets": len(self._baselines),
+            "successes": self.successes,
+            "overloads": self.overloads,
+            "decreases": self.decreases,
+        }
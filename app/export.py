@@ -0,0 +1,196 @@
+import csv
+import io
+from datetime import date
+from itertools import groupby
+from operator import itemgetter
+
+from sqlalchemy import select
+
+from . import models
+from . import database
+from . import analytics
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow есть в requirements.txt; без него доступна только выгрузка в CSV
+    pa = pq = None
+
+
+# Потоковая выгрузка отзывов и связей с темами (/api/export/...) с теми же фильтрами, что у дашборда.
+# Строки читаются серверным курсором порциями по chunk_size (yield_per), каждая порция сразу
+# кодируется и отдается клиенту — память процесса не зависит от размера выгрузки.
+#
+#   reviews — строка на отзыв: темы и тональности через "; " в порядке разметки;
+#   links   — строка на связь отзыв-тема (без текста), фильтр по продуктам оставляет только их связи.
+
+# Колонки выгрузок и их типы (для схемы Parquet)
+COLUMNS = {
+    "reviews": [
+        ("id", "int"), ("date", "datetime"), ("source", "str"), ("rating", "float"), ("product", "str"),
+        ("text", "str"), ("topics", "str"), ("sentiments", "str"),
+    ],
+    "links": [
+        ("review_id", "int"), ("date", "datetime"), ("source", "str"), ("rating", "float"),
+        ("topic", "str"), ("sentiment", "str"),
+    ],
+}
+MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "parquet": "application/vnd.apache.parquet"}
+LIST_SEPARATOR = "; "
+
+
+def available_formats() -> list:
+    return ["csv", "parquet"] if pq is not None else ["csv"]
+
+
+def reviews_query(topic_ids: list | None, start_date: date | None, end_date: date | None):
+    """Отзывы с их связями (outer join — отзывы без тем тоже попадают), по порядку id отзыва и связи"""
+    query = select(
+        models.Review.id,
+        models.Review.date,
+        models.Review.source,
+        models.Review.rating,
+        models.Review.source_topic,
+        models.Review.review_text,
+        models.Topic.name.label("topic"),
+        models.ReviewTopicLink.sentiment,
+    ).select_from(models.Review).outerjoin(
+        models.ReviewTopicLink, models.ReviewTopicLink.review_id == models.Review.id
+    ).outerjoin(models.Topic, models.Topic.id == models.ReviewTopicLink.topic_id)
+    if topic_ids is not None:
+        query = query.where(analytics.has_topics(topic_ids))
+    if start_date and end_date:
+        query = query.where(analytics.period_condition(start_date, end_date))
+    return query.order_by(models.Review.id, models.ReviewTopicLink.id)
+
+
+def links_query(topic_ids: list | None, start_date: date | None, end_date: date | None):
+    query = select(
+        models.ReviewTopicLink.review_id,
+        models.Review.date,
+        models.Review.source,
+        models.Review.rating,
+        models.Topic.name.label("topic"),
+        models.ReviewTopicLink.sentiment,
+    ).select_from(models.ReviewTopicLink).join(models.Review).join(models.Topic)
+    if topic_ids is not None:
+        query = query.where(models.ReviewTopicLink.topic_id.in_(topic_ids))
+    if start_date and end_date:
+        query = query.where(analytics.period_condition(start_date, end_date))
+    return query.order_by(models.ReviewTopicLink.review_id, models.ReviewTopicLink.id)
+
+
+def _review_row(links: list) -> tuple:
+    """Строка отзыва из его строк join (поля по позиции в reviews_query: 6 — тема, 7 — тональность)"""
+    labeled = [(link[6], link[7] or "") for link in links if link[6] is not None]
+    return (*links[0][:6], LIST_SEPARATOR.join(topic for topic, _ in labeled), LIST_SEPARATOR.join(s for _, s in labeled))
+
+
+def group_reviews(partitions):
+    """Порции строк join отзыв-связь -> порции строк по отзыву.
+
+    Связи одного отзыва идут подряд; отзыв на границе порции переносится в следующую.
+    """
+    carry = []
+    for rows in partitions:
+        rows = carry + list(rows)
+        last_id = rows[-1][0]
+        split = len(rows)
+        while split and rows[split - 1][0] == last_id:
+            split -= 1
+        complete, carry = rows[:split], rows[split:]
+        if complete:
+            yield [_review_row(list(links)) for _, links in groupby(complete, key=itemgetter(0))]
+    if carry:
+        yield [_review_row(carry)]
+
+
+class CsvEncoder:
+    """CSV в UTF-8 с BOM (Excel иначе не распознает кириллицу); заголовок — перед первой порцией"""
+
+    def __init__(self, columns: list):
+        self._pending = "\ufeff" + self._format([[name for name, _ in columns]])
+
+    @staticmethod
+    def _format(rows) -> str:
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows(rows)
+        return buffer.getvalue()
+
+    def write(self, rows: list) -> bytes:
+        data, self._pending = self._pending + self._format(rows), ""
+        return data.encode("utf-8")
+
+    def finish(self) -> bytes:
+        return self._pending.encode("utf-8")
+
+
+class _ChunkSink:
+    """Файл для ParquetWriter, который копит записанные байты до выдачи клиенту.
+
+    tell() считает все записанное с начала: по этим смещениям Parquet строит футер.
+    """
+
+    def __init__(self):
+        self.chunks, self.position, self.closed = [], 0, False
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+class ParquetEncoder:
+    """Parquet: каждая порция — отдельная группа строк, футер со схемой — в конце выгрузки"""
+
+    def __init__(self, columns: list):
+        types = {"int": pa.int64(), "float": pa.float64(), "str": pa.string(), "datetime": pa.timestamp("us")}
+        self._schema = pa.schema([(name, types[kind]) for name, kind in columns])
+        self._sink = _ChunkSink()
+        self._writer = pq.ParquetWriter(pa.PythonFile(self._sink, mode="w"), self._schema, compression="zstd")
+
+    def write(self, rows: list) -> bytes:
+        columns = list(zip(*rows))
+        self._writer.write_table(pa.Table.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(columns, self._schema)], schema=self._schema
+        ))
+        return self._sink.drain()
+
+    def finish(self) -> bytes:
+        self._writer.close()
+        return self._sink.drain()
+
+
+ENCODERS = {"csv": CsvEncoder, "parquet": ParquetEncoder}
+
+
+def export_chunks(kind: str, fmt: str, topic_ids: list | None, start_date: date | None, end_date: date | None, chunk_size: int):
+    """Генератор байтов выгрузки kind (reviews/links) в формате fmt (csv/parquet) в собственной сессии.
+
+    Блокирующий: каждый next() читает и кодирует одну порцию (в API — через database.iterate_sync).
+    """
+    query = (reviews_query if kind == "reviews" else links_query)(topic_ids, start_date, end_date)
+    encoder = ENCODERS[fmt](COLUMNS[kind])
+    with database.SessionLocal() as db:
+        # Core-соединение сессии: ORM-обработка строк не нужна; yield_per включает серверный курсор
+        partitions = db.connection().execute(query.execution_options(yield_per=chunk_size)).partitions()
+        for rows in (group_reviews(partitions) if kind == "reviews" else partitions):
+            data = encoder.write(rows)
+            if data:
+                yield data
+        data = encoder.finish()
+        if data:
+            yield data
@@ -0,0 +1,154 @@
+import re
+
+from . import postprocessing
+
+
+# Быстрый путь без LLM для коротких однозначных отзывов вида «удобное мобильное приложение».
+# Отвечаем только когда уверены: ровно одна тема, тональность однозначна, нет отрицаний и противопоставлений.
+# Все остальное уходит в vLLM.
+
+MAX_WORDS = 12  # Длиннее — уже не «тривиальный» отзыв
+
+# Основы слов (совпадение по началу слова) -> тема или подтема из postprocessing.topics_subtopics
+TOPIC_STEMS = {
+    "приложени": "Мобильное приложение",
+    "банкомат": "Банкоматы",
+    "отделени": "Офисное обслуживание",
+    "офис": "Офисное обслуживание",
+    "оператор": "Дистанционное обслуживание",
+    "поддержк": "Дистанционное обслуживание",
+    "курьер": "Курьерская доставка карт",
+    "валют": "Обмен валют",
+    "ипотек": "Ипотека",
+    "вклад": "Вклады",
+    "депозит": "Вклады",
+    "автокредит": "Автокредиты",
+    "кредитк": "Кредитные карты",
+    "дебетов": "Дебетовые карты",
+    "кэшбэк": "Кэшбэк",
+    "кешбэк": "Кэшбэк",
+    "кэшбек": "Кэшбэк",
+    "кешбек": "Кэшбэк",
+    "накопительн": "Накопительные счета",
+    "страховк": "Страховые и сервисные продукты",
+    "страхован": "Страховые и сервисные продукты",
+    "рефинансир": "Рефинансирование кредитов",
+    "реструктуриз": "Реструктуризация кредитов",
+    "кредит": "Кредиты",
+}
+
+# Основы, по которым тему однозначно не определить («кредитная» — карта, история, линия...)
+AMBIGUOUS_TOPIC_STEMS = ("кредитн",)
+
+# Основы берутся только такие, что не начинают слов с другим смыслом: «долг» нашлось бы в «долгожданная»,
+# «класс» — в «классический». Для таких слов — список точных форм. Правки проверяются на REGRESSION_CASES
+POSITIVE_STEMS = (
+    "удобн", "отличн", "хорош", "спасибо", "благодар", "нрав", "рекоменд", "доволен", "довольн",
+    "супер", "прекрасн", "замечательн", "вежлив", "лучш", "понятн", "приятн", "классн", "выгодн", "молодц",
+)
+POSITIVE_WORDS = {"класс"}
+
+NEGATIVE_STEMS = (
+    "ужасн", "плох", "неудобн", "отвратительн", "хамск", "хамств", "груб", "обман", "кошмар",
+    "навяз", "зависа", "невозможн", "худш", "отстой", "позор", "безобраз", "бесполезн", "недоволен", "разочаров",
+)
+NEGATIVE_WORDS = {
+    "долго", "дольше", "долгий", "долгая", "долгое", "долгие", "долгого", "долгой", "долгому", "долгим", "долгих",
+}
+
+# Оценка зависит от того, что именно произошло: «быстро одобрили» хорошо, «быстро списали деньги» — нет
+AMBIGUOUS_SENTIMENT_STEMS = ("быстр",)
+
+# Отрицания и противопоставления делают тональность неоднозначной — такие отзывы отдаем модели
+AMBIGUITY_WORDS = {"не", "ни", "нет", "но", "однако", "хотя", "зато", "а", "если", "?"}
+
+_WORD_RE = re.compile(r"\w+|\?")
+
+# Полные названия тем/подтем и синонимов (в нижнем регистре) -> название, которое поймет process_pairs
+_TOPIC_NAMES = {
+    name.lower(): name
+    for name in postprocessing.topics_subtopics_flatten + list(postprocessing.topics_to_replace)
+}
+# Ищем названия целиком, а не как подстроку («акции» не должно находиться в «транзакции»)
+_TOPIC_NAMES_RE = re.compile(
+    "|".join(rf"(?<!\w){re.escape(name)}(?!\w)" for name in sorted(_TOPIC_NAMES, key=len, reverse=True))
+)
+
+
+def _match_stem(word: str, stems) -> str | None:
+    for stem in stems:
+        if word.startswith(stem):
+            return stem
+    return None
+
+
+def classify(text: str) -> list | None:
+    """Пары тема/тональность для тривиального отзыва или None, если нужна модель"""
+    lowered = text.lower()
+    words = _WORD_RE.findall(lowered)
+    if not words or len(words) > MAX_WORDS:
+        return None
+    if any(word in AMBIGUITY_WORDS for word in words):
+        return None
+
+    topics = {_TOPIC_NAMES[match] for match in _TOPIC_NAMES_RE.findall(lowered)}
+    positive = negative = 0
+    for word in words:
+        if _match_stem(word, AMBIGUOUS_TOPIC_STEMS) or _match_stem(word, AMBIGUOUS_SENTIMENT_STEMS):
+            return None
+        stem = _match_stem(word, TOPIC_STEMS)
+        if stem is not None:
+            topics.add(TOPIC_STEMS[stem])
+        if word in POSITIVE_WORDS or _match_stem(word, POSITIVE_STEMS):
+            positive += 1
+        if word in NEGATIVE_WORDS or _match_stem(word, NEGATIVE_STEMS):
+            negative += 1
+
+    # Приводим к каноническим темам: подтема и ее тема считаются одним упоминанием
+    canonical = {
+        topic
+        for name in topics
+        for topic in postprocessing.identify_topic_by_subtopic(postprocessing.topics_to_replace.get(name, name), False)
+    }
+    if len(canonical) != 1 or (positive > 0) == (negative > 0):
+        return None
+
+    sentiment = "positive" if positive else "negative"
+    return [{"topic": name, "sentiment": sentiment} for name in sorted(topics)]
+
+
+# Ожидаемые ответы на характерных отзывах (None — отзыв уходит в модель), в том числе на прежних ошибках словаря.
+# Проверка после правок словаря: python -m app.fast_path
+REGRESSION_CASES = [
+    ("Удобное мобильное приложение", [("Мобильное приложение", "positive")]),
+    ("Долго ждал в отделении", [("Офисное обслуживание", "negative")]),
+    ("Очень долгое одобрение ипотеки", [("Ипотека", "negative")]),
+    ("Ужасный банкомат", [("Банкоматы", "negative")]),
+    ("Классное приложение", [("Мобильное приложение", "positive")]),
+    ("Долгожданная ипотека одобрена", None),
+    ("Быстро списали деньги с вклада", None),
+    ("Быстро одобрили ипотеку", None),
+    ("Классический вклад", None),
+    ("Долг по кредиту", None),
+    ("Приложение удобное, но банкомат сломан", None),
+    ("Удобное приложение, ужасное отделение", None),
+]
+
+
+def check_regressions() -> list:
+    """Отзывы из REGRESSION_CASES, на которых classify отвечает не так, как ожидается"""
+    failures = []
+    for text, expected in REGRESSION_CASES:
+        pairs = classify(text)
+        got = None if pairs is None else [(pair["topic"], pair["sentiment"]) for pair in pairs]
+        if got != expected:
+            failures.append((text, expected, got))
+    return failures
+
+
+if __name__ == "__main__":
+    failures = check_regressions()
+    for text, expected, got in failures:
+        print(f"{text!r}: ожидалось {expected}, получено {got}")
+    print(f"{len(REGRESSION_CASES) - len(failures)} из {len(REGRESSION_CASES)} случаев совпали")
+    raise SystemExit(1 if failures else 0)
@@ -0,0 +1,286 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime
+from typing import Awaitable, Callable, List
+
+from . import models
+from . import database
+from .schemas import ReviewRequestItem
+from .writeback import ReviewWriter
+
+
+ACTIVE_STATUSES = ("pending", "running")
+# failed тоже продолжается при следующем запуске: обычно причина — недоступность vLLM или БД
+RESUMABLE_STATUSES = (*ACTIVE_STATUSES, "failed")
+MAX_ERROR_LENGTH = 2000
+
+logger = logging.getLogger(__name__)
+
+
+class JobManager:
+    """Фоновые задачи разметки больших батчей.
+
+    Состояние задач и результаты по каждому отзыву хранятся в БД, поэтому после
+    перезапуска сервиса незавершенные задачи продолжаются с первого необработанного отзыва.
+    Отзыв, на который модель так и не ответила, получает статус failed и не считается обработанным;
+    задача с такими отзывами или упавшая с ошибкой завершается в статусе failed с текстом ошибки.
+    При следующем запуске (resume) она продолжается, и failed-отзывы размечаются заново.
+    Сами предсказания делает worker (predict_batch поверх process_single_review),
+    блокирующие запросы к БД выполняются в пуле потоков. Для задач с persist разметка чанка
+    пишется в reviews / reviews_topics в той же транзакции, что и результаты задачи.
+    """
+
+    def __init__(
+        self,
+        worker: Callable[[List[ReviewRequestItem]], Awaitable[list]],
+        writer: ReviewWriter | None = None,
+        chunk_size: int = 256,
+        max_running: int = 2,
+        insert_batch_size: int = 5000,
+    ):
+        self.worker = worker
+        self.writer = writer
+        self.chunk_size = chunk_size
+        self.insert_batch_size = insert_batch_size
+        self._running = asyncio.Semaphore(max_running)
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    # --- Работа с БД (синхронная) ---
+
+    def _create_job(self, items: List[ReviewRequestItem], persist: bool) -> str:
+        job_id = uuid.uuid4().hex
+        with database.SessionLocal() as db:
+            db.add(models.PredictionJob(id=job_id, status="pending", total=len(items), processed=0, persist=persist))
+            db.flush()
+            for start in range(0, len(items), self.insert_batch_size):
+                batch = items[start:start + self.insert_batch_size]
+                db.bulk_insert_mappings(models.PredictionJobItem, [
+                    {
+                        "job_id": job_id, "position": start + i, "review_id": item.id, "text": item.text,
+                        "source": item.source, "date": item.date, "rating": item.rating, "status": "pending",
+                    }
+                    for i, item in enumerate(batch)
+                ])
+            db.commit()
+        return job_id
+
+    def _active_job_ids(self) -> list:
+        with database.SessionLocal() as db:
+            rows = db.query(models.PredictionJob.id).filter(
+                models.PredictionJob.status.in_(RESUMABLE_STATUSES)
+            ).order_by(models.PredictionJob.created_at).all()
+        return [r.id for r in rows]
+
+    def _mark_running(self, job_id: str) -> bool | None:
+        """Переводит задачу в running и возвращает ее флаг persist; None, если задача уже отменена или завершена.
+
+        Отзывы, оставшиеся без ответа модели в прошлый раз, возвращаются в очередь.
+        """
+        with database.SessionLocal() as db:
+            updated = db.query(models.PredictionJob).filter(
+                models.PredictionJob.id == job_id,
+                models.PredictionJob.status.in_(RESUMABLE_STATUSES),
+            ).update({"status": "running", "error": None}, synchronize_session=False)
+            if not updated:
+                db.commit()
+                return None
+            db.query(models.PredictionJobItem).filter(
+                models.PredictionJobItem.job_id == job_id,
+                models.PredictionJobItem.status == "failed",
+            ).update({"status": "pending"}, synchronize_session=False)
+            db.commit()
+            return bool(db.get(models.PredictionJob, job_id).persist)
+
+    def _fetch_pending(self, job_id: str) -> list:
+        with database.SessionLocal() as db:
+            return db.query(
+                models.PredictionJobItem.id,
+                models.PredictionJobItem.review_id,
+                models.PredictionJobItem.text,
+                models.PredictionJobItem.source,
+                models.PredictionJobItem.date,
+                models.PredictionJobItem.rating,
+            ).filter(
+                models.PredictionJobItem.job_id == job_id,
+                models.PredictionJobItem.status == "pending",
+            ).order_by(models.PredictionJobItem.position).limit(self.chunk_size).all()
+
+    def _save_results(self, job_id: str, rows: list, items: list, predictions: list, persist: bool):
+        """Результаты чанка, счетчик задачи и (для persist) разметка отзывов пишутся в одной транзакции.
+
+        Отзывы без ответа модели (failed) не считаются обработанными; writer их тоже пропускает.
+        """
+        with database.SessionLocal() as db:
+            if persist:
+                self.writer.write(db, items, predictions)
+            db.bulk_update_mappings(models.PredictionJobItem, [
+                {"id": row.id, "status": "failed", "topics": None, "sentiments": None} if p.get("failed") else
+                {"id": row.id, "status": "done", "topics": p["topics"], "sentiments": p["sentiments"]}
+                for row, p in zip(rows, predictions)
+            ])
+            done = sum(not p.get("failed") for p in predictions)
+            db.query(models.PredictionJob).filter(models.PredictionJob.id == job_id).update(
+                {"processed": models.PredictionJob.processed + done}, synchronize_session=False
+            )
+            db.commit()
+
+    @staticmethod
+    def _failed_items(db, job_id: str) -> int:
+        return db.query(models.PredictionJobItem).filter(
+            models.PredictionJobItem.job_id == job_id,
+            models.PredictionJobItem.status == "failed",
+        ).count()
+
+    def _finish(self, job_id: str):
+        with database.SessionLocal() as db:
+            failed = self._failed_items(db, job_id)
+            values = {"status": "done", "finished_at": datetime.now()}
+            if failed:
+                values.update(status="failed", error=f"Отзывов без ответа модели: {failed}")
+            db.query(models.PredictionJob).filter(
+                models.PredictionJob.id == job_id,
+                models.PredictionJob.status == "running",
+            ).update(values, synchronize_session=False)
+            db.commit()
+
+    def _fail(self, job_id: str, error: str):
+        with database.SessionLocal() as db:
+            db.query(models.PredictionJob).filter(
+                models.PredictionJob.id == job_id,
+                models.PredictionJob.status.in_(ACTIVE_STATUSES),
+            ).update(
+                {"status": "failed", "error": error[:MAX_ERROR_LENGTH], "finished_at": datetime.now()},
+                synchronize_session=False,
+            )
+            db.commit()
+
+    def _cancel(self, job_id: str) -> str | None:
+        with database.SessionLocal() as db:
+            job = db.get(models.PredictionJob, job_id)
+            if job is None:
+                return None
+            if job.status in RESUMABLE_STATUSES:
+                job.status = "cancelled"
+                job.finished_at = datetime.now()
+                db.commit()
+            return job.status
+
+    def _status(self, job_id: str) -> dict | None:
+        with database.SessionLocal() as db:
+            job = db.get(models.PredictionJob, job_id)
+            if job is None:
+                return None
+            return {
+                "job_id": job.id,
+                "status": job.status,
+                "total": job.total,
+                "processed": job.processed,
+                "remaining": job.total - job.processed,
+                "progress": round(job.processed / job.total * 100, 2) if job.total else 100.0,
+                "created_at": job.created_at.isoformat() if job.created_at else None,
+                "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+                "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+                "persist": bool(job.persist),
+                "failed_items": self._failed_items(db, job_id),
+                "error": job.error,
+            }
+
+    def _results(self, job_id: str, offset: int, limit: int) -> dict | None:
+        """Готовые результаты, начиная с позиции offset.
+
+        Отдается непрерывный префикс: выдача останавливается на первом еще не обработанном отзыве,
+        чтобы клиент, идущий по next_offset, ничего не пропустил. Отзывы без ответа модели отдаются
+        с "failed": true — после повторной разметки их результат можно перечитать с прежнего offset.
+        """
+        with database.SessionLocal() as db:
+            if db.get(models.PredictionJob, job_id) is None:
+                return None
+            rows = db.query(
+                models.PredictionJobItem.position,
+                models.PredictionJobItem.review_id,
+                models.PredictionJobItem.status,
+                models.PredictionJobItem.topics,
+                models.PredictionJobItem.sentiments,
+            ).filter(
+                models.PredictionJobItem.job_id == job_id,
+                models.PredictionJobItem.position >= offset,
+            ).order_by(models.PredictionJobItem.position).limit(limit).all()
+
+        predictions = []
+        next_offset = offset
+        for row in rows:
+            if row.status == "failed":
+                predictions.append({"id": row.review_id, "topics": [], "sentiments": [], "failed": True})
+            elif row.status == "done":
+                predictions.append({"id": row.review_id, "topics": row.topics, "sentiments": row.sentiments})
+            else:
+                break
+            next_offset = row.position + 1
+        return {"predictions": predictions, "next_offset": next_offset}
+
+    # --- Исполнение ---
+
+    async def _run(self, job_id: str):
+        try:
+            async with self._running:
+                persist = await database.run_sync(self._mark_running, job_id)
+                if persist is None:
+                    return
+                while True:
+                    rows = await database.run_sync(self._fetch_pending, job_id)
+                    if not rows:
+                        break
+                    items = [
+                        ReviewRequestItem(id=row.review_id, text=row.text, source=row.source, date=row.date, rating=row.rating)
+                        for row in rows
+                    ]
+                    predictions = await self.worker(items)
+                    await database.run_sync(self._save_results, job_id, rows, items, predictions, persist)
+                await database.run_sync(self._finish, job_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("Задача %s остановлена из-за ошибки", job_id)
+            try:
+                await database.run_sync(self._fail, job_id, f"{type(e).__name__}: {e}")
+            except Exception:
+                # БД недоступна: задача останется running и продолжится при следующем запуске
+                logger.exception("Не удалось отметить задачу %s как failed", job_id)
+
+    def _start(self, job_id: str):
+        task = asyncio.create_task(self._run(job_id))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    async def submit(self, items: List[ReviewRequestItem], persist: bool = False) -> dict:
+        job_id = await database.run_sync(self._create_job, items, persist)
+        self._start(job_id)
+        return {"job_id": job_id, "status": "pending", "total": len(items), "persist": persist}
+
+    async def resume(self):
+        """Перезапускает незавершенные задачи (вызывается при старте приложения)"""
+        for job_id in await database.run_sync(self._active_job_ids):
+            if job_id not in self._tasks:
+                logger.info("Продолжаем задачу %s", job_id)
+                self._start(job_id)
+
+    async def cancel(self, job_id: str) -> str | None:
+        status = await database.run_sync(self._cancel, job_id)
+        task = self._tasks.get(job_id)
+        if task is not None:
+            task.cancel()
+        return status
+
+    async def status(self, job_id: str) -> dict | None:
+        return await database.run_sync(self._status, job_id)
+
+    async def results(self, job_id: str, offset: int, limit: int) -> dict | None:
+        return await database.run_sync(self._results, job_id, offset, limit)
+
+    async def shutdown(self):
+        """Останавливает задачи без смены статуса: после рестарта они продолжатся"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -1,45 +1,177 @@
 import os
 import json
-from pydantic import BaseModel
+import time
+import random
+import logging
 from typing import List
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 import traceback
 
 import asyncio
 import aiohttp
+import orjson
+from collections import Counter
+from contextlib import asynccontextmanager
 from dateutil.relativedelta import relativedelta
-from fastapi import FastAPI, Depends
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import func, Date
-from sqlalchemy.orm import Session
-import plotly.graph_objects as go
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Session, selectinload
+from prometheus_client import REGISTRY, CONTENT_TYPE_LATEST, generate_latest
 
 from . import models
 from . import database
 from . import system_prompt
 from . import postprocessing
+from . import chunking
+from . import fast_path
+from . import charts
+from . import analytics
+from . import rollup
+from . import analytics_cache
+from . import columnar
+from . import export
+from .schemas import ReviewRequestItem, PredictRequest
+from .vllm_client import VLLMClient
+from .concurrency import AdaptiveLimiter
+from .prediction_cache import PredictionCache, make_prefix
+from .jobs import JobManager
+from .writeback import ReviewWriter
+from .metrics import PipelineCollector, PARSE_SECONDS, POSTPROCESS_SECONDS, REVIEW_SECONDS
+
+
+logger = logging.getLogger(__name__)
 
 
 # --- КОНФИГУРАЦИЯ vLLM ---
 VLLM_URL = os.getenv("VLLM_URL", "http://localhost:8100/v1/chat/completions")
 MODEL_NAME = "JosephThePatrician/qwen3_0.6b-reviews-fine-tune-v3"
 turn_qwen_thinking_off = ("qwen3" in MODEL_NAME)
-MAX_CONNECTIONS = 100 # Ограничиваем количество одновременных запросов к vLLM
+MAX_CONNECTIONS = int(os.getenv("VLLM_MAX_CONNECTIONS", 100)) # Верхняя граница адаптивного лимита одновременных запросов к vLLM (на весь процесс)
+MIN_CONNECTIONS = int(os.getenv("VLLM_MIN_CONNECTIONS", 4))    # Нижняя граница адаптивного лимита
+INITIAL_CONNECTIONS = int(os.getenv("VLLM_INITIAL_CONNECTIONS", 32)) # Стартовое значение лимита
 MAX_RETRIES = 3       # Количество повторных попыток для каждого отзыва
+SAMPLING_PARAMS = {"temperature": 0.5, "max_tokens": 250}
+VLLM_MAX_MODEL_LEN = int(os.getenv("VLLM_MAX_MODEL_LEN", 4096)) # Должен совпадать с --max-model-len у vLLM
+DISPATCH_ORDER = os.getenv("DISPATCH_ORDER", "long_first")     # Порядок отправки отзывов батча: long_first или fifo
+# Быстрый путь без LLM для коротких однозначных отзывов (app/fast_path.py)
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "0") == "1"
+FAST_PATH_EVAL_RATE = float(os.getenv("FAST_PATH_EVAL_RATE", 0)) # Доля ответов быстрого пути, которые дополнительно сверяются с LLM
+# Guided decoding в vLLM: "" — выключен (парсинг + retry), "json_schema" — через response_format,
+# "guided_json" — через устаревший параметр guided_json (для старых версий vLLM)
+GUIDED_DECODING = os.getenv("VLLM_GUIDED_DECODING", "")
+# Нечеткое сопоставление названий тем, которые модель написала с отклонениями (регистр, кавычки, опечатки)
+FUZZY_TOPICS = os.getenv("FUZZY_TOPICS", "1") == "1"
+
+# Настройки пула соединений к vLLM
+VLLM_POOL_SIZE = int(os.getenv("VLLM_POOL_SIZE", MAX_CONNECTIONS))               # Максимум открытых TCP-соединений
+VLLM_KEEPALIVE_TIMEOUT = float(os.getenv("VLLM_KEEPALIVE_TIMEOUT", 60))          # Сколько секунд держать простаивающее соединение
+VLLM_REQUEST_TIMEOUT = float(os.getenv("VLLM_REQUEST_TIMEOUT", 180))             # Таймаут на весь запрос к vLLM
+VLLM_CONNECT_TIMEOUT = float(os.getenv("VLLM_CONNECT_TIMEOUT", 10))              # Таймаут на установку соединения
+
+# --- КЭШ ПРЕДСКАЗАНИЙ ---
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", 100_000))               # Записей в LRU в памяти
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "reviews-analysis"))  # Каталог кэша на диске (вне исходников)
+PREDICTION_CACHE_PATH = os.getenv("PREDICTION_CACHE_PATH", os.path.join(CACHE_DIR, "prediction_cache.sqlite3")) # Пустая строка отключает кэш на диске
+PREDICTION_CACHE_TTL = float(os.getenv("PREDICTION_CACHE_TTL", 30 * 24 * 3600))        # Время жизни записи на диске, сек
+PREDICTION_CACHE_MAX_ROWS = int(os.getenv("PREDICTION_CACHE_MAX_ROWS", 1_000_000))     # Максимум записей на диске
+
+# --- ФОНОВЫЕ ЗАДАЧИ ---
+JOB_CHUNK_SIZE = int(os.getenv("JOB_CHUNK_SIZE", 256))     # Сколько отзывов задачи обрабатывается и сохраняется за раз
+JOB_MAX_RUNNING = int(os.getenv("JOB_MAX_RUNNING", 2))     # Сколько задач выполняется одновременно
+JOB_RESULTS_MAX_LIMIT = 5000                              # Максимальный размер страницы результатов
+
+# --- ЛЕНТА ОТЗЫВОВ (/api/reviews) ---
+REVIEWS_PAGE_SIZE = int(os.getenv("REVIEWS_PAGE_SIZE", 50))  # Отзывов на странице по умолчанию
+REVIEWS_MAX_PAGE_SIZE = 500                                  # Максимальный размер страницы
+
+# --- КЭШ ОТВЕТОВ АНАЛИТИКИ ---
+ANALYTICS_CACHE_SIZE = int(os.getenv("ANALYTICS_CACHE_SIZE", 1000))                   # Ответов в LRU (0 — без кэша)
+ANALYTICS_CACHE_MAX_BYTES = int(os.getenv("ANALYTICS_CACHE_MAX_BYTES", 64 * 1024 * 1024)) # Суммарный размер ответов
+RESPONSE_COMPRESS_MIN_SIZE = int(os.getenv("RESPONSE_COMPRESS_MIN_SIZE", 1024))          # Ответы меньше этого размера не сжимаются
+
+# --- ДВИЖОК ПАНЕЛЕЙ АНАЛИТИКИ ---
+# "postgres" — дневной агрегат sentiment_daily в основной БД;
+# "duckdb" — колоночная копия фактов в DuckDB (app/columnar.py), догоняет основную БД по журналу изменений
+ANALYTICS_ENGINE = os.getenv("ANALYTICS_ENGINE", "postgres")
+COLUMNAR_PATH = os.getenv("COLUMNAR_PATH", "")  # Файл копии DuckDB; пустая строка — в памяти (файл только при одном воркере)
+
+# --- ВЫГРУЗКА ДАННЫХ (/api/export) ---
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", 10_000))  # Строк, читаемых из БД и кодируемых за раз (группа строк Parquet)
+EXPORT_MAX_RUNNING = int(os.getenv("EXPORT_MAX_RUNNING", 4))     # Одновременных выгрузок (сверх — 429); держать меньше DB_MAX_OVERFLOW
+
+# --- СОХРАНЕНИЕ РАЗМЕТКИ В БД (persist=true) ---
+WRITEBACK_BATCH_SIZE = int(os.getenv("WRITEBACK_BATCH_SIZE", 1000))  # Отзывов в одном пакетном INSERT
 
 
 models.Base.metadata.create_all(bind=database.engine)
+rollup.ensure_built()
+
+
+response_cache = analytics_cache.AnalyticsCache(ANALYTICS_CACHE_SIZE, ANALYTICS_CACHE_MAX_BYTES)
+columnar_store = columnar.ColumnarStore(COLUMNAR_PATH) if ANALYTICS_ENGINE == "duckdb" else None
+
+# Один клиент vLLM на весь процесс: общий пул соединений и общий адаптивный лимит запросов
+vllm_client = VLLMClient(
+    VLLM_URL,
+    AdaptiveLimiter(initial_limit=INITIAL_CONNECTIONS, min_limit=MIN_CONNECTIONS, max_limit=MAX_CONNECTIONS),
+    pool_size=VLLM_POOL_SIZE,
+    keepalive_timeout=VLLM_KEEPALIVE_TIMEOUT,
+    request_timeout=VLLM_REQUEST_TIMEOUT,
+    connect_timeout=VLLM_CONNECT_TIMEOUT,
+)
+
+# Кэш ключуется текстом отзыва + моделью, промптом и параметрами семплирования
+prediction_cache = PredictionCache(
+    make_prefix(MODEL_NAME, system_prompt.SYSTEM_PROMPT, {**SAMPLING_PARAMS, "guided_decoding": GUIDED_DECODING, "fuzzy_topics": FUZZY_TOPICS}),
+    memory_size=PREDICTION_CACHE_SIZE,
+    db_path=PREDICTION_CACHE_PATH or None,
+    ttl_seconds=PREDICTION_CACHE_TTL,
+    max_rows=PREDICTION_CACHE_MAX_ROWS,
+)
+
+
+# Словарь для перевода тональности
+SENTIMENT_MAP = {
+    "positive": "положительно",
+    "negative": "отрицательно",
+    "neutral": "нейтрально",
+}
+
+# Запись разметки в reviews / reviews_topics для /api/predict?persist=true и задач с persist
+review_writer = ReviewWriter(
+    {label: sentiment for sentiment, label in SENTIMENT_MAP.items()},
+    batch_size=WRITEBACK_BATCH_SIZE,
+    journal_reviews=columnar_store is not None,
+)
+
+
+# Задачи используют тот же конвейер, что и /api/predict (кэш, схлопывание дублей, общий лимит vLLM)
+job_manager = JobManager(
+    lambda items: predict_batch(vllm_client, items),
+    writer=review_writer,
+    chunk_size=JOB_CHUNK_SIZE,
+    max_running=JOB_MAX_RUNNING,
+)
 
-def get_db():
-    db = database.SessionLocal()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await vllm_client.start()
+    await job_manager.resume()
+    if columnar_store is not None:
+        # Первая загрузка копии — до первых запросов, а не внутри одного из них
+        await database.run_in_session(columnar_store.sync)
     try:
-        yield db
+        yield
     finally:
-        db.close()
+        await job_manager.shutdown()
+        await vllm_client.close()
+        prediction_cache.close()
 
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 origins = ["http://localhost:3000", "http://localhost:8080"]
 app.add_middleware(
@@ -51,20 +183,34 @@ app.add_middleware(
 )
 
 
-# Словарь для перевода тональности
-SENTIMENT_MAP = {
-    "positive": "положительно",
-    "negative": "отрицательно",
-    "neutral": "нейтрально",
+# Форматы потоковой выдачи /api/predict
+STREAM_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
 }
 
-# Модели для валидации запроса и ответа
-class ReviewRequestItem(BaseModel):
-    id: int
-    text: str
+# Схема ответа для guided decoding строится из допустимых тем postprocessing.topics_subtopics
+RESPONSE_SCHEMA = postprocessing.build_response_schema()
+
+# Бюджет токенов на текст отзыва: контекст модели минус системный промпт, ответ и запас на шаблон чата
+REVIEW_TOKEN_BUDGET = (
+    VLLM_MAX_MODEL_LEN
+    - chunking.estimate_tokens(system_prompt.SYSTEM_PROMPT)
+    - SAMPLING_PARAMS["max_tokens"]
+    - 64
+)
 
-class PredictRequest(BaseModel):
-    data: List[ReviewRequestItem]
+# Счетчики попыток разметки: attempts, retries, request_errors, parse_errors, invalid_structure, successes,
+# empty_fallbacks, chunked_reviews/chunks/partial_results для длинных отзывов,
+# tier_fast_path/tier_cache/tier_llm — каким уровнем обработан отзыв, fast_path_eval_* — сверка быстрого пути с LLM
+predict_stats = Counter()
+# Те же счетчики попыток для запросов сверки быстрого пути: в predict_stats они исказили бы parse_failure_rate
+fast_path_eval_stats = Counter()
+
+REGISTRY.register(PipelineCollector(predict_stats, prediction_cache, vllm_client.limiter, response_cache, columnar_store))
+
+# Фоновые задачи сверки быстрого пути с LLM (держим ссылки, чтобы их не собрал GC)
+_fast_path_eval_tasks = set()
 
 def validate_response_structure(pairs: list) -> bool:
     """Проверяет, что ответ соответствует требуемой структуре"""
@@ -84,87 +230,458 @@ def validate_response_structure(pairs: list) -> bool:
     except Exception:
         return False
 
+def build_payload(text: str) -> dict:
+    payload = {
+        "model": MODEL_NAME,
+        "messages": [
+            {"role": "system", "content": system_prompt.SYSTEM_PROMPT},
+            {"role": "user", "content": text + " /no_think" * turn_qwen_thinking_off}
+        ],
+        **SAMPLING_PARAMS,
+    }
+    if GUIDED_DECODING == "json_schema":
+        payload["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": "topic_sentiment_pairs", "schema": RESPONSE_SCHEMA},
+        }
+    elif GUIDED_DECODING == "guided_json":
+        payload["guided_json"] = RESPONSE_SCHEMA
+    return payload
+
+
+def parse_content(content: str):
+    content = content.replace("<think>\n\n</think>", "").strip()
+    if GUIDED_DECODING:
+        # При guided decoding vLLM гарантирует валидный JSON по схеме
+        return json.loads(content)
+    return json.loads(content.replace("'", "\"")) # Обучали на одинарных кавычках
+
+
+async def request_pairs(client: VLLMClient, text: str, stats: Counter = predict_stats) -> list | None:
+    """Запрашивает у vLLM пары тема/тональность для одного текста с повторными попытками.
+
+    Возвращает провалидированный (но еще не нормализованный) список пар или None, если все попытки провалились.
+    Попытки и ошибки учитываются в stats.
+    """
+    for attempt in range(MAX_RETRIES):
+        stats["attempts"] += 1
+        if attempt > 0:
+            stats["retries"] += 1
+        try:
+            payload = build_payload(text)
+            # Лимит одновременных запросов и таймауты задаются в самом клиенте
+            response_data = await client.chat_completion(payload)
+            if response_data is None:
+                stats["request_errors"] += 1
+            else:
+                content = response_data.get('choices', [{}])[0].get('message', {}).get('content', '')
+                parse_started_at = time.perf_counter()
+                try:
+                    parsed_response = parse_content(content)
+                    is_valid = validate_response_structure(parsed_response)
+                    PARSE_SECONDS.observe(time.perf_counter() - parse_started_at)
+                    if not is_valid:
+                        stats["invalid_structure"] += 1
+                        continue # Невалидная структура, retry
+                    stats["successes"] += 1
+                    return parsed_response
+
+                except (json.JSONDecodeError, TypeError) as e:
+                    # Модель вернула невалидный JSON, попробуем еще раз
+                    PARSE_SECONDS.observe(time.perf_counter() - parse_started_at)
+                    stats["parse_errors"] += 1
+                    logger.debug("Попытка %d провалена: Невалидный JSON - %s", attempt + 1, e)
+        except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+            # Таймаут запроса, попробуем еще раз
+            stats["request_errors"] += 1
+            logger.warning("Попытка %d провалена: Ошибка сети/таймаута - %r", attempt + 1, e)
+        except Exception:
+            # Любая другая ошибка, попробуем еще раз
+            stats["request_errors"] += 1
+            logger.exception("Попытка %d провалена: Неизвестная ошибка", attempt + 1)
+
+        # Если дошли сюда, значит была ошибка, ждем перед повторной попыткой
+        if attempt < MAX_RETRIES - 1:
+            await asyncio.sleep(1)
+    return None
+
+
+def to_prediction(pairs: list, record: bool = True) -> dict:
+    """Нормализует пары через process_pairs и переводит тональности в формат ответа.
+
+    record=False — несопоставленные названия тем не попадают в счетчики (для сверки быстрого пути).
+    """
+    started_at = time.perf_counter()
+    parsed_response = postprocessing.process_pairs(pairs, return_subtopics=False, fuzzy=FUZZY_TOPICS, record=record)
+
+    topics = [item["topic"] for item in parsed_response]
+    sentiments = [SENTIMENT_MAP[item["sentiment"]] for item in parsed_response]
+    POSTPROCESS_SECONDS.observe(time.perf_counter() - started_at)
+    return {"topics": topics, "sentiments": sentiments}
+
+
+async def evaluate_fast_path(client: VLLMClient, text: str, fast_prediction: dict):
+    """Сравнивает ответ быстрого пути с ответом модели на том же тексте (вне счетчиков рабочих запросов)"""
+    pairs = await request_pairs(client, text, fast_path_eval_stats)
+    if pairs is None:
+        return
+    llm_prediction = to_prediction(pairs, record=False)
+    predict_stats["fast_path_eval_samples"] += 1
+    if set(llm_prediction["topics"]) == set(fast_prediction["topics"]):
+        predict_stats["fast_path_eval_topic_agree"] += 1
+    llm_pairs = set(zip(llm_prediction["topics"], llm_prediction["sentiments"]))
+    if llm_pairs == set(zip(fast_prediction["topics"], fast_prediction["sentiments"])):
+        predict_stats["fast_path_eval_exact_agree"] += 1
+    else:
+        logger.info("Быстрый путь разошелся с LLM: %r: %s vs %s", text, fast_prediction, llm_prediction)
+
+
 async def process_single_review(
-    session: aiohttp.ClientSession,
-    semaphore: asyncio.Semaphore,
+    client: VLLMClient,
     review_item: ReviewRequestItem
 ):
     # print("review_item", review_item)
-    async with semaphore:
-        for attempt in range(MAX_RETRIES):
-            try:
-                payload = {
-                    "model": MODEL_NAME,
-                    "messages": [
-                        {"role": "system", "content": system_prompt.SYSTEM_PROMPT},
-                        {"role": "user", "content": review_item.text + " /no_think" * turn_qwen_thinking_off}
-                    ],
-                    "temperature": 0.5,
-                    "max_tokens": 250,
-                }
-                print("payload", payload)
-                async with session.post(VLLM_URL, json=payload, timeout=180) as response: # Добавляем таймаут
-                    if response.status == 200:
-                        response_data = await response.json()
-                        # print("response_data", response_data)
-                        content = response_data.get('choices', [{}])[0].get('message', {}).get('content', '')
-                        # print("content", content)
-                        try:
-                            content = content.replace("<think>\n\n</think>", "").strip()
-                            parsed_response = json.loads(content.replace("'", "\"")) # Обучали на одинарных кавычках
-                            # print("parsed_response", parsed_response)
-                            if not validate_response_structure(parsed_response):
-                                continue # Невалидная структура, retry
-
-                            parsed_response = postprocessing.process_pairs(parsed_response, return_subtopics=False)
-                            # print("parsed_response2", parsed_response)
-
-                            topics = [item["topic"] for item in parsed_response]
-                            # print("topics", topics)
-                            sentiments = [SENTIMENT_MAP[item["sentiment"]] for item in parsed_response]
-                            # print("sentiments", sentiments)
-                            return {"id": review_item.id, "topics": topics, "sentiments": sentiments}
-
-                        except (json.JSONDecodeError, TypeError) as e:
-                            # Модель вернула невалидный JSON, попробуем еще раз
-                            print(f"Попытка {attempt + 1} провалена: Ошибка сети/таймаута - {e}")
-                            # print(traceback.format_exc())
-                            pass
-            except (asyncio.TimeoutError, aiohttp.ClientError) as e:
-                # print(traceback.format_exc())
-                # Таймаут запроса, попробуем еще раз
-                print(f"Попытка {attempt + 1} провалена: Ошибка сети/таймаута - {e}")
-                pass
-            except Exception as e:
-                # Любая другая ошибка, попробуем еще раз
-                print(f"Попытка {attempt + 1} провалена: Неизвестная ошибка - {e}")
-                pass
-            
-            # Если дошли сюда, значит была ошибка, ждем перед повторной попыткой
-            if attempt < MAX_RETRIES - 1:
-                await asyncio.sleep(1)
-
-    # Если все попытки провалились, возвращаем пустой результат для этого отзыва
-    return {"id": review_item.id, "topics": [], "sentiments": []}
+    if FAST_PATH_ENABLED:
+        fast_pairs = fast_path.classify(review_item.text)
+        if fast_pairs is not None:
+            predict_stats["tier_fast_path"] += 1
+            prediction = to_prediction(fast_pairs)
+            if FAST_PATH_EVAL_RATE and random.random() < FAST_PATH_EVAL_RATE:
+                task = asyncio.create_task(evaluate_fast_path(client, review_item.text, prediction))
+                _fast_path_eval_tasks.add(task)
+                task.add_done_callback(_fast_path_eval_tasks.discard)
+            return {"id": review_item.id, **prediction}
+
+    cache_key = prediction_cache.key(review_item.text)
+    cached = await prediction_cache.get(cache_key)
+    if cached is not None:
+        predict_stats["tier_cache"] += 1
+        return {"id": review_item.id, **cached}
+
+    predict_stats["tier_llm"] += 1
+    started_at = time.perf_counter()
+    try:
+        return await predict_with_llm(client, review_item, cache_key, started_at)
+    finally:
+        REVIEW_SECONDS.observe(time.perf_counter() - started_at)
+
+
+async def predict_with_llm(client: VLLMClient, review_item: ReviewRequestItem, cache_key: str, started_at: float):
+    """Разметка отзыва моделью (уровень после быстрого пути и кэша)"""
+    # Отзыв длиннее контекста модели делим на куски, пары из всех кусков сливаем через process_pairs
+    chunks = chunking.split_text(review_item.text, REVIEW_TOKEN_BUDGET)
+    if len(chunks) == 1:
+        chunk_pairs = [await request_pairs(client, review_item.text)]
+    else:
+        predict_stats["chunked_reviews"] += 1
+        predict_stats["chunks"] += len(chunks)
+        chunk_pairs = await asyncio.gather(*(request_pairs(client, chunk) for chunk in chunks))
+
+    failed_chunks = sum(pairs is None for pairs in chunk_pairs)
+    if failed_chunks == len(chunk_pairs):
+        # Если все попытки провалились, возвращаем пустой результат для этого отзыва.
+        # failed отличает его от ответа модели «тем нет»: такой результат не сохраняется в БД (writeback.py)
+        predict_stats["empty_fallbacks"] += 1
+        logger.warning("Отзыв %s: не удалось получить ответ модели, возвращаем пустой результат", review_item.id)
+        return {"id": review_item.id, "topics": [], "sentiments": [], "failed": True}
+
+    pairs = [pair for chunk in chunk_pairs if chunk is not None for pair in chunk]
+    prediction = to_prediction(pairs)
+    if failed_chunks:
+        # Частичный результат не кэшируем: при следующем запросе попробуем получить ответ по всем кускам
+        predict_stats["partial_results"] += 1
+        logger.warning("Отзыв %s: %d из %d кусков без ответа модели, результат частичный", review_item.id, failed_chunks, len(chunks))
+    else:
+        # Кэшируем только успешные ответы, пустой fallback после ошибок не кэшируется
+        await prediction_cache.set(cache_key, prediction, cost_seconds=time.perf_counter() - started_at)
+    return {"id": review_item.id, **prediction}
+
+
+def order_for_dispatch(groups: dict) -> list:
+    """Порядок отправки уникальных отзывов в vLLM.
+
+    long_first: длинные отзывы уходят первыми (LPT-планирование) — самые долгие запросы не остаются
+    в хвосте батча, и хвостовая задержка ограничена временем самого длинного отзыва.
+    """
+    keys = list(groups)
+    if DISPATCH_ORDER == "long_first":
+        keys.sort(key=lambda key: len(groups[key][0].text), reverse=True)
+    return keys
+
+
+def group_duplicates(items: List[ReviewRequestItem]) -> dict:
+    """Группирует отзывы по ключу кэша: {ключ: [отзывы с этим текстом]}, первый отзыв группы уходит в vLLM"""
+    groups = {}
+    for item in items:
+        groups.setdefault(prediction_cache.key(item.text), []).append(item)
+    prediction_cache.deduplicated += len(items) - len(groups)
+    return groups
+
+
+def for_item(item: ReviewRequestItem, result: dict) -> dict:
+    """Результат уникального текста для конкретного отзыва (дубли получают тот же ответ под своим id)"""
+    prediction = {"id": item.id, "topics": result["topics"], "sentiments": result["sentiments"]}
+    if result.get("failed"):
+        prediction["failed"] = True
+    return prediction
+
+
+async def predict_batch(client: VLLMClient, items: List[ReviewRequestItem]) -> list:
+    """Предсказания для батча с сохранением порядка.
+
+    Отзывы с одинаковым (нормализованным) текстом схлопываются до отправки в vLLM:
+    модель вызывается один раз на уникальный текст, результат раздается всем дублям.
+    """
+    groups = group_duplicates(items)
+    keys = order_for_dispatch(groups)
+    results = await asyncio.gather(*(process_single_review(client, groups[key][0]) for key in keys))
+
+    by_id = {}
+    for key, result in zip(keys, results):
+        for item in groups[key]:
+            by_id[id(item)] = for_item(item, result)
+    return [by_id[id(item)] for item in items]
+
+
+async def iter_predictions(client: VLLMClient, items: List[ReviewRequestItem]):
+    """Асинхронный генератор предсказаний в порядке готовности (с тем же схлопыванием дублей)"""
+    groups = group_duplicates(items)
+
+    async def run_group(group):
+        return group, await process_single_review(client, group[0])
+
+    tasks = [asyncio.create_task(run_group(groups[key])) for key in order_for_dispatch(groups)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            group, result = await next_done
+            for item in group:
+                yield for_item(item, result)
+    finally:
+        # Клиент отключился — не тратим GPU на оставшиеся отзывы
+        for task in tasks:
+            task.cancel()
+
+
+async def stream_predictions(client: VLLMClient, items: List[ReviewRequestItem], mode: str, persist: bool = False):
+    """Сериализует iter_predictions в NDJSON или SSE и завершает поток итоговой записью.
+
+    При persist готовые предсказания сохраняются в БД пакетами по WRITEBACK_BATCH_SIZE по ходу потока.
+    """
+    started_at = time.perf_counter()
+    total = 0
+    empty = 0
+    items_by_id = {item.id: item for item in items}
+    pending = []
+    persisted = 0
+    persist_error = None
+    async for prediction in iter_predictions(client, items):
+        total += 1
+        if not prediction["topics"]:
+            empty += 1
+        line = json.dumps(prediction, ensure_ascii=False)
+        yield f"data: {line}\n\n" if mode == "sse" else line + "\n"
+
+        if persist and persist_error is None:
+            pending.append(prediction)
+            if len(pending) >= WRITEBACK_BATCH_SIZE or total == len(items):
+                try:
+                    persisted += await review_writer.persist_async([items_by_id[p["id"]] for p in pending], pending)
+                except Exception as e:
+                    logger.exception("Не удалось сохранить разметку в БД")
+                    persist_error = str(e)
+                pending = []
+
+    summary = {"total": total, "empty": empty, "elapsed_seconds": round(time.perf_counter() - started_at, 3)}
+    if persist:
+        summary["persisted"] = persisted
+        if persist_error is not None:
+            summary["persist_error"] = persist_error
+    summary = json.dumps({"summary": summary}, ensure_ascii=False)
+    yield f"event: summary\ndata: {summary}\n\n" if mode == "sse" else summary + "\n"
 
 
 @app.post("/api/predict")
-async def predict_sentiments(request: PredictRequest):
+async def predict_sentiments(request: PredictRequest, stream: str | None = None, persist: bool = False):
+    """Разметка батча отзывов.
+
+    stream=ndjson или stream=sse отдает каждое предсказание сразу по готовности
+    (в порядке завершения), последняя запись — {"summary": {...}}.
+    persist=true дополнительно сохраняет отзывы и разметку в reviews / reviews_topics.
+    Отзыв, по которому модель так и не ответила, приходит с "failed": true и в БД не сохраняется.
+    """
     # Проверка на пустые данные согласно ТЗ
     # print("request", request)
     if not request.data:
         return JSONResponse(
             status_code=400,
             content={"error": "Пустые данные. 'data' не может быть пустым списком."}
-        )  
-    semaphore = asyncio.Semaphore(MAX_CONNECTIONS)
-    async with aiohttp.ClientSession() as session:
-        tasks = [process_single_review(session, semaphore, item) for item in request.data]
-        predictions = await asyncio.gather(*tasks)
-        
+        )
+    if stream is not None:
+        if stream not in STREAM_MEDIA_TYPES:
+            return JSONResponse(
+                status_code=400,
+                content={"error": f"Неизвестный формат потока '{stream}'. Допустимо: {', '.join(STREAM_MEDIA_TYPES)}."}
+            )
+        return StreamingResponse(
+            stream_predictions(vllm_client, request.data, stream, persist),
+            media_type=STREAM_MEDIA_TYPES[stream],
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},  # Отключаем буферизацию в nginx
+        )
+    predictions = await predict_batch(vllm_client, request.data)
+    if persist:
+        try:
+            await review_writer.persist_async(request.data, predictions)
+        except Exception:
+            # Предсказания уже в кэше, поэтому повтор запроса не будет заново вызывать модель
+            logger.exception("Не удалось сохранить разметку в БД")
+            return JSONResponse(status_code=500, content={"error": "Не удалось сохранить разметку в базу данных."})
     return {"predictions": predictions}
 
 
+@app.post("/api/jobs", status_code=202)
+async def create_prediction_job(request: PredictRequest, persist: bool = False):
+    """Создает фоновую задачу разметки и сразу возвращает ее id.
+
+    persist=true — разметка каждого обработанного чанка сохраняется в reviews / reviews_topics.
+    """
+    if not request.data:
+        return JSONResponse(
+            status_code=400,
+            content={"error": "Пустые данные. 'data' не может быть пустым списком."}
+        )
+    return await job_manager.submit(request.data, persist)
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_prediction_job(job_id: str):
+    """Статус и прогресс задачи"""
+    job = await job_manager.status(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"Задача {job_id} не найдена."})
+    return job
+
+
+@app.get("/api/jobs/{job_id}/results")
+async def get_prediction_job_results(job_id: str, offset: int = 0, limit: int = 1000):
+    """Готовые результаты задачи постранично; следующая страница начинается с next_offset"""
+    limit = max(1, min(limit, JOB_RESULTS_MAX_LIMIT))
+    results = await job_manager.results(job_id, max(offset, 0), limit)
+    if results is None:
+        return JSONResponse(status_code=404, content={"error": f"Задача {job_id} не найдена."})
+    return results
+
+
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_prediction_job(job_id: str):
+    """Отменяет задачу; уже полученные результаты сохраняются"""
+    status = await job_manager.cancel(job_id)
+    if status is None:
+        return JSONResponse(status_code=404, content={"error": f"Задача {job_id} не найдена."})
+    return {"job_id": job_id, "status": status}
+
+
+@app.get("/api/predict/cache_stats")
+async def get_prediction_cache_stats():
+    """Счетчики попаданий/промахов кэша предсказаний"""
+    return prediction_cache.stats()
+
+
+@app.get("/api/predict/stats")
+async def get_prediction_stats():
+    """Счетчики попыток, ретраев и ошибок разбора ответа (для сравнения режимов с guided decoding и без),
+    доли отзывов по уровням обработки, согласие быстрого пути с LLM и несопоставленные названия тем"""
+    attempts = predict_stats["attempts"]
+    handled = sum(predict_stats[f"tier_{tier}"] for tier in ("fast_path", "cache", "llm"))
+    eval_samples = predict_stats["fast_path_eval_samples"]
+    parse_failures = predict_stats["parse_errors"] + predict_stats["invalid_structure"]
+    return {
+        "guided_decoding": GUIDED_DECODING or "off",
+        "attempts": attempts,
+        "retries": predict_stats["retries"],
+        "successes": predict_stats["successes"],
+        "request_errors": predict_stats["request_errors"],
+        "parse_errors": predict_stats["parse_errors"],
+        "invalid_structure": predict_stats["invalid_structure"],
+        "empty_fallbacks": predict_stats["empty_fallbacks"],
+        "chunked_reviews": predict_stats["chunked_reviews"],
+        "chunks": predict_stats["chunks"],
+        "partial_results": predict_stats["partial_results"],
+        "parse_failure_rate": parse_failures / attempts if attempts else 0.0,
+        "tiers": {tier: predict_stats[f"tier_{tier}"] for tier in ("fast_path", "cache", "llm")},
+        "tier_fractions": {
+            tier: predict_stats[f"tier_{tier}"] / handled if handled else 0.0
+            for tier in ("fast_path", "cache", "llm")
+        },
+        "fast_path_eval": {
+            "samples": eval_samples,
+            "topic_agreement": predict_stats["fast_path_eval_topic_agree"] / eval_samples if eval_samples else None,
+            "exact_agreement": predict_stats["fast_path_eval_exact_agree"] / eval_samples if eval_samples else None,
+            "attempts": fast_path_eval_stats["attempts"],
+            "failed_attempts": fast_path_eval_stats["attempts"] - fast_path_eval_stats["successes"],
+        },
+        "writeback": review_writer.stats(),
+        "topics": {
+            "fuzzy": FUZZY_TOPICS,
+            "fuzzy_resolved": postprocessing.topic_resolution_stats["fuzzy_resolved"],
+            "unresolved": postprocessing.topic_resolution_stats["unresolved"],
+            "top_unresolved": postprocessing.unresolved_topics.most_common(20),
+        },
+    }
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Метрики в формате Prometheus: гистограммы стадий конвейера разметки и счетчики попыток/ретраев/кэша"""
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/api/predict/concurrency")
+async def get_prediction_concurrency():
+    """Текущий адаптивный лимит запросов к vLLM, число запросов в работе и очередь"""
+    return vllm_client.limiter.stats()
+
+
+async def cached_json(request: Request, key: tuple, build) -> Response:
+    """JSON-ответ аналитики из кэша или от build() (корутина, возвращающая JSON-байты).
+
+    Поколение данных читается до расчета: если во время расчета придет запись, результат
+    сохранится под старым поколением и будет отброшен при следующем запросе.
+    ETag строится из фильтров и поколения, поэтому 304 отдается без расчета и без обращения к кэшу.
+    Большие ответы сжимаются (br/gzip), сжатый вариант тоже кэшируется.
+    """
+    generation = await database.run_in_session(analytics_cache.current_generation)
+    etag = analytics_cache.make_etag(key, generation)
+    # no-cache: браузер хранит ответ, но перед использованием переспрашивает с If-None-Match
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if analytics_cache.etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    body = response_cache.get(key, generation)
+    if body is None:
+        body = await build()
+        response_cache.set(key, generation, body)
+    encoding = analytics_cache.choose_encoding(request.headers.get("accept-encoding", ""))
+    if encoding and len(body) >= RESPONSE_COMPRESS_MIN_SIZE:
+        compressed = response_cache.get(key + (encoding,), generation, record=False)
+        if compressed is None:
+            compressed = analytics_cache.compress(body, encoding)
+            response_cache.set(key + (encoding,), generation, compressed)
+        body = compressed
+        headers["Content-Encoding"] = encoding
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def panel_engine(db: Session):
+    """Источник данных панелей: модуль analytics (sentiment_daily) или колоночная копия в DuckDB.
+
+    Копия перед запросом догоняет основную БД — ответ не отстает от записанной разметки.
+    """
+    if columnar_store is None:
+        return analytics
+    columnar_store.sync(db)
+    return columnar_store
+
+
 def format_date_label(date_obj, granularity):
     if granularity == 'month':
         months = ["Янв", "Фев", "Мар", "Апр", "Май", "Июн", "Июл", "Авг", "Сен", "Окт", "Ноя", "Дек"]
@@ -174,72 +691,43 @@ def format_date_label(date_obj, granularity):
     return date_obj.strftime('%d.%m.%Y')
 
 
-@app.get("/api/kpi_summary")
-async def get_kpi_summary(
-    products: str | None = None,
-    start_date: date | None = None,
-    end_date: date | None = None,
-    granularity: str = 'month', # Гранулярность нужна для расчета тренда
-    db: Session = Depends(get_db)
-):
-    print('---[ДЕБАГ: Backend Endpoint]---')
-    print(f'Получен start_date: {start_date} (тип: {type(start_date)})')
-    print(f'Получен end_date: {end_date} (тип: {type(end_date)})')
+def trend_periods(end_date: date | None, granularity: str) -> dict:
+    """Периоды для расчета тренда: последний интервал гранулярности (до end_date) и предпоследний (полный).
 
-    topic_list = [p.strip() for p in products.split(',')] if products else None
-
-    # Вспомогательная функция для получения данных за период
-    def get_counts_for_period(period_start, period_end):
-        """Получение данных за период"""
-        if not period_start or not period_end:
-            return {"positive": 0, "neutral": 0, "negative": 0}
-            
-        query = db.query(
-            models.ReviewTopicLink.sentiment,
-            func.count(models.ReviewTopicLink.id)
-        ).join(models.Review)
-
-        if topic_list:
-            query = query.join(models.Topic).filter(models.Topic.name.in_(topic_list))
-        
-        # Явно приводим тип поля в БД к Date для корректного сравнения
-        query = query.filter(func.cast(models.Review.date, Date).between(period_start, period_end))
+    Если end_date не задан, тренды посчитать невозможно — периодов нет.
+    """
+    if not end_date:
+        return {}
+    if granularity == 'day':
+        last_interval_start = end_date
+        previous_interval_start = end_date - timedelta(days=1)
+        previous_interval_end = end_date - timedelta(days=1)
+    elif granularity == 'week':
+        # Начало недели, в которую попадает end_date
+        last_interval_start = end_date - timedelta(days=end_date.weekday())
+        previous_interval_start = last_interval_start - timedelta(weeks=1)
+        previous_interval_end = last_interval_start - timedelta(days=1)
+    else: # month
+        # Начало месяца, в который попадает end_date
+        last_interval_start = end_date.replace(day=1)
+        previous_interval_start = last_interval_start - relativedelta(months=1)
+        previous_interval_end = last_interval_start - timedelta(days=1)
+    return {"last": (last_interval_start, end_date), "previous": (previous_interval_start, previous_interval_end)}
 
-        counts = query.group_by(models.ReviewTopicLink.sentiment).all()
-        result = {"positive": 0, "neutral": 0, "negative": 0}
-        for sentiment, count in counts:
-            result[sentiment.lower()] = count
-        return result
 
-    # 1. Считаем ОСНОВНЫЕ ЗНАЧЕНИЯ за ВЕСЬ выбранный период
-    total_period_counts = get_counts_for_period(start_date, end_date)
-    
-    # 2. Определяем периоды для РАСЧЕТА ТРЕНДА (последний и предпоследний)
-    if end_date:
-        if granularity == 'day':
-            last_interval_start = end_date
-            previous_interval_start = end_date - timedelta(days=1)
-            previous_interval_end = end_date - timedelta(days=1)
-        elif granularity == 'week':
-            # Начало недели, в которую попадает end_date
-            last_interval_start = end_date - timedelta(days=end_date.weekday())
-            previous_interval_start = last_interval_start - timedelta(weeks=1)
-            previous_interval_end = last_interval_start - timedelta(days=1)
-        else: # month
-            # Начало месяца, в который попадает end_date
-            last_interval_start = end_date.replace(day=1)
-            previous_interval_start = last_interval_start - relativedelta(months=1)
-            previous_interval_end = last_interval_start - timedelta(days=1)
-
-        # Данные за последний интервал (с начала последнего периода до end_date)
-        last_interval_counts = get_counts_for_period(last_interval_start, end_date)
-        
-        # Данные за предпоследний интервал (полный предпоследний период)
-        previous_interval_counts = get_counts_for_period(previous_interval_start, previous_interval_end)
-    else:
-        # Если end_date не задан, тренды посчитать невозможно
-        last_interval_counts = {"positive": 0, "neutral": 0, "negative": 0}
-        previous_interval_counts = {"positive": 0, "neutral": 0, "negative": 0}
+def kpi_summary(db: Session, topic_ids: list | None, start_date: date | None, end_date: date | None, granularity: str) -> dict:
+    """KPI за период и тренды по последнему/предпоследнему интервалу.
+
+    Все три периода считаются одним запросом к дневному агрегату (условная агрегация).
+    """
+    # 1. ОСНОВНЫЕ ЗНАЧЕНИЯ считаются за ВЕСЬ выбранный период,
+    # 2. тренд — по последнему и предпоследнему интервалу (без end_date остаются нулевыми)
+    periods = {"total": (start_date, end_date), **trend_periods(end_date, granularity)}
+
+    counts = panel_engine(db).period_counts(db, periods, topic_ids)
+    total_period_counts = counts["total"]
+    last_interval_counts = counts.get("last", analytics.empty_counts())
+    previous_interval_counts = counts.get("previous", analytics.empty_counts())
 
     # 3. Формируем итоговый результат
     kpi_abs = {}
@@ -270,37 +758,66 @@ async def get_kpi_summary(
     return {"kpiAbs": kpi_abs, "kpiPerc": kpi_perc}
 
 
+@app.get("/api/kpi_summary")
+async def get_kpi_summary(
+    request: Request,
+    products: str | None = None,
+    start_date: date | None = None,
+    end_date: date | None = None,
+    granularity: str = 'month', # Гранулярность нужна для расчета тренда
+):
+    print('---[ДЕБАГ: Backend Endpoint]---')
+    print(f'Получен start_date: {start_date} (тип: {type(start_date)})')
+    print(f'Получен end_date: {end_date} (тип: {type(end_date)})')
+
+    async def build():
+        topic_ids = await database.run_in_session(analytics.resolve_topic_ids, analytics.parse_products(products))
+        return orjson.dumps(await database.run_in_session(kpi_summary, topic_ids, start_date, end_date, granularity))
+
+    return await cached_json(request, ("kpi_summary", *analytics_cache.filter_key(products, start_date, end_date, granularity)), build)
+
+
+def key_aspects(
+    db: Session, topic_ids: list | None, start_date: date | None, end_date: date | None, granularity: str = 'month', top_n: int = 5
+) -> list:
+    """Топ тем по позитивным и негативным упоминаниям с трендом — одним запросом.
+
+    Упоминания за период и за интервалы тренда (те же, что у KPI) считаются условной агрегацией,
+    топ по каждой тональности отбирает row_number() в том же запросе.
+    Тренд — изменение числа упоминаний темы в последнем интервале относительно предпоследнего, в %.
+    """
+    periods = trend_periods(end_date, granularity)
+    rows = panel_engine(db).aspect_rows(db, topic_ids, start_date, end_date, periods, top_n)
+
+    aspects = []
+    for sentiment_filter in ("positive", "negative"):
+        top = sorted((r for r in rows if r.sentiment == sentiment_filter), key=lambda r: r.rank)
+        for r in top:
+            last, previous = (r.last, r.previous) if periods else (0, 0)
+            # Без упоминаний в предпоследнем интервале относительный рост не определен
+            trend = round((last - previous) / previous * 100) if previous else 0
+            aspects.append({"aspect": r.aspect, "sentiment": sentiment_filter, "count": r.count, "trend": trend})
+    return aspects
+
+
 @app.get("/api/key_aspects")
 async def get_key_aspects(
+    request: Request,
     products: str | None = None,
     start_date: date | None = None,
     end_date: date | None = None,
-    db: Session = Depends(get_db)
+    granularity: str = 'month', # Гранулярность задает интервалы для тренда, как у KPI
 ):
     """Эндпоинт для таблицы "Ключевые аспекты"""
-    def get_top_aspects(sentiment_filter):
-        query = db.query(
-            models.Topic.name.label("aspect"),
-            func.count(models.ReviewTopicLink.id).label("count")
-        ).select_from(models.ReviewTopicLink).join(models.Topic).join(models.Review)
-        
-        if products:
-            query = query.filter(models.Topic.name.in_([p.strip() for p in products.split(',')]))
-        
-        if start_date and end_date:
-            # Явно приводим тип поля в БД к Date для корректного сравнения
-            query = query.filter(func.cast(models.Review.date, Date).between(start_date, end_date))
-
-        results = query.filter(models.ReviewTopicLink.sentiment.ilike(sentiment_filter)).group_by(models.Topic.name).order_by(func.count(models.ReviewTopicLink.id).desc()).limit(5).all()
-        return [{"aspect": r.aspect, "sentiment": sentiment_filter.lower(), "count": r.count, "trend": 0} for r in results]
+    async def build():
+        topic_ids = await database.run_in_session(analytics.resolve_topic_ids, analytics.parse_products(products))
+        return orjson.dumps(await database.run_in_session(key_aspects, topic_ids, start_date, end_date, granularity))
 
-    positive_aspects = get_top_aspects("positive")
-    negative_aspects = get_top_aspects("negative")
-    return positive_aspects + negative_aspects
+    return await cached_json(request, ("key_aspects", *analytics_cache.filter_key(products, start_date, end_date, granularity)), build)
 
 
 def create_dynamics_data(
-    products: str | None,
+    topic_ids: list | None,
     start_date: date | None,
     end_date: date | None,
     granularity: str,
@@ -313,25 +830,9 @@ def create_dynamics_data(
         sql_trunc_unit = 'week'
     else:
         sql_trunc_unit = 'month'
-        
-    base_query = db.query(models.ReviewTopicLink).join(models.Review)
 
-    if products:
-        topic_list = [p.strip() for p in products.split(',')]
-        base_query = base_query.join(models.Topic).filter(models.Topic.name.in_(topic_list))
-    
-    if start_date and end_date:
-        # Явно приводим тип поля в БД к Date для корректного сравнения
-        base_query = base_query.filter(func.cast(models.Review.date, Date).between(start_date, end_date))
-    
-    group_date_col = func.date_trunc(sql_trunc_unit, models.Review.date).cast(Date).label("group_date")
+    results = panel_engine(db).dynamics_rows(db, topic_ids, start_date, end_date, sql_trunc_unit)
 
-    results = base_query.with_entities(
-        group_date_col,
-        models.ReviewTopicLink.sentiment,
-        func.count(models.ReviewTopicLink.id).label("count")
-    ).group_by("group_date", models.ReviewTopicLink.sentiment).order_by("group_date").all()
-    
     data = {}
     for row in results:
         if row.group_date:
@@ -343,107 +844,239 @@ def create_dynamics_data(
     return data, raw_categories_dates, formatted_categories
 
 
+async def dynamics_data(products: str | None, start_date: date | None, end_date: date | None, granularity: str):
+    topic_ids = await database.run_in_session(analytics.resolve_topic_ids, analytics.parse_products(products))
+    return await database.run_in_session(
+        lambda db: create_dynamics_data(topic_ids, start_date, end_date, granularity, db)
+    )
+
+
 @app.get("/api/dynamics")
 async def get_dynamics_chart_data(
+    request: Request,
     products: str | None = None,
     start_date: date | None = None,
     end_date: date | None = None,
     granularity: str = 'month',
-    db: Session = Depends(get_db)
 ):
     """Эндпоинт для графика долей (%)"""
-    data, raw_categories_dates, formatted_categories = create_dynamics_data(products, start_date, end_date, granularity, db)
-
-    series_data = {s: [] for s in ['positive', 'negative', 'neutral']}
-    for date_key in raw_categories_dates:
-        total = sum(data.get(date_key, {}).values())
-        for sentiment in series_data:
-            count = data.get(date_key, {}).get(sentiment, 0)
-            series_data[sentiment].append((count / total) * 100 if total > 0 else 0)
-            
-    fig = go.Figure()
-    colors = {'positive': '#00875A', 'negative': '#DE350B', 'neutral': '#FFA500'}
-    names = {'positive': 'Позитивные', 'negative': 'Негативные', 'neutral': 'Нейтральные'}
-    sentiments_order = ['positive', 'neutral', 'negative']
-
-    for sentiment in sentiments_order:
-        fig.add_trace(go.Scatter(
-            x=formatted_categories, y=series_data[sentiment], name=names[sentiment],
-            mode='lines', stackgroup='one', line=dict(width=0.5, color=colors[sentiment]),
-            fillcolor=colors[sentiment] # Добавляем цвет заливки
-        ))
-        
-    fig.update_layout(
-        template="plotly_white", yaxis_title="Доля, %",
-        margin=dict(t=10, b=10, l=40, r=10),
-        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
-    )
-    return json.loads(fig.to_json())
+    async def build():
+        data, raw_categories_dates, formatted_categories = await dynamics_data(products, start_date, end_date, granularity)
+        # Отдаем готовые JSON-байты фигуры, без go.Figure -> to_json -> json.loads -> повторной сериализации
+        series_data = charts.share_series(data, raw_categories_dates)
+        return charts.share_chart(formatted_categories, series_data)
+
+    return await cached_json(request, ("dynamics", *analytics_cache.filter_key(products, start_date, end_date, granularity)), build)
 
 
 @app.get("/api/dynamics_stacked_bar")
 async def get_dynamics_stacked_bar(
+    request: Request,
     products: str | None = None,
     start_date: date | None = None,
     end_date: date | None = None,
     granularity: str = 'month',
-    db: Session = Depends(get_db)
 ):
     """Эндпоинт для графика количества (stacked bar)"""
-    data, raw_categories_dates, formatted_categories = create_dynamics_data(products, start_date, end_date, granularity, db)
-        
-    fig = go.Figure()
-    sentiments_order = ['positive', 'neutral', 'negative']
-    colors = {'positive': '#00875A', 'negative': '#DE350B', 'neutral': '#FFA500'}
-    names = {'positive': 'Позитивные', 'negative': 'Негативные', 'neutral': 'Нейтральные'}
-
-    for sentiment in sentiments_order:
-        counts = [data.get(date_key, {}).get(sentiment, 0) for date_key in raw_categories_dates]
-        fig.add_trace(go.Bar(
-            name=names[sentiment], x=formatted_categories, y=counts,
-            marker_color=colors[sentiment]
-        ))
-
-    fig.update_layout(
-        barmode='stack', template="plotly_white", yaxis_title="Количество отзывов",
-        margin=dict(t=10, b=10, l=40, r=10),
-        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
-    )
-    return json.loads(fig.to_json())
+    async def build():
+        data, raw_categories_dates, formatted_categories = await dynamics_data(products, start_date, end_date, granularity)
+        series_counts = charts.count_series(data, raw_categories_dates)
+        return charts.count_chart(formatted_categories, series_counts)
+
+    return await cached_json(request, ("dynamics_stacked_bar", *analytics_cache.filter_key(products, start_date, end_date, granularity)), build)
+
+
+def latest_reviews(
+    db: Session, topic_ids: list | None, start_date: date | None, end_date: date | None,
+    cursor: tuple | None = None, limit: int = REVIEWS_PAGE_SIZE, q: str | None = None
+) -> dict:
+    """Страница ленты отзывов (от новых к старым) с учетом фильтров.
+
+    Keyset-пагинация по (date, id): следующая страница продолжает индекс ix_reviews_date_id с курсора,
+    поэтому стоит одинаково на любой глубине. Фильтр по темам — EXISTS по связям отзыва, без выгрузки id.
+    Связи и темы страницы загружаются одним дополнительным запросом, а не по отзыву.
+    С поисковым запросом q отзывы отбираются по GIN-индексу search_vector и сортируются по релевантности
+    (курсор — (релевантность, id)), к ним добавляются rank и snippet с подсвеченными совпадениями.
+    """
+    if q:
+        sort_key = analytics.search_rank(q)
+        query = db.query(models.Review, sort_key.label("sort_key")).filter(analytics.search_condition(q))
+    else:
+        sort_key = models.Review.date
+        query = db.query(models.Review, sort_key.label("sort_key")).filter(models.Review.date.is_not(None))
+    query = query.options(selectinload(models.Review.topics).joinedload(models.ReviewTopicLink.topic))
+    if topic_ids is not None:
+        query = query.filter(analytics.has_topics(topic_ids))
+    if start_date and end_date:
+        query = query.filter(analytics.period_condition(start_date, end_date))
+    if cursor:
+        query = query.filter(tuple_(sort_key, models.Review.id) < tuple_(*cursor))
+
+    # Лишняя строка показывает, есть ли следующая страница
+    rows = query.order_by(sort_key.desc(), models.Review.id.desc()).limit(limit + 1).all()
+    page = rows[:limit]
+    snippets = analytics.search_snippets(db, q, [r.id for r, _ in page]) if q else {}
+
+    items = []
+    for r, rank in page:
+        item = {"id": r.id, "product": r.source_topic, "text": r.review_text, "sentiment": r.topics[0].sentiment if r.topics else "N/A", "cluster": ", ".join([link.topic.name for link in r.topics]), "date": r.date.isoformat() if r.date else None}
+        if q:
+            item["rank"] = rank
+            item["snippet"] = snippets.get(r.id, "")
+        items.append(item)
+    return {
+        "items": items,
+        "nextCursor": analytics.encode_cursor(page[-1].sort_key, page[-1][0].id) if len(rows) > limit else None,
+    }
+
+
+def normalize_search(q: str | None) -> str | None:
+    """Поисковый запрос без лишних пробелов; пустой — None"""
+    q = " ".join(q.split()) if q else ""
+    return q or None
 
 
 @app.get("/api/reviews")
 async def get_reviews(
+    request: Request,
     products: str | None = None,
     start_date: date | None = None,
     end_date: date | None = None,
-    db: Session = Depends(get_db)
+    q: str | None = None, # Полнотекстовый поиск по тексту отзыва
+    cursor: str | None = None, # nextCursor предыдущей страницы
+    limit: int = REVIEWS_PAGE_SIZE,
 ):
-    """Эндпоинт для списка отзывов"""
-    base_query = db.query(models.Review)
-    if products:
-        topic_list = [p.strip() for p in products.split(',')]
-        review_ids_query = db.query(models.ReviewTopicLink.review_id).join(models.Topic).filter(models.Topic.name.in_(topic_list))
-        review_ids = [r.review_id for r in review_ids_query.distinct().all()]
-        base_query = base_query.filter(models.Review.id.in_(review_ids))
+    """Эндпоинт для списка отзывов (постранично, с поиском)"""
+    q = normalize_search(q)
+    if q and not await database.run_in_session(analytics.search_available):
+        return JSONResponse(
+            status_code=400,
+            content={"error": "Полнотекстовый поиск недоступен: нужен PostgreSQL с примененными миграциями (python -m app.migrate)."},
+        )
+    position = None
+    if cursor:
+        position = analytics.decode_cursor(cursor, float if q else datetime.fromisoformat)
+        if position is None:
+            return JSONResponse(status_code=400, content={"error": "Некорректный курсор страницы."})
+    limit = max(1, min(limit, REVIEWS_MAX_PAGE_SIZE))
 
-    if start_date and end_date:
-        # Явно приводим тип поля в БД к Date для корректного сравнения
-        base_query = base_query.filter(func.cast(models.Review.date, Date).between(start_date, end_date))
+    async def build():
+        topic_ids = await database.run_in_session(analytics.resolve_topic_ids, analytics.parse_products(products))
+        return orjson.dumps(await database.run_in_session(latest_reviews, topic_ids, start_date, end_date, position, limit, q))
 
-    latest_reviews = base_query.order_by(models.Review.date.desc()).limit(50).all()
-    return [{"id": r.id, "product": r.source_topic, "text": r.review_text, "sentiment": r.topics[0].sentiment if r.topics else "N/A", "cluster": ", ".join([link.topic.name for link in r.topics]), "date": r.date.isoformat() if r.date else None} for r in latest_reviews]
+    return await cached_json(request, ("reviews", *analytics_cache.filter_key(products, start_date, end_date), q, position, limit), build)
 
 
-@app.get("/api/products_list")
-async def get_products_list(db: Session = Depends(get_db)):
-    """Эндпоинт для списка продуктов"""
+@app.get("/api/dashboard")
+async def get_dashboard(
+    request: Request,
+    products: str | None = None,
+    start_date: date | None = None,
+    end_date: date | None = None,
+    granularity: str = 'month',
+):
+    """Все панели дашборда одним ответом.
+
+    Фильтр по продуктам разбирается и переводится в id тем один раз, панели считаются
+    параллельно в пуле потоков БД (у каждой своя сессия), графики строятся по одним данным динамики.
+    """
+    async def build():
+        topic_ids = await database.run_in_session(analytics.resolve_topic_ids, analytics.parse_products(products))
+
+        kpi, aspects, dynamics, reviews = await asyncio.gather(
+            database.run_in_session(kpi_summary, topic_ids, start_date, end_date, granularity),
+            database.run_in_session(key_aspects, topic_ids, start_date, end_date, granularity),
+            database.run_in_session(lambda db: create_dynamics_data(topic_ids, start_date, end_date, granularity, db)),
+            database.run_in_session(latest_reviews, topic_ids, start_date, end_date),
+        )
+
+        data, raw_categories_dates, formatted_categories = dynamics
+        return charts.embed(
+            {**kpi, "keyAspects": aspects, "reviews": reviews},
+            dynamics=charts.share_chart(formatted_categories, charts.share_series(data, raw_categories_dates)),
+            dynamicsStackedBar=charts.count_chart(formatted_categories, charts.count_series(data, raw_categories_dates)),
+        )
+
+    return await cached_json(request, ("dashboard", *analytics_cache.filter_key(products, start_date, end_date, granularity)), build)
+
+
+# Выгрузка держит соединение из пула БД все время скачивания, поэтому их число ограничено
+export_slots = asyncio.Semaphore(EXPORT_MAX_RUNNING)
+
+
+class ExportResponse(StreamingResponse):
+    """Потоковый ответ, который освобождает слот выгрузки по окончании отправки — в том числе при обрыве"""
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            export_slots.release()
+
+
+async def export_response(kind: str, format: str, products: str | None, start_date: date | None, end_date: date | None):
+    """Потоковый ответ выгрузки: порции читаются и кодируются в пуле потоков БД по мере отправки клиенту"""
+    if format not in export.ENCODERS:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"Неизвестный формат выгрузки '{format}'. Допустимо: {', '.join(export.ENCODERS)}."}
+        )
+    if format not in export.available_formats():
+        return JSONResponse(status_code=400, content={"error": "Выгрузка в Parquet недоступна: не установлен пакет pyarrow."})
+    topic_ids = await database.run_in_session(analytics.resolve_topic_ids, analytics.parse_products(products))
+    # Без ожидания: клиент с долгой загрузкой не должен занимать соединения, пока стоит в очереди
+    if export_slots.locked():
+        return JSONResponse(
+            status_code=429,
+            content={"error": f"Достигнут лимит одновременных выгрузок ({EXPORT_MAX_RUNNING}). Повторите запрос позже."}
+        )
+    await export_slots.acquire()
+    return ExportResponse(
+        database.iterate_sync(export.export_chunks(kind, format, topic_ids, start_date, end_date, EXPORT_CHUNK_SIZE)),
+        media_type=export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{kind}.{format}"', "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/export/reviews")
+async def export_reviews(
+    products: str | None = None,
+    start_date: date | None = None,
+    end_date: date | None = None,
+    format: str = "csv", # csv или parquet
+):
+    """Выгрузка отзывов с темами и тональностями (строка на отзыв) с фильтрами дашборда"""
+    return await export_response("reviews", format, products, start_date, end_date)
+
+
+@app.get("/api/export/links")
+async def export_links(
+    products: str | None = None,
+    start_date: date | None = None,
+    end_date: date | None = None,
+    format: str = "csv", # csv или parquet
+):
+    """Выгрузка связей отзыв-тема с тональностью (строка на связь) с фильтрами дашборда"""
+    return await export_response("links", format, products, start_date, end_date)
+
+
+def products_list(db: Session) -> list:
     topics_query = db.query(models.Topic.name).distinct().order_by(models.Topic.name)
     return [t.name for t in topics_query.all()]
 
-@app.get("/api/sources_list")
-async def get_sources_list(db: Session = Depends(get_db)):
-    """Эндпоинт для списка источников отзывов."""
+
+def sources_list(db: Session) -> list:
     sources_query = db.query(models.Review.source).distinct().order_by(models.Review.source)
     # Возвращаем только непустые значения
-    return [s.source for s in sources_query.all() if s.source]
\ No newline at end of file
+    return [s.source for s in sources_query.all() if s.source]
+
+
+@app.get("/api/products_list")
+async def get_products_list():
+    """Эндпоинт для списка продуктов"""
+    return await database.run_in_session(products_list)
+
+@app.get("/api/sources_list")
+async def get_sources_list():
+    """Эндпоинт для списка источников отзывов."""
+    return await database.run_in_session(sources_list)
\ No newline at end of file
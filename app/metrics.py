@@ -0,0 +1,135 @@
+from prometheus_client import Histogram
+
+from . import postprocessing
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+
+# --- Гистограммы по стадиям обработки отзыва ---
+# Счетчики горячего пути живут в обычном Counter (predict_stats в main.py) и отдаются
+# через PipelineCollector в момент скрейпа — на каждом отзыве это одно сложение в словаре.
+
+LIMITER_WAIT_SECONDS = Histogram(
+    "predict_limiter_wait_seconds",
+    "Ожидание слота адаптивного лимитера перед запросом к vLLM",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+VLLM_REQUEST_SECONDS = Histogram(
+    "predict_vllm_request_seconds",
+    "Время запроса к vLLM (отправка запроса и чтение ответа)",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 60, 180),
+)
+PARSE_SECONDS = Histogram(
+    "predict_parse_seconds",
+    "Разбор JSON ответа модели и проверка структуры",
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01),
+)
+POSTPROCESS_SECONDS = Histogram(
+    "predict_postprocess_seconds",
+    "Нормализация пар через process_pairs",
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01),
+)
+REVIEW_SECONDS = Histogram(
+    "predict_review_seconds",
+    "Полное время обработки одного уникального отзыва (с ретраями и кусками длинных отзывов)",
+    buckets=(0.001, 0.01, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 180, 600),
+)
+
+
+class PipelineCollector:
+    """Отдает счетчики конвейера разметки, кэшей и лимитера в формате Prometheus в момент скрейпа"""
+
+    def __init__(self, predict_stats, prediction_cache, limiter, analytics_cache=None, columnar_store=None):
+        self.predict_stats = predict_stats
+        self.prediction_cache = prediction_cache
+        self.limiter = limiter
+        self.analytics_cache = analytics_cache
+        self.columnar_store = columnar_store
+
+    def collect(self):
+        stats = self.predict_stats
+
+        yield CounterMetricFamily("predict_attempts", "Попытки запроса к vLLM", value=stats["attempts"])
+        yield CounterMetricFamily("predict_retries", "Повторные попытки", value=stats["retries"])
+        yield CounterMetricFamily("predict_successes", "Попытки с валидным ответом модели", value=stats["successes"])
+
+        failures = CounterMetricFamily("predict_failed_attempts", "Неудачные попытки по причинам", labels=["cause"])
+        for cause, key in (
+            ("request_error", "request_errors"),
+            ("parse_error", "parse_errors"),
+            ("invalid_structure", "invalid_structure"),
+        ):
+            failures.add_metric([cause], stats[key])
+        yield failures
+
+        yield CounterMetricFamily(
+            "predict_empty_fallbacks", "Отзывы, для которых все попытки провалились", value=stats["empty_fallbacks"]
+        )
+        yield CounterMetricFamily("predict_chunked_reviews", "Длинные отзывы, разбитые на куски", value=stats["chunked_reviews"])
+        yield CounterMetricFamily("predict_chunks", "Куски длинных отзывов", value=stats["chunks"])
+        yield CounterMetricFamily(
+            "predict_partial_results", "Отзывы, где часть кусков осталась без ответа", value=stats["partial_results"]
+        )
+
+        tiers = CounterMetricFamily("predict_reviews", "Отзывы по уровню обработки", labels=["tier"])
+        for tier in ("fast_path", "cache", "llm"):
+            tiers.add_metric([tier], stats[f"tier_{tier}"])
+        yield tiers
+
+        fast_path_eval = CounterMetricFamily(
+            "predict_fast_path_eval", "Сверка быстрого пути с LLM", labels=["outcome"]
+        )
+        fast_path_eval.add_metric(["sampled"], stats["fast_path_eval_samples"])
+        fast_path_eval.add_metric(["topic_agree"], stats["fast_path_eval_topic_agree"])
+        fast_path_eval.add_metric(["exact_agree"], stats["fast_path_eval_exact_agree"])
+        yield fast_path_eval
+
+        topic_names = CounterMetricFamily(
+            "predict_topic_names", "Названия тем от модели, не совпавшие с каноническими", labels=["outcome"]
+        )
+        topic_names.add_metric(["fuzzy_resolved"], postprocessing.topic_resolution_stats["fuzzy_resolved"])
+        topic_names.add_metric(["unresolved"], postprocessing.topic_resolution_stats["unresolved"])
+        yield topic_names
+
+        cache = self.prediction_cache.stats()
+        hits = CounterMetricFamily("prediction_cache_hits", "Попадания в кэш предсказаний", labels=["tier"])
+        hits.add_metric(["memory"], cache["hits_memory"])
+        hits.add_metric(["persistent"], cache["hits_persistent"])
+        yield hits
+        yield CounterMetricFamily("prediction_cache_misses", "Промахи кэша предсказаний", value=cache["misses"])
+        yield CounterMetricFamily(
+            "prediction_cache_deduplicated", "Дубли внутри батча, схлопнутые до отправки", value=cache["deduplicated"]
+        )
+        yield GaugeMetricFamily("prediction_cache_memory_entries", "Записей в LRU в памяти", value=cache["memory_entries"])
+        yield GaugeMetricFamily(
+            "prediction_cache_saved_llm_seconds", "Оценка сэкономленного времени LLM", value=cache["saved_llm_seconds_estimate"]
+        )
+
+        limiter = self.limiter.stats()
+        yield GaugeMetricFamily("vllm_concurrency_limit", "Текущий адаптивный лимит запросов к vLLM", value=limiter["limit"])
+        yield GaugeMetricFamily("vllm_in_flight", "Запросы к vLLM в работе", value=limiter["in_flight"])
+        yield GaugeMetricFamily("vllm_backlog", "Запросы, ожидающие слота лимитера", value=limiter["backlog"])
+        yield CounterMetricFamily("vllm_overloads", "Таймауты и ответы 429/5xx от vLLM", value=limiter["overloads"])
+
+        if self.analytics_cache is not None:
+            cache = self.analytics_cache.stats()
+            yield CounterMetricFamily("analytics_cache_hits", "Ответы аналитики из кэша", value=cache["hits"])
+            yield CounterMetricFamily("analytics_cache_misses", "Ответы аналитики, посчитанные заново", value=cache["misses"])
+            yield CounterMetricFamily(
+                "analytics_cache_invalidations", "Сбросы кэша аналитики из-за новых данных", value=cache["invalidations"]
+            )
+            yield CounterMetricFamily("analytics_cache_evictions", "Вытеснения из LRU кэша аналитики", value=cache["evictions"])
+            yield GaugeMetricFamily("analytics_cache_entries", "Ответов в кэше аналитики", value=cache["entries"])
+            yield GaugeMetricFamily("analytics_cache_bytes", "Размер ответов в кэше аналитики", value=cache["bytes"])
+
+        if self.columnar_store is not None:
+            store = self.columnar_store.stats()
+            yield GaugeMetricFamily("columnar_facts", "Строк фактов в колоночной копии DuckDB", value=store["facts"])
+            yield GaugeMetricFamily("columnar_generation", "Поколение данных, до которого синхронизирована копия", value=store["generation"])
+            yield CounterMetricFamily("columnar_full_loads", "Полные перезагрузки колоночной копии", value=store["full_loads"])
+            yield CounterMetricFamily(
+                "columnar_incremental_loads", "Инкрементальные синхронизации колоночной копии", value=store["incremental_loads"]
+            )
+            yield CounterMetricFamily(
+                "columnar_refreshed_reviews", "Отзывы, перечитанные при инкрементальной синхронизации", value=store["refreshed_reviews"]
+            )
+            yield GaugeMetricFamily("columnar_last_load_seconds", "Длительность последней синхронизации, сек", value=store["last_load_seconds"])
@@ -0,0 +1,76 @@
+from datetime import datetime
+
+from sqlalchemy import text
+
+from .database import engine
+from . import models
+
+
+# Миграции для уже развернутой базы: create_all создает таблицы и индексы только с нуля,
+# а существующие таблицы не трогает. Каждая миграция — список идемпотентных SQL-команд,
+# примененные миграции записываются в schema_migrations и повторно не выполняются.
+#
+# Запуск (после seed_db или на существующей базе):
+#     python -m app.migrate
+
+# {concurrently} в PostgreSQL строит индекс без блокировки записи в таблицу.
+# Третий элемент — диалект, для которого нужна миграция (None — для всех).
+MIGRATIONS = [
+    (
+        "001_analytics_indexes",
+        [
+            # Фильтр по периоду + keyset-пагинация ленты отзывов по (date, id)
+            "CREATE INDEX {concurrently} IF NOT EXISTS ix_reviews_date_id ON reviews (date, id)",
+            # Связи отзыва: join по review_id без чтения таблицы (sentiment и topic_id уже в индексе)
+            "CREATE INDEX {concurrently} IF NOT EXISTS ix_reviews_topics_review_topic_sentiment "
+            "ON reviews_topics (review_id, topic_id, sentiment)",
+            # Фильтр по темам и группировка по теме/тональности (ключевые аспекты)
+            "CREATE INDEX {concurrently} IF NOT EXISTS ix_reviews_topics_topic_sentiment_review "
+            "ON reviews_topics (topic_id, sentiment, review_id)",
+            "ANALYZE reviews",
+            "ANALYZE reviews_topics",
+        ],
+        None,
+    ),
+    (
+        "002_reviews_search",
+        # Добавление хранимой колонки переписывает таблицу reviews: на большой базе — в окно обслуживания
+        [*models.REVIEW_SEARCH_DDL, "ANALYZE reviews"],
+        "postgresql",
+    ),
+    (
+        "003_prediction_jobs_error",
+        # В SQLite нет ADD COLUMN IF NOT EXISTS: локальную базу проще пересоздать через seed_db
+        ["ALTER TABLE prediction_jobs ADD COLUMN IF NOT EXISTS error TEXT"],
+        "postgresql",
+    ),
+]
+
+
+def applied_migrations(connection) -> set:
+    connection.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations (name VARCHAR(255) PRIMARY KEY, applied_at TIMESTAMP)"
+    ))
+    return {row.name for row in connection.execute(text("SELECT name FROM schema_migrations"))}
+
+
+def migrate():
+    is_postgres = engine.dialect.name == "postgresql"
+    # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        applied = applied_migrations(connection)
+        for name, statements, dialect in MIGRATIONS:
+            if name in applied or dialect not in (None, engine.dialect.name):
+                continue
+            print(f"Применяем миграцию {name}...")
+            for statement in statements:
+                connection.execute(text(statement.format(concurrently="CONCURRENTLY" if is_postgres else "")))
+            connection.execute(
+                text("INSERT INTO schema_migrations (name, applied_at) VALUES (:name, :applied_at)"),
+                {"name": name, "applied_at": datetime.now()},
+            )
+        print("Миграции применены.")
+
+
+if __name__ == "__main__":
+    migrate()
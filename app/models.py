@@ -1,9 +1,13 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Float
+from sqlalchemy import Column, Integer, String, Date, DateTime, Text, ForeignKey, Float, Boolean, JSON, Index, DDL, event, func
 from sqlalchemy.orm import relationship
 from .database import Base
 
 class Review(Base):
     __tablename__ = "reviews"
+    __table_args__ = (
+        # Индексы аналитических запросов; для существующей базы их создает app/migrate.py
+        Index("ix_reviews_date_id", "date", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     site_specific_id = Column(Integer)
@@ -14,7 +18,21 @@ class Review(Base):
     source_topic = Column(String(255), nullable=True)
     source_subtopic = Column(String(255), nullable=True)
     
-    topics = relationship("ReviewTopicLink", back_populates="review")
+    topics = relationship("ReviewTopicLink", back_populates="review", order_by="ReviewTopicLink.id")
+
+
+# Полнотекстовый поиск по отзывам (только PostgreSQL): хранимый tsvector с русской конфигурацией и GIN-индекс.
+# В модели колонки нет (в SQLite ее не создать): новой таблице ее добавляет after_create,
+# существующей — миграция 002_reviews_search в app/migrate.py.
+REVIEW_SEARCH_DDL = [
+    "ALTER TABLE reviews ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('russian', coalesce(review_text, ''))) STORED",
+    "CREATE INDEX {concurrently} IF NOT EXISTS ix_reviews_search_vector ON reviews USING gin (search_vector)",
+]
+for _statement in REVIEW_SEARCH_DDL:
+    event.listen(
+        Review.__table__, "after_create", DDL(_statement.format(concurrently="")).execute_if(dialect="postgresql")
+    )
 
 class Topic(Base):
     __tablename__ = "topics"
@@ -27,6 +45,10 @@ class Topic(Base):
 
 class ReviewTopicLink(Base):
     __tablename__ = "reviews_topics"
+    __table_args__ = (
+        Index("ix_reviews_topics_review_topic_sentiment", "review_id", "topic_id", "sentiment"),
+        Index("ix_reviews_topics_topic_sentiment_review", "topic_id", "sentiment", "review_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     review_id = Column(Integer, ForeignKey("reviews.id"))
@@ -34,4 +56,86 @@ class ReviewTopicLink(Base):
     sentiment = Column(String(50), index=True)
 
     review = relationship("Review", back_populates="topics")
-    topic = relationship("Topic", back_populates="reviews")
\ No newline at end of file
+    topic = relationship("Topic", back_populates="reviews")
+
+
+class SentimentDaily(Base):
+    """Дневной агрегат связей отзыв-тема: день x тема x тональность x источник.
+
+    Аналитические эндпоинты читают его вместо join reviews_topics с reviews.
+    Поддерживается app/writeback.py, пересчитывается целиком командой python -m app.rollup.
+    """
+    __tablename__ = "sentiment_daily"
+    __table_args__ = (
+        Index("ix_sentiment_daily_topic_day", "topic_id", "day"),
+    )
+
+    day = Column(Date, primary_key=True)
+    topic_id = Column(Integer, primary_key=True)
+    sentiment = Column(String(50), primary_key=True)
+    source = Column(String(255), primary_key=True, default="")  # Пустая строка вместо NULL: колонка входит в ключ
+    count = Column(Integer, nullable=False, default=0)
+
+
+class DataVersion(Base):
+    """Поколение аналитических данных: одна строка, generation растет при каждой записи отзывов и связей.
+
+    Увеличивается в той же транзакции, что и запись, поэтому новое значение видно только вместе с данными.
+    По нему сбрасывается кэш ответов аналитики (app/analytics_cache.py).
+    """
+    __tablename__ = "data_version"
+
+    id = Column(Integer, primary_key=True)
+    generation = Column(Integer, nullable=False, default=0)
+
+
+class DataChange(Base):
+    """Журнал изменений по поколениям: какие отзывы записаны в поколении generation.
+
+    review_id = NULL — массовая перезагрузка (seed_db, пересчет агрегата), копии данных строятся заново.
+    По журналу колоночный снимок (app/columnar.py) обновляется инкрементально.
+    """
+    __tablename__ = "data_changes"
+
+    id = Column(Integer, primary_key=True)
+    generation = Column(Integer, nullable=False, index=True)
+    review_id = Column(Integer, nullable=True)
+
+
+class PredictionJob(Base):
+    """Фоновая задача на разметку большого батча отзывов"""
+    __tablename__ = "prediction_jobs"
+
+    id = Column(String(32), primary_key=True)
+    status = Column(String(20), index=True)  # pending / running / done / cancelled / failed
+    total = Column(Integer, default=0)
+    processed = Column(Integer, default=0)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+    finished_at = Column(DateTime, nullable=True)
+    persist = Column(Boolean, default=False)  # Сохранять разметку в reviews / reviews_topics
+    error = Column(Text, nullable=True)  # Причина остановки задачи в статусе failed
+
+    items = relationship("PredictionJobItem", back_populates="job")
+
+class PredictionJobItem(Base):
+    """Отзыв внутри задачи вместе с результатом разметки"""
+    __tablename__ = "prediction_job_items"
+    __table_args__ = (
+        Index("ix_prediction_job_items_job_status", "job_id", "status"),
+        Index("ix_prediction_job_items_job_position", "job_id", "position"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    job_id = Column(String(32), ForeignKey("prediction_jobs.id", ondelete="CASCADE"))
+    position = Column(Integer)  # Порядковый номер отзыва в исходном батче
+    review_id = Column(Integer)  # id, переданный клиентом
+    text = Column(Text)
+    source = Column(String(255), nullable=True)
+    date = Column(DateTime, nullable=True)
+    rating = Column(Float, nullable=True)
+    status = Column(String(20))  # pending / done / failed (модель не ответила, повтор при следующем запуске)
+    topics = Column(JSON, nullable=True)
+    sentiments = Column(JSON, nullable=True)
+
+    job = relationship("PredictionJob", back_populates="items")
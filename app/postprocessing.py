@@ -1,3 +1,9 @@
+import re
+import difflib
+import unicodedata
+from collections import Counter
+
+
 topics_to_replace = {
     "Обслуживание в банкоматах" : "Банкоматы",
     "Обслуживание в банкомате" : "Банкоматы",
@@ -127,8 +133,30 @@ for topic in topics_subtopics:
 topics_subtopics_flatten_set = set(topics_subtopics_flatten)
 
 
+def build_response_schema():
+    """JSON-схема ответа модели для guided decoding в vLLM.
 
-def identify_topic_by_subtopic(selected_topic, return_if_subtopic=True):
+    Тема ограничена списком допустимых тем/подтем и известными синонимами из topics_to_replace,
+    которые дальше нормализует process_pairs, тональность — тремя значениями.
+    """
+    allowed_topics = list(dict.fromkeys(topics_subtopics_flatten + list(topics_to_replace)))
+    return {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {
+                "topic": {"type": "string", "enum": allowed_topics},
+                "sentiment": {"type": "string", "enum": ["positive", "negative", "neutral"]},
+            },
+            "required": ["topic", "sentiment"],
+            "additionalProperties": False,
+        },
+    }
+
+
+
+def _scan_topic_by_subtopic(selected_topic, return_if_subtopic=True):
+    """Поиск темы полным перебором topics_subtopics — используется только для построения индекса"""
     selected_topic = selected_topic.strip()
     if selected_topic in topics_subtopics:
         return [selected_topic]
@@ -148,21 +176,161 @@ def identify_topic_by_subtopic(selected_topic, return_if_subtopic=True):
     return identified_subtopics
 
 
-def process_pairs(pairs, return_subtopics=True):
+# Обратный индекс, строится один раз при импорте: название темы/подтемы -> канонические темы
+# (с самой подтемой в конце для варианта with_subtopics). Названия, которых нет в индексе, ни к чему не приводятся.
+_topic_index = {
+    True: {name: tuple(_scan_topic_by_subtopic(name, True)) for name in topics_subtopics_flatten},
+    False: {name: tuple(_scan_topic_by_subtopic(name, False)) for name in topics_subtopics_flatten},
+}
+
+
+def identify_topic_by_subtopic(selected_topic, return_if_subtopic=True):
+    return list(_topic_index[bool(return_if_subtopic)].get(selected_topic.strip(), ()))
+
+
+# --- Нечеткое сопоставление названий тем ---
+# Модель иногда пишет название чуть иначе: регистр, «»/"", ё/е, множественное число, перестановка частей
+# через «/», опечатка. Такие варианты приводятся к каноническому названию по индексу, построенному при импорте:
+# 1) нормализованный ключ (регистр, кавычки, пробелы) и 2) ключ из основ слов без учета порядка — точные словари;
+# 3) опечатки — кандидаты по общим триграммам, из которых difflib сравнивает не больше FUZZY_MAX_CANDIDATES.
+
+FUZZY_THRESHOLD = 0.85      # Минимальная похожесть для исправления опечатки
+FUZZY_MAX_CANDIDATES = 5    # Сколько кандидатов сравнивается посимвольно (ограничивает время поиска)
+FUZZY_MAX_NAME_LENGTH = 200 # Длиннее — точно не название темы
+_FUZZY_CACHE_SIZE = 10_000
+_UNRESOLVED_MAX_NAMES = 1000
+
+# Счетчики: fuzzy_resolved — исправлено нечетким поиском, unresolved — не удалось сопоставить.
+# Считаются только ответы модели в сервисе (record=True), а не пакетная нормализация истории
+topic_resolution_stats = Counter()
+# Несопоставленные названия с частотой — кандидаты в topics_to_replace
+unresolved_topics = Counter()
+
+_QUOTES_RE = re.compile(r"[«»\"“”„'`]")
+_SEPARATORS_RE = re.compile(r"[\s.,;:!]+")
+_WORD_SPLIT_RE = re.compile(r"[\s/]+")
+_ENDINGS = sorted(
+    ["ами", "ями", "ого", "его", "ому", "ему", "ыми", "ими", "ых", "их", "ой", "ей", "ий", "ый", "ая", "яя",
+     "ое", "ее", "ые", "ие", "ов", "ев", "ам", "ям", "ах", "ях", "ом", "ем", "ую", "юю",
+     "а", "я", "ы", "и", "о", "е", "у", "ю", "ь"],
+    key=len, reverse=True,
+)
+
+
+def _normalized_key(name):
+    name = unicodedata.normalize("NFKC", name).casefold().replace("ё", "е")
+    name = _QUOTES_RE.sub(" ", name)
+    return _SEPARATORS_RE.sub(" ", name).strip()
+
+
+def _stem(word):
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 4:
+            return word[:-len(ending)]
+    return word
+
+
+def _token_key(normalized):
+    return " ".join(sorted({_stem(word) for word in _WORD_SPLIT_RE.split(normalized) if word}))
+
+
+def _trigrams(text):
+    text = f"  {text} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _build_fuzzy_index():
+    """Ключи всех допустимых названий и синонимов -> каноническое название (неоднозначные ключи -> None)"""
+    exact, tokens = {}, {}
+    for name in topics_subtopics_flatten + list(topics_to_replace):
+        target = topics_to_replace.get(name, name)
+        normalized = _normalized_key(name)
+        for index, key in ((exact, normalized), (tokens, _token_key(normalized))):
+            index[key] = target if index.get(key, target) == target else None
+
+    candidates = sorted({key for key, target in exact.items() if target is not None})
+    trigram_index = {}
+    for candidate_id, key in enumerate(candidates):
+        for trigram in _trigrams(key):
+            trigram_index.setdefault(trigram, []).append(candidate_id)
+    return exact, tokens, candidates, trigram_index
+
+
+_fuzzy_exact, _fuzzy_tokens, _fuzzy_candidates, _fuzzy_trigrams = _build_fuzzy_index()
+_fuzzy_cache = {}
+
+
+def _fuzzy_lookup(raw_topic):
+    if len(raw_topic) > FUZZY_MAX_NAME_LENGTH:
+        return None
+    normalized = _normalized_key(raw_topic)
+    if normalized in _fuzzy_exact:
+        return _fuzzy_exact[normalized]
+    token_key = _token_key(normalized)
+    if token_key in _fuzzy_tokens:
+        return _fuzzy_tokens[token_key]
+
+    overlap = Counter()
+    for trigram in _trigrams(normalized):
+        overlap.update(_fuzzy_trigrams.get(trigram, ()))
+    scored = []
+    for candidate_id, _ in overlap.most_common(FUZZY_MAX_CANDIDATES):
+        candidate = _fuzzy_candidates[candidate_id]
+        scored.append((difflib.SequenceMatcher(None, normalized, candidate).ratio(), candidate))
+    scored.sort(reverse=True)
+    if not scored or scored[0][0] < FUZZY_THRESHOLD:
+        return None
+    if len(scored) > 1 and scored[1][0] == scored[0][0] and _fuzzy_exact[scored[1][1]] != _fuzzy_exact[scored[0][1]]:
+        return None  # Два разных кандидата одинаково похожи — не угадываем
+    return _fuzzy_exact[scored[0][1]]
+
+
+def fuzzy_match(raw_topic):
+    """Каноническое название для варианта написания или None, если уверенного совпадения нет"""
+    if raw_topic in _fuzzy_cache:
+        return _fuzzy_cache[raw_topic]
+    match = _fuzzy_lookup(raw_topic)
+    if len(_fuzzy_cache) >= _FUZZY_CACHE_SIZE:
+        _fuzzy_cache.clear()
+    _fuzzy_cache[raw_topic] = match
+    return match
+
+
+def _record_unresolved(raw_topic):
+    topic_resolution_stats["unresolved"] += 1
+    if raw_topic in unresolved_topics or len(unresolved_topics) < _UNRESOLVED_MAX_NAMES:
+        unresolved_topics[raw_topic] += 1
+
+
+def resolve_topic(raw_topic, return_subtopics=True, fuzzy=False, record=False):
+    """Сырое название темы от модели -> кортеж канонических тем (синонимы из topics_to_replace учтены).
+
+    При fuzzy=True нераспознанное название дополнительно ищется нечетким поиском.
+    При record=True исход учитывается в topic_resolution_stats, а несопоставленные названия — в unresolved_topics.
+    """
+    raw_topic = topics_to_replace.get(raw_topic, raw_topic)
+    index = _topic_index[bool(return_subtopics)]
+    resolved = index.get(raw_topic.strip())
+    if resolved is not None:
+        return resolved
+    if fuzzy:
+        match = fuzzy_match(raw_topic)
+        if match is not None:
+            if record:
+                topic_resolution_stats["fuzzy_resolved"] += 1
+            return index.get(match, ())
+    if record:
+        _record_unresolved(raw_topic)
+    return ()
+
+
+def process_pairs(pairs, return_subtopics=True, fuzzy=False, record=False):
     unique_topics = set()
     new_pairs = []
     for pair in pairs:
-        pair_topic = pair["topic"]
         pair_sentiment = pair["sentiment"]
         
-        if pair_topic in topics_to_replace:
-            pair_topic = topics_to_replace[pair_topic]
-            # if pair_topic not in unique_topics:
-            #     unique_topics.add(pair_topic)
-        
-        identified_topics = identify_topic_by_subtopic(pair_topic, return_subtopics)
-        
-        for identified_topic in identified_topics:
+        for identified_topic in resolve_topic(pair["topic"], return_subtopics, fuzzy, record):
             if identified_topic not in unique_topics:
                 unique_topics.add(identified_topic)
                 new_pairs.append(
@@ -175,6 +343,57 @@ def process_pairs(pairs, return_subtopics=True):
     return new_pairs
 
 
+def _to_list(column):
+    """Колонка pandas / Arrow / numpy / обычный список -> список Python"""
+    if hasattr(column, "to_pylist"):
+        return column.to_pylist()
+    if hasattr(column, "tolist"):
+        return column.tolist()
+    return list(column)
+
+
+def normalize_pair_columns(review_ids, topics, sentiments, return_subtopics=True, fuzzy=False):
+    """Пакетная нормализация пар в «длинном» формате (одна строка — одна пара тема/тональность).
+
+    Результат совпадает с process_pairs, примененным к парам каждого отзыва по отдельности:
+    темы раскрываются через индекс, внутри отзыва остается первое вхождение темы, порядок сохраняется.
+    Строки одного отзыва не обязаны идти подряд. Каждое уникальное сырое название разрешается один раз.
+
+    Возвращает три списка: review_ids, topics, sentiments.
+    """
+    review_ids, topics, sentiments = _to_list(review_ids), _to_list(topics), _to_list(sentiments)
+    resolved = {raw_topic: resolve_topic(raw_topic, return_subtopics, fuzzy) for raw_topic in set(topics)}
+
+    seen_by_review = {}
+    current_id, current_seen = object(), None
+    out_ids, out_topics, out_sentiments = [], [], []
+    for review_id, raw_topic, sentiment in zip(review_ids, topics, sentiments):
+        identified_topics = resolved[raw_topic]
+        if not identified_topics:
+            continue
+        if review_id != current_id:
+            # Обычно строки отзыва идут подряд, и множество берется из словаря один раз на отзыв
+            current_id = review_id
+            current_seen = seen_by_review.setdefault(review_id, set())
+        for topic in identified_topics:
+            if topic not in current_seen:
+                current_seen.add(topic)
+                out_ids.append(review_id)
+                out_topics.append(topic)
+                out_sentiments.append(sentiment)
+    return out_ids, out_topics, out_sentiments
+
+
+def normalize_pairs_frame(df, id_column="id", topic_column="topic", sentiment_column="sentiment", return_subtopics=True, fuzzy=False):
+    """normalize_pair_columns для pandas.DataFrame: возвращает новый DataFrame с теми же названиями колонок"""
+    import pandas as pd
+
+    ids, topics, sentiments = normalize_pair_columns(
+        df[id_column], df[topic_column], df[sentiment_column], return_subtopics, fuzzy
+    )
+    return pd.DataFrame({id_column: ids, topic_column: topics, sentiment_column: sentiments})
+
+
 def postprocess(topics_sentiments_full, return_subtopics=True):
     updated_topics_sentiments_full = []
 
@@ -0,0 +1,180 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Нормализация текста отзыва для ключа кэша: NFC, схлопывание пробелов, обрезка краев"""
+    text = unicodedata.normalize("NFC", text)
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def make_prefix(model_name: str, system_prompt: str, sampling_params: dict) -> str:
+    """Часть ключа, общая для всех отзывов: модель, хэш системного промпта и параметры семплирования.
+
+    Изменение любого из этих параметров автоматически делает старые записи кэша недостижимыми.
+    """
+    prompt_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+    params = json.dumps(sampling_params, sort_keys=True, ensure_ascii=False)
+    return f"{model_name}\x00{prompt_hash}\x00{params}\x00"
+
+
+def make_key(prefix: str, text: str) -> str:
+    return hashlib.sha256((prefix + normalize_text(text)).encode("utf-8")).hexdigest()
+
+
+class PredictionCache:
+    """Двухуровневый кэш предсказаний: LRU в памяти + SQLite на диске с TTL.
+
+    Значение — словарь {"topics": [...], "sentiments": [...]} без id отзыва,
+    так что одно значение переиспользуется для всех отзывов с одинаковым текстом.
+    """
+
+    def __init__(
+        self,
+        prefix: str,
+        memory_size: int = 100_000,
+        db_path: str | None = None,
+        ttl_seconds: float = 30 * 24 * 3600,
+        max_rows: int = 1_000_000,
+    ):
+        self.prefix = prefix
+        self.memory_size = memory_size
+        self.ttl_seconds = ttl_seconds
+        self.max_rows = max_rows
+
+        self._memory: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes_since_prune = 0
+
+        self.hits_memory = 0
+        self.hits_persistent = 0
+        self.misses = 0
+        self.deduplicated = 0
+        self._computed_count = 0
+        self._computed_seconds = 0.0
+
+        self._db: sqlite3.Connection | None = None
+        if db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS prediction_cache ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS ix_prediction_cache_created_at ON prediction_cache (created_at)")
+            self._db.commit()
+
+    def key(self, text: str) -> str:
+        return make_key(self.prefix, text)
+
+    # --- Память ---
+
+    def _memory_get(self, key: str) -> dict | None:
+        value = self._memory.get(key)
+        if value is not None:
+            self._memory.move_to_end(key)
+        return value
+
+    def _memory_set(self, key: str, value: dict):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    # --- SQLite (блокирующие вызовы, выполняются в пуле потоков) ---
+
+    def _persistent_get(self, key: str) -> dict | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, created_at FROM prediction_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if time.time() - row[1] > self.ttl_seconds:
+                self._db.execute("DELETE FROM prediction_cache WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+        return json.loads(row[0])
+
+    def _persistent_set(self, key: str, value: dict):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO prediction_cache (key, value, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time.time()),
+            )
+            self._writes_since_prune += 1
+            if self._writes_since_prune >= 1000:
+                self._writes_since_prune = 0
+                self._prune()
+            self._db.commit()
+
+    def _prune(self):
+        """Удаляет просроченные записи и самые старые записи сверх max_rows"""
+        self._db.execute("DELETE FROM prediction_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        self._db.execute(
+            "DELETE FROM prediction_cache WHERE key IN ("
+            " SELECT key FROM prediction_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_rows,),
+        )
+
+    # --- Публичный интерфейс ---
+
+    async def get(self, key: str) -> dict | None:
+        value = self._memory_get(key)
+        if value is not None:
+            self.hits_memory += 1
+            return value
+        if self._db is not None:
+            value = await asyncio.to_thread(self._persistent_get, key)
+            if value is not None:
+                self.hits_persistent += 1
+                self._memory_set(key, value)
+                return value
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: dict, cost_seconds: float | None = None):
+        """Сохраняет успешное предсказание; cost_seconds — сколько заняло его получение от LLM"""
+        if cost_seconds is not None:
+            self._computed_count += 1
+            self._computed_seconds += cost_seconds
+        self._memory_set(key, value)
+        if self._db is not None:
+            await asyncio.to_thread(self._persistent_set, key, value)
+
+    def close(self):
+        if self._db is not None:
+            with self._lock:
+                self._db.close()
+                self._db = None
+
+    def stats(self) -> dict:
+        hits = self.hits_memory + self.hits_persistent
+        lookups = hits + self.misses
+        avg_cost = self._computed_seconds / self._computed_count if self._computed_count else 0.0
+        return {
+            "hits_memory": self.hits_memory,
+            "hits_persistent": self.hits_persistent,
+            "misses": self.misses,
+            "deduplicated": self.deduplicated,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "avg_llm_seconds": avg_cost,
+            # Оценка сэкономленного времени LLM: попадания + схлопнутые дубли, умноженные на среднюю стоимость вызова
+            "saved_llm_seconds_estimate": (hits + self.deduplicated) * avg_cost,
+        }
@@ -0,0 +1,99 @@
+import time
+
+from sqlalchemy import delete, func, literal_column, select
+
+from . import models
+from . import database
+from . import analytics_cache
+
+
+# Дневной агрегат sentiment_daily: число связей отзыв-тема по (день, тема, тональность, источник).
+# Аналитика читает его вместо полного join reviews_topics с reviews, поэтому время ответа дашборда
+# зависит от длины выбранного периода, а не от общего числа отзывов. Недели и месяцы собираются
+# из дневных строк. Отзывы без даты в агрегат не попадают (в них нечего показывать по периодам).
+#
+# Агрегат обновляется инкрементально в app/writeback.py. После загрузки данных в обход приложения
+# (seed_db.py уже пересчитывает сам, прямые правки в БД) его нужно пересчитать:
+#     python -m app.rollup
+
+
+def _aggregate_links(review_ids: list | None = None, sign: int = 1):
+    """SELECT вклада связей в агрегат (для всех отзывов или только для review_ids)"""
+    day = func.date(models.Review.date)
+    # Литералы, а не параметры: иначе PostgreSQL не признает выражения в SELECT и GROUP BY одинаковыми
+    source = func.coalesce(models.Review.source, literal_column("''"))
+    query = select(
+        day.label("day"),
+        models.ReviewTopicLink.topic_id,
+        models.ReviewTopicLink.sentiment,
+        source.label("source"),
+        (func.count() * literal_column(str(int(sign)))).label("count"),
+    ).select_from(models.ReviewTopicLink).join(models.Review).where(models.Review.date.is_not(None))
+    if review_ids is not None:
+        query = query.where(models.ReviewTopicLink.review_id.in_(review_ids))
+    return query.group_by(day, models.ReviewTopicLink.topic_id, models.ReviewTopicLink.sentiment, source)
+
+
+# Ключ pg_advisory_xact_lock транзакций, которые меняют связи и агрегат
+WRITE_LOCK_KEY = 7_300_016
+
+
+def lock_writes(db):
+    """Сериализует транзакции записи связей и агрегата (блокировка до commit/rollback).
+
+    Вызывается до apply(-1): вычитание читает текущие связи отзывов, и без блокировки две параллельные
+    записи одного отзыва (ретрай клиента, задача вместе с /api/predict) вычли бы одни и те же связи дважды,
+    а связи первой записи не вычел бы никто. Блокировка на все записи, а не на отзывы: строк новых
+    отзывов, которые можно было бы заблокировать, до записи еще нет.
+    В SQLite записи и так сериализуются блокировкой базы с первого изменяющего запроса.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(select(func.pg_advisory_xact_lock(WRITE_LOCK_KEY)))
+
+
+def apply(db, review_ids: list, sign: int):
+    """Добавляет (sign=+1) или вычитает (sign=-1) текущие связи отзывов review_ids из агрегата.
+
+    Вызывается в транзакции записи после lock_writes: -1 до изменения отзывов и их связей, +1 после.
+    """
+    columns = ["day", "topic_id", "sentiment", "source", "count"]
+    stmt = database.dialect_insert(models.SentimentDaily).from_select(columns, _aggregate_links(review_ids, sign))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["day", "topic_id", "sentiment", "source"],
+        set_={"count": models.SentimentDaily.count + stmt.excluded.count},
+    )
+    db.execute(stmt)
+
+
+def rebuild(db):
+    """Полный пересчет агрегата по reviews_topics (в переданной сессии, без commit)"""
+    lock_writes(db)
+    db.execute(delete(models.SentimentDaily))
+    db.execute(
+        models.SentimentDaily.__table__.insert().from_select(
+            ["day", "topic_id", "sentiment", "source", "count"], _aggregate_links()
+        )
+    )
+    analytics_cache.bump_generation(db)
+
+
+def is_empty(db) -> bool:
+    return db.execute(select(models.SentimentDaily.day).limit(1)).first() is None
+
+
+def ensure_built():
+    """Строит агрегат, если он пуст, а связи уже есть (первый запуск на существующей базе)"""
+    with database.SessionLocal() as db:
+        if is_empty(db) and db.execute(select(models.ReviewTopicLink.id).limit(1)).first() is not None:
+            print("Дневной агрегат пуст, пересчитываем...")
+            rebuild(db)
+            db.commit()
+
+
+if __name__ == "__main__":
+    started_at = time.perf_counter()
+    with database.SessionLocal() as session:
+        rebuild(session)
+        session.commit()
+        rows = session.execute(select(func.count()).select_from(models.SentimentDaily)).scalar()
+    print(f"Дневной агрегат пересчитан: {rows} строк за {time.perf_counter() - started_at:.1f} с")
@@ -0,0 +1,17 @@
+from datetime import datetime
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+
+# Модели для валидации запроса и ответа
+class ReviewRequestItem(BaseModel):
+    id: int
+    text: str
+    # Необязательные поля отзыва, нужны только при сохранении разметки в БД (persist=true)
+    source: Optional[str] = None
+    date: Optional[datetime] = None
+    rating: Optional[float] = None
+
+class PredictRequest(BaseModel):
+    data: List[ReviewRequestItem]
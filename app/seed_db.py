@@ -12,6 +12,7 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from .database import engine, Base
 from .models import Review, Topic, ReviewTopicLink
+from . import rollup
 
 
 # --- Логика ожидания базы ---
@@ -71,6 +72,7 @@ try:
     session.execute(text("DROP TABLE IF EXISTS reviews_topics CASCADE;"))
     session.execute(text("DROP TABLE IF EXISTS topics CASCADE;"))
     session.execute(text("DROP TABLE IF EXISTS reviews CASCADE;"))
+    session.execute(text("DROP TABLE IF EXISTS sentiment_daily CASCADE;"))
     session.commit()
     print("Старые таблицы удалены.")
 
@@ -112,6 +114,10 @@ try:
     })
     session.bulk_insert_mappings(ReviewTopicLink, df_reviews_topics_to_seed.to_dict(orient='records'))
     print(f"Заполнено {len(df_reviews_topics)} review-topic links.")
+
+    # Дневной агрегат для аналитики
+    print("Пересчитываем 'sentiment_daily'...")
+    rollup.rebuild(session)
     
     session.commit()
     print("\nБаза данных успешно заполнена!")
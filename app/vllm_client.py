@@ -0,0 +1,90 @@
+import asyncio
+import time
+
+import aiohttp
+
+from .chunking import estimate_tokens
+from .concurrency import AdaptiveLimiter
+from .metrics import LIMITER_WAIT_SECONDS, VLLM_REQUEST_SECONDS
+
+
+class VLLMClient:
+    """Клиент vLLM, общий для всех запросов к сервису.
+
+    Держит один пул keep-alive соединений на всё время жизни приложения
+    и глобальный адаптивный лимит одновременных запросов к vLLM (а не лимит на один вызов /api/predict).
+    """
+
+    def __init__(
+        self,
+        url: str,
+        limiter: AdaptiveLimiter,
+        pool_size: int = 100,
+        keepalive_timeout: float = 60,
+        request_timeout: float = 180,
+        connect_timeout: float = 10,
+    ):
+        self.url = url
+        self.limiter = limiter
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.request_timeout = request_timeout
+        self.connect_timeout = connect_timeout
+        self._session: aiohttp.ClientSession | None = None
+
+    async def start(self):
+        """Открывает сессию с пулом соединений (вызывается при старте приложения)"""
+        if self._session is not None:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_size,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=self.request_timeout,
+            sock_connect=self.connect_timeout,
+        )
+        self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def close(self):
+        """Закрывает сессию и все соединения пула (вызывается при остановке приложения)"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            raise RuntimeError("VLLMClient не запущен: вызовите start() перед отправкой запросов")
+        return self._session
+
+    async def chat_completion(self, payload: dict) -> dict | None:
+        """Отправляет запрос в chat/completions с учетом глобального лимита.
+
+        Возвращает распарсенный JSON ответа или None, если vLLM ответил не 200.
+        Сетевые ошибки и таймауты пробрасываются вызывающему коду.
+        Задержки, таймауты и ответы 429/5xx передаются лимитеру как сигнал загрузки бэкенда.
+        """
+        wait_started_at = time.monotonic()
+        async with self.limiter:
+            started_at = time.monotonic()
+            LIMITER_WAIT_SECONDS.observe(started_at - wait_started_at)
+            try:
+                async with self.session.post(self.url, json=payload) as response:
+                    if response.status == 429 or response.status >= 500:
+                        self.limiter.record_overload()
+                        return None
+                    if response.status != 200:
+                        return None
+                    data = await response.json()
+            except asyncio.TimeoutError:
+                self.limiter.record_overload()
+                raise
+            finally:
+                VLLM_REQUEST_SECONDS.observe(time.monotonic() - started_at)
+            # Задержка сравнивается с обычной для такой длины запроса; без usage длина оценивается по тексту
+            prompt_tokens = (data.get("usage") or {}).get("prompt_tokens") or sum(
+                estimate_tokens(message.get("content") or "") for message in payload.get("messages", [])
+            )
+            self.limiter.record_success(time.monotonic() - started_at, prompt_tokens)
+            return data
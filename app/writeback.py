@@ -0,0 +1,168 @@
+import threading
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import func, select, update, delete, text
+
+from . import models
+from . import database
+from . import rollup
+from . import analytics_cache
+
+
+# Запись разметки в reviews / reviews_topics, чтобы аналитика видела новые отзывы сразу после инференса.
+# Запись идемпотентна: отзыв обновляется по id (upsert), его связи с темами заменяются целиком,
+# поэтому повтор того же батча (ретрай клиента, перезапуск задачи) не создает дублей.
+# На батч уходит фиксированное число запросов к БД, а не несколько на каждый отзыв.
+# Дневные агрегаты (sentiment_daily) обновляются в той же транзакции: вклад старой разметки
+# вычитается до записи, вклад новой — добавляется после. Там же увеличивается поколение данных,
+# которое сбрасывает кэш ответов аналитики.
+
+
+def _sync_sequences(db):
+    """Подтягивает sequence id в PostgreSQL к MAX(id).
+
+    seed_db.py загружает topics и reviews_topics с явными id, sequence при этом остается на 1,
+    и первый же INSERT без id упирается в дубль первичного ключа.
+    """
+    if database.engine.dialect.name != "postgresql":
+        return
+    for model in (models.Topic, models.ReviewTopicLink):
+        table = model.__tablename__
+        sequence = db.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": table}).scalar()
+        if sequence is None:
+            continue
+        db.execute(text(
+            f"SELECT setval('{sequence}', (SELECT COALESCE(MAX(id), 0) + 1 FROM {table}), false) "
+            f"WHERE (SELECT COALESCE(MAX(id), 0) FROM {table}) >= (SELECT last_value FROM {sequence})"
+        ))
+    db.commit()
+
+
+class ReviewWriter:
+    """Сохраняет предсказания в models.Review и models.ReviewTopicLink.
+
+    sentiment_values переводит тональность из формата ответа API в значение для БД
+    ("положительно" -> "positive"). Словарь «название темы -> Topic.id» загружается
+    один раз и дополняется, когда модель возвращает тему, которой еще нет в таблице topics.
+    """
+
+    def __init__(self, sentiment_values: dict, batch_size: int = 1000, journal_reviews: bool = False):
+        self.sentiment_values = sentiment_values
+        self.batch_size = batch_size
+        # id записанных отзывов в журнал data_changes: нужны только колоночной копии (ANALYTICS_ENGINE=duckdb),
+        # без нее поколение отмечается одной строкой
+        self.journal_reviews = journal_reviews
+        self._topic_ids = None
+        self._topic_lock = threading.Lock()
+        self.counters = Counter()
+
+    def _topic_id_map(self, names: set) -> dict:
+        """Topic.id по названиям; недостающие темы создаются отдельной короткой транзакцией"""
+        with self._topic_lock:
+            if self._topic_ids is None:
+                with database.SessionLocal() as db:
+                    _sync_sequences(db)
+                    self._topic_ids = dict(db.execute(select(models.Topic.name, models.Topic.id)).all())
+            missing = names - self._topic_ids.keys()
+            if missing:
+                with database.SessionLocal() as db:
+                    db.execute(
+                        database.dialect_insert(models.Topic).on_conflict_do_nothing(index_elements=["name"]),
+                        [{"name": name} for name in sorted(missing)],
+                    )
+                    self._topic_ids.update(db.execute(
+                        select(models.Topic.name, models.Topic.id).where(models.Topic.name.in_(missing))
+                    ).all())
+                    db.commit()
+                self.counters["topics_created"] += len(missing)
+            return self._topic_ids
+
+    def write(self, db, items: list, predictions: list) -> int:
+        """Пишет батч в переданную сессию (без commit). Возвращает число сохраненных отзывов"""
+        by_id = {}
+        for item, prediction in zip(items, predictions):
+            by_id[item.id] = (item, prediction)  # Повтор id в батче: остается последний
+        # Модель не ответила (failed): пустой результат — не разметка, сохраненные связи отзыва не трогаем
+        failed = [review_id for review_id, (_, prediction) in by_id.items() if prediction.get("failed")]
+        for review_id in failed:
+            del by_id[review_id]
+        self.counters["skipped_failed"] += len(failed)
+        if not by_id:
+            return 0
+        topic_ids = self._topic_id_map({
+            topic for _, prediction in by_id.values() for topic in prediction["topics"]
+        })
+
+        # До первого apply(-1): параллельные записи тех же отзывов ждут commit этой транзакции
+        rollup.lock_writes(db)
+        review_ids = list(by_id)
+        for start in range(0, len(review_ids), self.batch_size):
+            batch_ids = review_ids[start:start + self.batch_size]
+            batch = [by_id[review_id] for review_id in batch_ids]
+
+            rollup.apply(db, batch_ids, -1)
+
+            # Отзывы: upsert по id. Необязательные поля, которых нет в запросе, не затирают сохраненные
+            stmt = database.dialect_insert(models.Review)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["id"],
+                set_={
+                    "review_text": stmt.excluded.review_text,
+                    "source": func.coalesce(stmt.excluded.source, models.Review.source),
+                    "date": func.coalesce(stmt.excluded.date, models.Review.date),
+                    "rating": func.coalesce(stmt.excluded.rating, models.Review.rating),
+                },
+            )
+            db.execute(stmt, [
+                {"id": item.id, "review_text": item.text, "source": item.source, "date": item.date, "rating": item.rating}
+                for item, _ in batch
+            ])
+            # Отзыв без даты попал бы мимо всех фильтров по периоду — датируем его моментом разметки
+            db.execute(
+                update(models.Review)
+                .where(models.Review.id.in_(batch_ids), models.Review.date.is_(None))
+                .values(date=datetime.now())
+            )
+
+            # Связи с темами заменяются целиком: старая разметка отзыва удаляется одним запросом
+            db.execute(delete(models.ReviewTopicLink).where(models.ReviewTopicLink.review_id.in_(batch_ids)))
+            links = [
+                {"review_id": item.id, "topic_id": topic_ids[topic], "sentiment": self.sentiment_values[sentiment]}
+                for item, prediction in batch
+                for topic, sentiment in zip(prediction["topics"], prediction["sentiments"])
+            ]
+            if links:
+                db.execute(database.dialect_insert(models.ReviewTopicLink), links)
+            rollup.apply(db, batch_ids, +1)
+            self.counters["links"] += len(links)
+
+        # Последним шагом: строка поколения блокируется до commit
+        analytics_cache.bump_generation(db, review_ids if self.journal_reviews else None)
+        self.counters["reviews"] += len(by_id)
+        self.counters["batches"] += 1
+        return len(by_id)
+
+    def persist(self, items: list, predictions: list) -> int:
+        """write + commit в собственной сессии"""
+        try:
+            with database.SessionLocal() as db:
+                written = self.write(db, items, predictions)
+                db.commit()
+        except Exception:
+            self.counters["errors"] += 1
+            raise
+        return written
+
+    async def persist_async(self, items: list, predictions: list) -> int:
+        return await database.run_sync(self.persist, items, predictions)
+
+    def stats(self) -> dict:
+        return {
+            "reviews": self.counters["reviews"],
+            "links": self.counters["links"],
+            "batches": self.counters["batches"],
+            "errors": self.counters["errors"],
+            "topics_created": self.counters["topics_created"],
+            "skipped_failed": self.counters["skipped_failed"],
+        }
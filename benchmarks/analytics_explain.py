@@ -0,0 +1,242 @@
+"""Проверка планов аналитических запросов через EXPLAIN ANALYZE на сгенерированных данных.
+
+Скрипт создает отдельную схему в PostgreSQL (по умолчанию bench_analytics, рабочие таблицы не трогает),
+генерирует в ней отзывы и связи с темами (по умолчанию 2 млн отзывов, ~4 млн связей) с индексами из
+app/models.py и сравнивает запросы KPI, ключевых аспектов и динамики в двух вариантах:
+  legacy — прежний фильтр cast(reviews.date AS DATE) BETWEEN ...;
+  current — полуоткрытый диапазон из app/analytics.py и фильтр тем по id (links_query ниже);
+  rollup — те же панели по дневному агрегату sentiment_daily (так их сейчас считают эндпоинты).
+
+Проверки (при нарушении скрипт завершается с кодом 1):
+  - для узкого периода current читает reviews через индекс, а не Seq Scan;
+  - current не медленнее legacy (с допуском --tolerance);
+  - полнотекстовый поиск (/api/reviews?q=) отбирает отзывы по GIN-индексу ix_reviews_search_vector.
+Запросы выполняются с random_page_cost=1.1, как у сервиса db в docker-compose.yml.
+
+Запуск из корня репозитория (DATABASE_URL указывает на PostgreSQL):
+    python -m benchmarks.analytics_explain --reviews 2000000
+    python -m benchmarks.analytics_explain --reuse   # без повторной генерации данных
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import date
+
+from sqlalchemy import Date, func, select, text
+from sqlalchemy.orm import Session
+
+from app import analytics, database, models, postprocessing, rollup
+
+
+SEARCH_PHRASE = "ипотеку одобрили за один день"
+
+
+def generate(connection, schema: str, reviews: int):
+    connection.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+    connection.execute(text(f"CREATE SCHEMA {schema}"))
+    connection.execute(text(f"SET search_path TO {schema}"))
+    models.Base.metadata.create_all(connection, tables=[
+        models.Review.__table__, models.Topic.__table__, models.ReviewTopicLink.__table__,
+        models.SentimentDaily.__table__, models.DataVersion.__table__, models.DataChange.__table__,
+    ])
+    topics = postprocessing.main_topics
+    connection.execute(
+        text("INSERT INTO topics (id, name) VALUES (:id, :name)"),
+        [{"id": i, "name": name} for i, name in enumerate(topics, 1)],
+    )
+    started_at = time.perf_counter()
+    # Отзывы равномерно за 6 лет, по 1-3 темы на отзыв. Одна фраза из тысячи редкая — по ней проверяется поиск
+    connection.execute(text("""
+        INSERT INTO reviews (id, site_specific_id, source, date, review_text, rating)
+        SELECT i, i, CASE WHEN i % 3 = 0 THEN 'sravni.ru' ELSE 'banki.ru' END,
+               timestamp '2019-01-01' + random() * interval '6 years',
+               CASE WHEN i % 1000 = 0 THEN :rare
+                    ELSE (ARRAY['удобное мобильное приложение', 'долго ждал в отделении', 'банкомат не выдал наличные',
+                                'одобрили кредит под хороший процент', 'ставка по вкладу снизилась'])[1 + i % 5]
+               END || ', отзыв ' || i,
+               1 + i % 5
+        FROM generate_series(1, :reviews) AS i
+    """), {"reviews": reviews, "rare": SEARCH_PHRASE})
+    connection.execute(text("""
+        INSERT INTO reviews_topics (review_id, topic_id, sentiment)
+        SELECT r, 1 + (r * 7 + k * 5) % :topics, (ARRAY['positive', 'neutral', 'negative'])[1 + (r + k) % 3]
+        FROM generate_series(1, :reviews) AS r, generate_series(1, 3) AS k
+        WHERE k = 1 OR (r + k) % 2 = 0
+    """), {"reviews": reviews, "topics": len(topics)})
+    rollup.rebuild(Session(bind=connection))
+    connection.commit()
+    # VACUUM заполняет visibility map — без нее Index Only Scan все равно ходит в таблицу
+    connection.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM ANALYZE"))
+    print(f"Сгенерировано {reviews} отзывов за {time.perf_counter() - started_at:.1f} с")
+
+
+def search_query(db):
+    """Первая страница поиска, как в /api/reviews?q=: отбор по search_vector, сортировка по релевантности"""
+    rank = analytics.search_rank(SEARCH_PHRASE)
+    return (
+        db.query(models.Review.id, rank.label("rank"))
+        .filter(analytics.search_condition(SEARCH_PHRASE))
+        .order_by(rank.desc(), models.Review.id.desc())
+        .limit(51)
+    )
+
+
+def uses_index(plan: dict, index_name: str) -> bool:
+    stack = [plan["Plan"]]
+    while stack:
+        node = stack.pop()
+        if node.get("Index Name") == index_name:
+            return True
+        stack.extend(node.get("Plans", []))
+    return False
+
+
+def links_query(db, *entities, topic_list=None, start_date=None, end_date=None):
+    """Панели полным join связей с отзывами, как до дневного агрегата: темы — через их id (без join с topics),
+    период — полуоткрытым диапазоном analytics.period_condition"""
+    query = db.query(*entities).select_from(models.ReviewTopicLink).join(models.Review)
+    if topic_list:
+        query = query.filter(models.ReviewTopicLink.topic_id.in_(
+            select(models.Topic.id).where(models.Topic.name.in_(topic_list))
+        ))
+    if start_date and end_date:
+        query = query.filter(analytics.period_condition(start_date, end_date))
+    return query
+
+
+def link_count():
+    """count(*), а не count(reviews_topics.id): id не входит в составные индексы,
+    и с count(*) связи читаются Index Only Scan по (review_id, topic_id, sentiment)"""
+    return func.count()
+
+
+def legacy_links_query(db, *entities, topic_list=None, start_date=None, end_date=None):
+    """Прежний вариант фильтров: join с topics и cast колонки даты"""
+    query = db.query(*entities).select_from(models.ReviewTopicLink).join(models.Review)
+    if topic_list:
+        query = query.join(models.Topic).filter(models.Topic.name.in_(topic_list))
+    if start_date and end_date:
+        query = query.filter(func.cast(models.Review.date, Date).between(start_date, end_date))
+    return query
+
+
+def legacy_link_count():
+    return func.count(models.ReviewTopicLink.id)
+
+
+def build_queries(db, links_query, link_count) -> dict:
+    month = dict(start_date=date(2023, 3, 1), end_date=date(2023, 3, 31))
+    year = dict(start_date=date(2022, 1, 1), end_date=date(2022, 12, 31))
+    sentiment = models.ReviewTopicLink.sentiment
+    return {
+        "kpi_month": (links_query(db, sentiment, link_count(), **month).group_by(sentiment), True),
+        "kpi_month_products": (
+            links_query(db, sentiment, link_count(), topic_list=["Вклады", "Ипотека"], **month).group_by(sentiment), True
+        ),
+        "aspects_month": (
+            links_query(db, models.Topic.name, link_count(), **month).join(models.Topic)
+            .filter(sentiment == "positive").group_by(models.Topic.name).order_by(link_count().desc()).limit(5),
+            True,
+        ),
+        "dynamics_year": (
+            links_query(db, func.date_trunc("month", models.Review.date).label("group_date"), sentiment, link_count(), **year)
+            .group_by("group_date", sentiment),
+            False,
+        ),
+    }
+
+
+def build_rollup_queries(db) -> dict:
+    """Те же панели по дневному агрегату sentiment_daily (так их считают эндпоинты)"""
+    month = dict(start_date=date(2023, 3, 1), end_date=date(2023, 3, 31))
+    year = dict(start_date=date(2022, 1, 1), end_date=date(2022, 12, 31))
+    sentiment, count = models.SentimentDaily.sentiment, analytics.rollup_count()
+    return {
+        "kpi_month": analytics.rollup_query(db, sentiment, count, **month).group_by(sentiment),
+        "kpi_month_products": analytics.rollup_query(
+            db, sentiment, count, topic_ids=analytics.resolve_topic_ids(db, ["Вклады", "Ипотека"]), **month
+        ).group_by(sentiment),
+        "aspects_month": analytics.rollup_query(db, models.Topic.name, count, **month)
+        .join(models.Topic, models.Topic.id == models.SentimentDaily.topic_id)
+        .filter(sentiment == "positive").group_by(models.Topic.name).order_by(count.desc()).limit(5),
+        "dynamics_year": analytics.rollup_query(
+            db, func.date_trunc("month", models.SentimentDaily.day).label("group_date"), sentiment, count, **year
+        ).group_by("group_date", sentiment),
+    }
+
+
+def explain(connection, query) -> dict:
+    compiled = query.statement.compile(dialect=connection.dialect, compile_kwargs={"render_postcompile": True})
+    row = connection.exec_driver_sql(
+        "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + str(compiled), compiled.params
+    ).scalar()
+    return (json.loads(row) if isinstance(row, str) else row)[0]
+
+
+def review_scans(plan: dict) -> set:
+    """Типы узлов, которыми читается таблица reviews"""
+    node_types = set()
+    stack = [plan["Plan"]]
+    while stack:
+        node = stack.pop()
+        if node.get("Relation Name") == "reviews":
+            node_types.add(node["Node Type"])
+        stack.extend(node.get("Plans", []))
+    return node_types
+
+
+def main(args):
+    engine = database.engine
+    if engine.dialect.name != "postgresql":
+        sys.exit("Нужен PostgreSQL: EXPLAIN ANALYZE и генерация данных используют его синтаксис")
+
+    with engine.connect() as connection:
+        if not args.reuse:
+            generate(connection, args.schema, args.reviews)
+        connection.execute(text(f"SET search_path TO {args.schema}"))
+        # Та же стоимость случайного чтения, что у сервиса db в docker-compose.yml (SSD)
+        connection.execute(text(f"SET random_page_cost = {args.random_page_cost}"))
+        db = Session(bind=connection)
+
+        failures = []
+        print(f"{'query':>20} {'legacy, ms':>11} {'current, ms':>12} {'rollup, ms':>11} {'reviews scan (current)':>30}")
+        current = build_queries(db, links_query, link_count)
+        legacy = build_queries(db, legacy_links_query, legacy_link_count)
+        rollup_queries = build_rollup_queries(db)
+        for name, (query, narrow) in current.items():
+            legacy_ms = min(explain(connection, legacy[name][0])["Execution Time"] for _ in range(args.repeat))
+            plans = [explain(connection, query) for _ in range(args.repeat)]
+            current_ms = min(plan["Execution Time"] for plan in plans)
+            rollup_ms = min(explain(connection, rollup_queries[name])["Execution Time"] for _ in range(args.repeat))
+            scans = review_scans(plans[0])
+            print(f"{name:>20} {legacy_ms:>11.1f} {current_ms:>12.1f} {rollup_ms:>11.1f} {', '.join(sorted(scans)):>30}")
+
+            if narrow and "Seq Scan" in scans:
+                failures.append(f"{name}: reviews читается Seq Scan вместо индекса по date")
+            if current_ms > legacy_ms * args.tolerance:
+                failures.append(f"{name}: {current_ms:.1f} мс против {legacy_ms:.1f} мс у прежнего фильтра")
+
+        # Полнотекстовый поиск: редкая фраза должна находиться через GIN-индекс, без Seq Scan по reviews
+        plans = [explain(connection, search_query(db)) for _ in range(args.repeat)]
+        search_ms = min(plan["Execution Time"] for plan in plans)
+        print(f"{'search':>20} {'':>11} {search_ms:>12.1f} {'':>11} {', '.join(sorted(review_scans(plans[0]))):>30}")
+        if not uses_index(plans[0], "ix_reviews_search_vector"):
+            failures.append("search: поиск не использует GIN-индекс ix_reviews_search_vector")
+        db.close()
+
+    if failures:
+        print("\n".join(["", "Регрессии:"] + failures))
+        sys.exit(1)
+    print("\nOK: планы используют индексы, запросы не медленнее прежних")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="EXPLAIN ANALYZE аналитических запросов")
+    parser.add_argument("--reviews", type=int, default=2_000_000, help="Сколько отзывов сгенерировать")
+    parser.add_argument("--schema", default="bench_analytics", help="Схема для сгенерированных данных")
+    parser.add_argument("--reuse", action="store_true", help="Не генерировать данные, использовать уже созданную схему")
+    parser.add_argument("--repeat", type=int, default=3, help="Прогонов каждого запроса (берется лучший)")
+    parser.add_argument("--random-page-cost", type=float, default=1.1, help="random_page_cost для сессии")
+    parser.add_argument("--tolerance", type=float, default=1.1, help="Допустимое замедление относительно прежнего фильтра")
+    main(parser.parse_args())
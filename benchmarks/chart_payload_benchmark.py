@@ -0,0 +1,116 @@
+"""Микробенчмарк сериализации графиков /api/dynamics и /api/dynamics_stacked_bar.
+
+Сравнивает прежний путь (go.Figure -> fig.to_json() -> json.loads -> повторная сериализация FastAPI)
+с app.charts (готовые JSON-байты через orjson) на дневных рядах за 1, 2 и 5 лет.
+Заодно проверяет, что оба пути дают один и тот же JSON.
+
+Запуск из корня репозитория:
+    python -m benchmarks.chart_payload_benchmark
+"""
+import argparse
+import json
+import random
+import time
+from datetime import date, timedelta
+
+import plotly.graph_objects as go
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app import charts
+
+
+def make_dynamics_data(days: int, rng: random.Random):
+    """Данные в формате create_dynamics_data для дневной гранулярности"""
+    start = date(2020, 1, 1)
+    raw_categories_dates = [start + timedelta(days=i) for i in range(days)]
+    data = {
+        d: {s: rng.randint(0, 500) for s in ('positive', 'neutral', 'negative')}
+        for d in raw_categories_dates
+    }
+    formatted_categories = [d.strftime('%d.%m.%Y') for d in raw_categories_dates]
+    return data, raw_categories_dates, formatted_categories
+
+
+def legacy_share_chart(data, raw_categories_dates, formatted_categories) -> bytes:
+    """Прежняя реализация /api/dynamics, включая сериализацию ответа FastAPI"""
+    series_data = {s: [] for s in ['positive', 'negative', 'neutral']}
+    for date_key in raw_categories_dates:
+        total = sum(data.get(date_key, {}).values())
+        for sentiment in series_data:
+            count = data.get(date_key, {}).get(sentiment, 0)
+            series_data[sentiment].append((count / total) * 100 if total > 0 else 0)
+
+    fig = go.Figure()
+    for sentiment in charts.SENTIMENTS_ORDER:
+        fig.add_trace(go.Scatter(
+            x=formatted_categories, y=series_data[sentiment], name=charts.NAMES[sentiment],
+            mode='lines', stackgroup='one', line=dict(width=0.5, color=charts.COLORS[sentiment]),
+            fillcolor=charts.COLORS[sentiment]
+        ))
+    fig.update_layout(
+        template="plotly_white", yaxis_title="Доля, %",
+        margin=dict(t=10, b=10, l=40, r=10),
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+    )
+    return JSONResponse(jsonable_encoder(json.loads(fig.to_json()))).body
+
+
+def legacy_count_chart(data, raw_categories_dates, formatted_categories) -> bytes:
+    """Прежняя реализация /api/dynamics_stacked_bar, включая сериализацию ответа FastAPI"""
+    fig = go.Figure()
+    for sentiment in charts.SENTIMENTS_ORDER:
+        counts = [data.get(date_key, {}).get(sentiment, 0) for date_key in raw_categories_dates]
+        fig.add_trace(go.Bar(
+            name=charts.NAMES[sentiment], x=formatted_categories, y=counts,
+            marker_color=charts.COLORS[sentiment]
+        ))
+    fig.update_layout(
+        barmode='stack', template="plotly_white", yaxis_title="Количество отзывов",
+        margin=dict(t=10, b=10, l=40, r=10),
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+    )
+    return JSONResponse(jsonable_encoder(json.loads(fig.to_json()))).body
+
+
+def fast_share_chart(data, raw_categories_dates, formatted_categories) -> bytes:
+    return charts.share_chart(formatted_categories, charts.share_series(data, raw_categories_dates))
+
+
+def fast_count_chart(data, raw_categories_dates, formatted_categories) -> bytes:
+    return charts.count_chart(formatted_categories, charts.count_series(data, raw_categories_dates))
+
+
+def measure(fn, args, repeat: int) -> float:
+    """Среднее время вызова в мс (после одного прогревочного вызова)"""
+    fn(*args)
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        fn(*args)
+    return (time.perf_counter() - started_at) / repeat * 1000
+
+
+def main(args):
+    rng = random.Random(0)
+    print(f"{'chart':>12} {'years':>6} {'points':>7} {'legacy, ms':>11} {'fast, ms':>9} {'speedup':>8} {'size, KB':>9}")
+    for years in args.years:
+        dynamics = make_dynamics_data(365 * years, rng)
+        for name, legacy, fast in (
+            ("share", legacy_share_chart, fast_share_chart),
+            ("stacked_bar", legacy_count_chart, fast_count_chart),
+        ):
+            legacy_body, fast_body = legacy(*dynamics), fast(*dynamics)
+            assert json.loads(legacy_body) == json.loads(fast_body), f"{name}: JSON не совпадает с прежней реализацией"
+            legacy_ms = measure(legacy, dynamics, args.repeat)
+            fast_ms = measure(fast, dynamics, args.repeat)
+            print(
+                f"{name:>12} {years:>6} {len(dynamics[1]):>7} {legacy_ms:>11.2f} {fast_ms:>9.2f}"
+                f" {legacy_ms / fast_ms:>7.1f}x {len(fast_body) / 1024:>9.1f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Микробенчмарк сериализации графиков")
+    parser.add_argument("--years", type=lambda v: [int(x) for x in v.split(",")], default=[1, 2, 5])
+    parser.add_argument("--repeat", type=int, default=50)
+    main(parser.parse_args())
@@ -0,0 +1,143 @@
+"""Сравнение движков панелей аналитики на больших объемах: PostgreSQL и колоночная копия в DuckDB.
+
+Для каждого объема (по умолчанию 1, 10 и 50 млн связей отзыв-тема) скрипт генерирует данные в отдельной
+схеме PostgreSQL (как benchmarks.analytics_explain, ~2 связи на отзыв за 6 лет), загружает их в
+app/columnar.py и измеряет запросы панелей в трех вариантах:
+  join    — полный join reviews_topics с reviews (как до дневного агрегата);
+  rollup  — дневной агрегат sentiment_daily (ANALYTICS_ENGINE=postgres);
+  duckdb  — колоночная копия фактов (ANALYTICS_ENGINE=duckdb).
+Запросы: динамика по дням за все 6 лет, KPI с трендами за год, ключевые аспекты за год.
+Отдельно измеряются полная загрузка копии и инкрементальная синхронизация после записи 1000 отзывов.
+
+Проверка (при нарушении код выхода 1): ответы rollup и duckdb совпадают.
+
+Запуск из корня репозитория (DATABASE_URL указывает на PostgreSQL; 50 млн связей — несколько ГБ на диске):
+    python -m benchmarks.columnar_benchmark --links 1000000,10000000,50000000
+"""
+import argparse
+import sys
+import time
+from datetime import date
+
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+
+from app import analytics, analytics_cache, columnar, database, models, rollup
+from benchmarks.analytics_explain import generate, link_count, links_query
+
+
+START, END = date(2019, 1, 1), date(2024, 12, 31)
+YEAR = dict(start_date=date(2023, 1, 1), end_date=date(2023, 12, 31))
+TREND = {"last": (date(2023, 12, 1), date(2023, 12, 31)), "previous": (date(2023, 11, 1), date(2023, 11, 30))}
+
+
+def join_panels(db) -> dict:
+    """Те же панели полным join по связям"""
+    sentiment, count = models.ReviewTopicLink.sentiment, link_count()
+    return {
+        "dynamics_days": lambda: links_query(
+            db, func.date_trunc("day", models.Review.date).label("group_date"), sentiment, count,
+            start_date=START, end_date=END,
+        ).group_by("group_date", sentiment).all(),
+        "kpi_year": lambda: [
+            links_query(db, sentiment, count, start_date=start, end_date=end).group_by(sentiment).all()
+            for start, end in [(YEAR["start_date"], YEAR["end_date"]), *TREND.values()]
+        ],
+        "aspects_year": lambda: links_query(db, models.Topic.name, sentiment, count, **YEAR)
+            .join(models.Topic).filter(sentiment.in_(["positive", "negative"]))
+            .group_by(models.Topic.name, sentiment).all(),
+    }
+
+
+def engine_panels(engine, db) -> dict:
+    """Панели через интерфейс движка (модуль analytics или ColumnarStore)"""
+    return {
+        "dynamics_days": lambda: sorted(
+            (row.group_date, row.sentiment.lower(), row.count)
+            for row in engine.dynamics_rows(db, None, START, END, "day")
+        ),
+        "kpi_year": lambda: engine.period_counts(db, {"total": (YEAR["start_date"], YEAR["end_date"]), **TREND}),
+        "aspects_year": lambda: sorted(
+            (row.aspect, row.sentiment.lower(), row.count, row.last, row.previous, row.rank)
+            for row in engine.aspect_rows(db, None, YEAR["start_date"], YEAR["end_date"], TREND, 5)
+        ),
+    }
+
+
+def best_time(fn, repeat: int) -> tuple:
+    timings, result = [], None
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started_at)
+    return min(timings), result
+
+
+def touch_reviews(db, count: int):
+    """Запись в обход writeback: меняет тональность связей count отзывов и регистрирует их в журнале"""
+    review_ids = [row.id for row in db.execute(text("SELECT id FROM reviews ORDER BY random() LIMIT :n"), {"n": count})]
+    rollup.lock_writes(db)
+    rollup.apply(db, review_ids, -1)
+    db.execute(text("""
+        UPDATE reviews_topics SET sentiment = CASE sentiment WHEN 'positive' THEN 'negative' ELSE 'positive' END
+        WHERE review_id = ANY(:ids)
+    """), {"ids": review_ids})
+    rollup.apply(db, review_ids, +1)
+    analytics_cache.bump_generation(db, review_ids)
+    db.commit()
+
+
+def main(args):
+    if database.engine.dialect.name != "postgresql":
+        sys.exit("Нужен PostgreSQL: генерация данных использует его синтаксис")
+
+    failures = []
+    for links in [int(value) for value in args.links.split(",")]:
+        if not args.reuse:
+            # Отдельное соединение: generate переводит его в AUTOCOMMIT для VACUUM, а потоковому чтению
+            # копии (серверный курсор) нужна транзакция
+            with database.engine.connect() as connection:
+                generate(connection, args.schema, links // 2)
+        with database.engine.connect() as connection:
+            connection.execute(text(f"SET search_path TO {args.schema}"))
+            db = Session(bind=connection)
+            total_links = db.execute(text("SELECT count(*) FROM reviews_topics")).scalar()
+
+            store = columnar.ColumnarStore(chunk_size=args.chunk_size)
+            started_at = time.perf_counter()
+            store.sync(db)
+            load_seconds = time.perf_counter() - started_at
+
+            touch_reviews(db, 1000)
+            started_at = time.perf_counter()
+            store.sync(db)
+            sync_seconds = time.perf_counter() - started_at
+
+            print(f"\n{total_links} связей: загрузка в DuckDB {load_seconds:.1f} с, "
+                  f"синхронизация 1000 отзывов {sync_seconds * 1000:.0f} мс")
+            print(f"{'query':>15} {'join, ms':>10} {'rollup, ms':>11} {'duckdb, ms':>11}")
+            join, postgres, duck = join_panels(db), engine_panels(analytics, db), engine_panels(store, db)
+            for name in postgres:
+                join_seconds = best_time(join[name], args.repeat)[0] if not args.skip_join else float("nan")
+                rollup_seconds, rollup_result = best_time(postgres[name], args.repeat)
+                duck_seconds, duck_result = best_time(duck[name], args.repeat)
+                print(f"{name:>15} {join_seconds * 1000:>10.1f} {rollup_seconds * 1000:>11.1f} {duck_seconds * 1000:>11.1f}")
+                if rollup_result != duck_result:
+                    failures.append(f"{total_links} связей, {name}: ответы rollup и duckdb различаются")
+            db.close()
+
+    if failures:
+        print("\n".join(["", "Расхождения:"] + failures))
+        sys.exit(1)
+    print("\nOK: ответы DuckDB совпадают с дневным агрегатом")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PostgreSQL против колоночной копии DuckDB на панелях аналитики")
+    parser.add_argument("--links", default="1000000,10000000,50000000", help="Объемы связей через запятую")
+    parser.add_argument("--schema", default="bench_columnar", help="Схема для сгенерированных данных")
+    parser.add_argument("--reuse", action="store_true", help="Не генерировать данные, использовать уже созданную схему")
+    parser.add_argument("--repeat", type=int, default=3, help="Прогонов каждого запроса (берется лучший)")
+    parser.add_argument("--chunk-size", type=int, default=100_000, help="Строк в порции при загрузке в DuckDB")
+    parser.add_argument("--skip-join", action="store_true", help="Не измерять полный join (долго на больших объемах)")
+    main(parser.parse_args())
@@ -0,0 +1,151 @@
+"""Проверка, что медленный аналитический запрос не задерживает параллельные запросы /api/predict.
+
+Скрипт поднимает заглушку vLLM и сервис (как benchmarks.predict_load_test) на SQLite-базе с большим
+числом отзывов и темой без единого отзыва: лента /api/reviews?products=<эта тема> проходит все отзывы
+и отвечает долго — это и есть медленный запрос.
+Затем в два этапа измеряется задержка /api/predict с одним отзывом:
+  idle — только запросы разметки;
+  slow — те же запросы, пока несколько клиентов непрерывно запрашивают медленную ленту.
+
+Пока запросы к БД выполнялись прямо в event loop, p95 разметки на этапе slow вырастал до длительности
+медленного запроса. Проверка (при нарушении код выхода 1): p95 на этапе slow меньше половины средней
+длительности медленного запроса.
+
+Запуск из корня репозитория:
+    python -m benchmarks.db_blocking_test --reviews 1000000 --duration 10
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from benchmarks.predict_load_test import free_port, make_texts, percentile, wait_ready
+
+
+SLOW_TOPIC = "Тема без отзывов"
+
+
+def generate(path: str, reviews: int):
+    """Наполняет базу, таблицы которой сервис уже создал при запуске"""
+    started_at = time.perf_counter()
+    with sqlite3.connect(path) as connection:
+        connection.execute("INSERT INTO topics (id, name) VALUES (1, ?)", (SLOW_TOPIC,))
+        connection.execute("""
+            WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+            INSERT INTO reviews (id, site_specific_id, source, date, review_text, rating)
+            SELECT i, i, 'banki.ru', datetime('2019-01-01', '+' || (i % 2190) || ' days', '+' || (i % 86400) || ' seconds'),
+                   'отзыв ' || i, 1 + i % 5
+            FROM n
+        """, (reviews,))
+    print(f"Сгенерировано {reviews} отзывов за {time.perf_counter() - started_at:.1f} с")
+
+
+async def run_phase(session, service_url, args, slow_clients: int, rng, counter) -> dict:
+    predict_latencies, slow_latencies = [], []
+    deadline = time.monotonic() + args.duration
+
+    async def predict_client():
+        while time.monotonic() < deadline:
+            body = {"data": [{"id": 1, "text": make_texts(1, 100, 0.0, rng, counter)[0]}]}
+            started_at = time.perf_counter()
+            async with session.post(f"{service_url}/api/predict", json=body) as response:
+                await response.read()
+            predict_latencies.append(time.perf_counter() - started_at)
+
+    async def slow_client():
+        while time.monotonic() < deadline:
+            started_at = time.perf_counter()
+            async with session.get(f"{service_url}/api/reviews", params={"products": SLOW_TOPIC}) as response:
+                await response.read()
+            slow_latencies.append(time.perf_counter() - started_at)
+
+    await asyncio.gather(
+        *(predict_client() for _ in range(args.predict_clients)),
+        *(slow_client() for _ in range(slow_clients)),
+    )
+    return {
+        "predict_requests": len(predict_latencies),
+        "predict_p50": percentile(predict_latencies, 50),
+        "predict_p95": percentile(predict_latencies, 95),
+        "predict_max": max(predict_latencies, default=0.0),
+        "slow_requests": len(slow_latencies),
+        "slow_mean": sum(slow_latencies) / len(slow_latencies) if slow_latencies else 0.0,
+    }
+
+
+async def main(args):
+    rng = random.Random(args.seed)
+    counter = [0]
+    workdir = tempfile.mkdtemp(prefix="db_blocking_test_")
+    database_path = f"{workdir}/blocking.db"
+
+    mock_port, service_port = free_port(), free_port()
+    processes = [subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.mock_vllm", "--port", str(mock_port),
+         "--latency-dist", "const", "--latency-mean", str(args.llm_latency)],
+        stdout=subprocess.DEVNULL,
+    )]
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{database_path}",
+        "VLLM_URL": f"http://127.0.0.1:{mock_port}/v1/chat/completions",
+        "PREDICTION_CACHE_PATH": "",
+        # Без кэша ответов аналитики: иначе медленная лента после первого запроса отдается из памяти
+        "ANALYTICS_CACHE_SIZE": "0",
+    }
+    processes.append(subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(service_port), "--log-level", "warning"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+    ))
+    service_url = f"http://127.0.0.1:{service_port}"
+
+    try:
+        await wait_ready(f"http://127.0.0.1:{mock_port}/v1/models")
+        await wait_ready(f"{service_url}/api/predict/stats")
+        generate(database_path, args.reviews)
+        timeout = aiohttp.ClientTimeout(total=None)
+        async with aiohttp.ClientSession(timeout=timeout, connector=aiohttp.TCPConnector(limit=0)) as session:
+            results = {
+                "idle": await run_phase(session, service_url, args, 0, rng, counter),
+                "slow": await run_phase(session, service_url, args, args.slow_clients, rng, counter),
+            }
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+    print(f"{'phase':>6} {'predict req':>12} {'p50, ms':>8} {'p95, ms':>8} {'max, ms':>8} {'slow req':>9} {'slow mean, ms':>14}")
+    for phase, row in results.items():
+        print(
+            f"{phase:>6} {row['predict_requests']:>12} {row['predict_p50'] * 1000:>8.0f} {row['predict_p95'] * 1000:>8.0f} "
+            f"{row['predict_max'] * 1000:>8.0f} {row['slow_requests']:>9} {row['slow_mean'] * 1000:>14.0f}"
+        )
+
+    slow = results["slow"]
+    if not slow["slow_requests"]:
+        sys.exit("Медленный запрос не успел выполниться ни разу: увеличьте --duration")
+    if slow["predict_p95"] >= slow["slow_mean"] / 2:
+        print(f"\nРегрессия: p95 /api/predict {slow['predict_p95'] * 1000:.0f} мс при медленном запросе "
+              f"{slow['slow_mean'] * 1000:.0f} мс — запросы к БД блокируют event loop")
+        sys.exit(1)
+    print("\nOK: медленный запрос к БД не задерживает /api/predict")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Влияние медленного запроса к БД на /api/predict")
+    parser.add_argument("--reviews", type=int, default=1_000_000, help="Сколько отзывов сгенерировать")
+    parser.add_argument("--duration", type=float, default=10, help="Длительность каждого этапа, сек")
+    parser.add_argument("--predict-clients", type=int, default=4, help="Параллельных клиентов /api/predict")
+    parser.add_argument("--slow-clients", type=int, default=2, help="Параллельных клиентов медленной ленты")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Задержка заглушки vLLM, сек")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
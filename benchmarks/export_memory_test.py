@@ -0,0 +1,133 @@
+"""Проверка, что потоковая выгрузка (/api/export/...) не раздувает память воркера.
+
+Скрипт поднимает сервис на схеме PostgreSQL со сгенерированными данными (как benchmarks.analytics_explain,
+по умолчанию 2 млн отзывов, ~4 млн связей; search_path задается в DATABASE_URL) и по очереди скачивает
+выгрузки reviews и links в CSV и Parquet, читая ответ порциями. Во время скачивания раз в --sample секунд
+снимается RSS процесса сервиса (/proc/<pid>/status, только Linux).
+
+Проверка (при нарушении код выхода 1): пиковый RSS во время любой выгрузки вырос относительно RSS
+до ее начала не больше чем на --max-rss-growth МБ.
+
+Запуск из корня репозитория (DATABASE_URL указывает на PostgreSQL):
+    python -m benchmarks.export_memory_test --reviews 2000000
+    python -m benchmarks.export_memory_test --reuse --schema bench_analytics   # данные уже сгенерированы
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import aiohttp
+from sqlalchemy import text
+
+from app import database
+from benchmarks.analytics_explain import generate
+from benchmarks.predict_load_test import free_port, wait_ready
+
+
+EXPORTS = [("reviews", "csv"), ("reviews", "parquet"), ("links", "csv"), ("links", "parquet")]
+
+
+def rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def schema_url(url: str, schema: str) -> str:
+    """DATABASE_URL, в котором соединения сервиса сразу работают в схеме schema"""
+    return f"{url}{'&' if '?' in url else '?'}options=-csearch_path%3D{schema}"
+
+
+async def download(session, service_url: str, pid: int, kind: str, fmt: str, sample: float) -> dict:
+    baseline = rss_mb(pid)
+    peak, size, lines = baseline, 0, 0
+    started_at = time.perf_counter()
+    first_byte, last_sample = None, 0.0
+    async with session.get(f"{service_url}/api/export/{kind}", params={"format": fmt}) as response:
+        response.raise_for_status()
+        async for chunk in response.content.iter_chunked(1 << 20):
+            if first_byte is None:
+                first_byte = time.perf_counter() - started_at
+            size += len(chunk)
+            lines += chunk.count(b"\n")
+            if time.perf_counter() - last_sample >= sample:
+                peak, last_sample = max(peak, rss_mb(pid)), time.perf_counter()
+    peak = max(peak, rss_mb(pid))
+    return {
+        "seconds": time.perf_counter() - started_at,
+        "first_byte": first_byte or 0.0,
+        "mb": size / 1024 / 1024,
+        "rows": lines - 1 if fmt == "csv" else None,
+        "baseline": baseline,
+        "growth": peak - baseline,
+    }
+
+
+async def main(args):
+    if database.engine.dialect.name != "postgresql":
+        sys.exit("Нужен PostgreSQL: генерация данных использует его синтаксис")
+    if not args.reuse:
+        with database.engine.connect() as connection:
+            generate(connection, args.schema, args.reviews)
+    with database.engine.connect() as connection:
+        connection.execute(text(f"SET search_path TO {args.schema}"))
+        links = connection.execute(text("SELECT count(*) FROM reviews_topics")).scalar()
+
+    service_port = free_port()
+    env = {
+        **os.environ,
+        "DATABASE_URL": schema_url(database.DATABASE_URL, args.schema),
+        "PREDICTION_CACHE_PATH": "",
+        "EXPORT_CHUNK_SIZE": str(args.chunk_size),
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(service_port), "--log-level", "warning"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    service_url = f"http://127.0.0.1:{service_port}"
+    try:
+        await wait_ready(f"{service_url}/api/predict/stats")
+        timeout = aiohttp.ClientTimeout(total=None)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            results = {
+                (kind, fmt): await download(session, service_url, process.pid, kind, fmt, args.sample)
+                for kind, fmt in EXPORTS
+            }
+    finally:
+        process.terminate()
+        process.wait()
+
+    print(f"\n{links} связей, порция {args.chunk_size} строк")
+    print(f"{'export':>16} {'rows':>9} {'MB':>8} {'first byte, ms':>15} {'seconds':>8} {'MB/s':>7} {'RSS before':>11} {'RSS growth':>11}")
+    failures = []
+    for (kind, fmt), row in results.items():
+        name = f"{kind}.{fmt}"
+        rows = "" if row["rows"] is None else row["rows"]
+        print(
+            f"{name:>16} {rows:>9} {row['mb']:>8.1f} {row['first_byte'] * 1000:>15.0f} {row['seconds']:>8.1f} "
+            f"{row['mb'] / row['seconds']:>7.1f} {row['baseline']:>11.0f} {row['growth']:>11.0f}"
+        )
+        if row["growth"] > args.max_rss_growth:
+            failures.append(f"{name}: RSS вырос на {row['growth']:.0f} МБ (допустимо {args.max_rss_growth:.0f} МБ)")
+
+    if failures:
+        print("\n".join(["", "Регрессии:"] + failures))
+        sys.exit(1)
+    print("\nOK: память сервиса не растет с размером выгрузки")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RSS сервиса во время потоковой выгрузки")
+    parser.add_argument("--reviews", type=int, default=2_000_000, help="Сколько отзывов сгенерировать")
+    parser.add_argument("--schema", default="bench_analytics", help="Схема для сгенерированных данных")
+    parser.add_argument("--reuse", action="store_true", help="Не генерировать данные, использовать уже созданную схему")
+    parser.add_argument("--chunk-size", type=int, default=10_000, help="EXPORT_CHUNK_SIZE сервиса")
+    parser.add_argument("--sample", type=float, default=0.1, help="Интервал замера RSS, сек")
+    parser.add_argument("--max-rss-growth", type=float, default=100, help="Допустимый рост RSS за выгрузку, МБ")
+    asyncio.run(main(parser.parse_args()))
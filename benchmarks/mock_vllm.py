@@ -0,0 +1,128 @@
+"""Заглушка vLLM с OpenAI-совместимым /v1/chat/completions для нагрузочного тестирования без GPU.
+
+Запуск из корня репозитория:
+    python -m benchmarks.mock_vllm --port 8100 --latency-dist lognormal --latency-mean 0.8 --error-rate 0.01 --malformed-rate 0.05
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+
+from aiohttp import web
+
+from app import postprocessing
+
+
+def make_latency_sampler(dist: str, mean: float, sigma: float, rng: random.Random):
+    if dist == "const":
+        return lambda: mean
+    if dist == "uniform":
+        return lambda: rng.uniform(max(0.0, mean - sigma), mean + sigma)
+    if dist == "exponential":
+        return lambda: rng.expovariate(1 / mean) if mean > 0 else 0.0
+    if dist == "lognormal":
+        # Параметры подобраны так, чтобы среднее распределения было равно mean
+        mu = math.log(mean) - sigma ** 2 / 2 if mean > 0 else 0.0
+        return lambda: rng.lognormvariate(mu, sigma) if mean > 0 else 0.0
+    raise ValueError(f"Неизвестное распределение задержки: {dist}")
+
+
+def make_answer(text: str, rng: random.Random, double_quotes: bool) -> str:
+    """Правдоподобный ответ модели: 0-3 темы из списка допустимых"""
+    topics = rng.sample(postprocessing.main_topics, k=rng.choice([0, 1, 1, 2, 2, 3]))
+    pairs = [{"topic": t, "sentiment": rng.choice(["positive", "negative", "neutral"])} for t in topics]
+    content = json.dumps(pairs, ensure_ascii=False)
+    if not double_quotes:
+        content = content.replace('"', "'")  # Модель обучали на одинарных кавычках
+    return "<think>\n\n</think>\n\n" + content
+
+
+MALFORMED_ANSWERS = [
+    "[{'topic': 'Мобильное приложение', 'sentiment': 'positive'",  # Обрезанный JSON
+    "Отзыв касается мобильного приложения",                        # Текст вместо JSON
+    "[{'topic': 'Мобильное приложение'}]",                         # Невалидная структура
+    "[{'topic': 'Банкоматы', 'sentiment': 'good'}]",               # Неизвестная тональность
+]
+
+
+class MockVLLM:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.sample_latency = make_latency_sampler(args.latency_dist, args.latency_mean, args.latency_sigma, self.rng)
+        self.active = 0
+        self.requests = 0
+
+    async def chat_completions(self, request: web.Request):
+        payload = await request.json()
+        self.requests += 1
+        self.active += 1
+        try:
+            text = payload["messages"][-1]["content"]
+            latency = self.sample_latency() + self.args.per_char_latency * len(text)
+            # Имитация ограниченной пропускной способности GPU: сверх capacity задержка растет линейно
+            if self.args.capacity and self.active > self.args.capacity:
+                latency *= self.active / self.args.capacity
+
+            roll = self.rng.random()
+            if roll < self.args.timeout_rate:
+                await asyncio.sleep(self.args.hang_seconds)
+                return web.json_response({"error": "hang"}, status=504)
+            roll -= self.args.timeout_rate
+            if roll < self.args.error_rate:
+                await asyncio.sleep(latency / 10)
+                return web.json_response({"error": "internal error"}, status=500)
+            roll -= self.args.error_rate
+            if roll < self.args.rate_limit_rate:
+                return web.json_response({"error": "too many requests"}, status=429)
+
+            await asyncio.sleep(latency)
+            if self.rng.random() < self.args.malformed_rate:
+                content = self.rng.choice(MALFORMED_ANSWERS)
+            else:
+                guided = "response_format" in payload or "guided_json" in payload
+                content = make_answer(text, self.rng, double_quotes=guided)
+            return web.json_response({
+                "id": f"chatcmpl-mock-{self.requests}",
+                "object": "chat.completion",
+                "model": payload.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": len(text) // 4, "completion_tokens": len(content) // 4},
+            })
+        finally:
+            self.active -= 1
+
+    async def models(self, request: web.Request):
+        return web.json_response({"object": "list", "data": [{"id": "mock", "object": "model"}]})
+
+
+def build_app(args) -> web.Application:
+    mock = MockVLLM(args)
+    app = web.Application(client_max_size=16 * 1024 * 1024)
+    app.router.add_post("/v1/chat/completions", mock.chat_completions)
+    app.router.add_get("/v1/models", mock.models)
+    return app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Заглушка vLLM (OpenAI chat completions)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency-dist", choices=["const", "uniform", "exponential", "lognormal"], default="lognormal")
+    parser.add_argument("--latency-mean", type=float, default=0.5, help="Средняя задержка ответа, сек")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Разброс (sigma для lognormal, полуширина для uniform)")
+    parser.add_argument("--per-char-latency", type=float, default=0.0, help="Доп. задержка на символ запроса, сек")
+    parser.add_argument("--capacity", type=int, default=0, help="Сколько запросов «GPU» обрабатывает без замедления (0 — без ограничения)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Доля ответов 429")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="Доля зависших запросов")
+    parser.add_argument("--hang-seconds", type=float, default=300.0, help="Сколько висит зависший запрос")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Доля невалидных ответов модели")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    web.run_app(build_app(args), host=args.host, port=args.port)
@@ -0,0 +1,253 @@
+"""Нагрузочный тест /api/predict.
+
+По умолчанию сам поднимает заглушку vLLM (benchmarks.mock_vllm) и сервис (uvicorn, SQLite вместо Postgres),
+поэтому работает на обычной Linux-машине без GPU и сети. Для каждой комбинации размера батча и числа
+параллельных клиентов выводит пропускную способность, p50/p95/p99 задержки запроса, число ретраев
+и пустых ответов (по /api/predict/stats) и пиковую память процесса сервиса.
+
+Запуск из корня репозитория:
+    python -m benchmarks.predict_load_test --batch-sizes 1,50,500 --concurrency 1,8 --requests 20 \\
+        --mock-args "--latency-mean 0.3 --malformed-rate 0.05 --capacity 64"
+    python -m benchmarks.predict_load_test --service-url http://localhost:8000   # уже запущенный сервис
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+
+PHRASES = [
+    "удобное мобильное приложение",
+    "в отделении долго ждал очереди",
+    "оператор на горячей линии не смог помочь",
+    "банкомат не выдал наличные",
+    "курьер привез карту вовремя",
+    "одобрили кредит наличными под хороший процент",
+    "кэшбэк начисляют с задержкой",
+    "ставка по вкладу снизилась без предупреждения",
+    "ипотеку оформили быстро",
+    "персональный менеджер всегда на связи",
+    "перевод завис на три дня",
+    "накопительный счет с ежедневным процентом",
+]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def make_texts(count: int, mean_length: int, duplicate_rate: float, rng: random.Random, counter: list) -> list:
+    texts = []
+    for _ in range(count):
+        if texts and rng.random() < duplicate_rate:
+            texts.append(rng.choice(texts))
+            continue
+        target = max(10, int(rng.expovariate(1 / mean_length)))
+        words = []
+        while sum(len(w) + 2 for w in words) < target:
+            words.append(rng.choice(PHRASES))
+        counter[0] += 1
+        # Уникальный хвост, чтобы тест не упирался в кэш предсказаний
+        texts.append(". ".join(words).capitalize() + f". Отзыв №{counter[0]}")
+    return texts
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def read_rss_mb(pid: int | None) -> tuple:
+    """(текущий RSS, пиковый RSS) процесса в МБ по /proc"""
+    if pid is None:
+        return None, None
+    rss = hwm = None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1]) / 1024
+                elif line.startswith("VmHWM:"):
+                    hwm = int(line.split()[1]) / 1024
+    except FileNotFoundError:
+        pass
+    return rss, hwm
+
+
+async def wait_ready(url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(url) as response:
+                    if response.status < 500:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Сервис {url} не поднялся за {timeout} сек")
+
+
+async def run_config(session, service_url, batch_size, concurrency, requests, args, rng, counter, service_pid):
+    async with session.get(f"{service_url}/api/predict/stats") as response:
+        stats_before = await response.json()
+
+    latencies = []
+    errors = 0
+    peak_rss = 0.0
+    remaining = [requests]
+
+    async def client():
+        nonlocal errors
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            texts = make_texts(batch_size, args.review_length, args.duplicate_rate, rng, counter)
+            body = {"data": [{"id": i, "text": t} for i, t in enumerate(texts)]}
+            started_at = time.perf_counter()
+            try:
+                async with session.post(f"{service_url}/api/predict", json=body) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+            latencies.append(time.perf_counter() - started_at)
+
+    async def sample_memory():
+        nonlocal peak_rss
+        while True:
+            rss, _ = read_rss_mb(service_pid)
+            if rss:
+                peak_rss = max(peak_rss, rss)
+            await asyncio.sleep(0.2)
+
+    sampler = asyncio.create_task(sample_memory())
+    started_at = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started_at
+    sampler.cancel()
+
+    async with session.get(f"{service_url}/api/predict/stats") as response:
+        stats_after = await response.json()
+
+    reviews = requests * batch_size
+    return {
+        "batch_size": batch_size,
+        "concurrency": concurrency,
+        "requests": requests,
+        "reviews": reviews,
+        "errors": errors,
+        "elapsed_seconds": round(elapsed, 3),
+        "reviews_per_second": round(reviews / elapsed, 1) if elapsed else 0.0,
+        "requests_per_second": round(requests / elapsed, 2) if elapsed else 0.0,
+        "p50_seconds": round(percentile(latencies, 50), 4),
+        "p95_seconds": round(percentile(latencies, 95), 4),
+        "p99_seconds": round(percentile(latencies, 99), 4),
+        "llm_attempts": stats_after["attempts"] - stats_before["attempts"],
+        "retries": stats_after["retries"] - stats_before["retries"],
+        "empty_fallbacks": stats_after["empty_fallbacks"] - stats_before["empty_fallbacks"],
+        "service_peak_rss_mb": round(peak_rss, 1) if service_pid else None,
+    }
+
+
+def print_table(results: list):
+    columns = [
+        ("batch_size", "batch"), ("concurrency", "conc"), ("reviews", "reviews"), ("reviews_per_second", "rev/s"),
+        ("p50_seconds", "p50,s"), ("p95_seconds", "p95,s"), ("p99_seconds", "p99,s"),
+        ("retries", "retries"), ("empty_fallbacks", "empty"), ("errors", "errors"), ("service_peak_rss_mb", "rss,MB"),
+    ]
+    print(" ".join(f"{title:>9}" for _, title in columns))
+    for row in results:
+        print(" ".join(f"{str(row[key]):>9}" for key, _ in columns))
+
+
+async def main(args):
+    rng = random.Random(args.seed)
+    counter = [0]
+    processes = []
+    service_pid = None
+    service_url = args.service_url
+
+    try:
+        if service_url is None:
+            workdir = tempfile.mkdtemp(prefix="predict_load_test_")
+            mock_port, service_port = free_port(), free_port()
+            processes.append(subprocess.Popen(
+                [sys.executable, "-m", "benchmarks.mock_vllm", "--port", str(mock_port), *shlex.split(args.mock_args)],
+                stdout=subprocess.DEVNULL if args.quiet_service else None,
+            ))
+            env = {
+                **os.environ,
+                "DATABASE_URL": f"sqlite:///{workdir}/loadtest.db",
+                "VLLM_URL": f"http://127.0.0.1:{mock_port}/v1/chat/completions",
+                "PREDICTION_CACHE_PATH": "",
+                **dict(item.split("=", 1) for item in args.service_env),
+            }
+            service = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(service_port), "--log-level", "warning"],
+                env=env,
+                stdout=subprocess.DEVNULL if args.quiet_service else None,
+            )
+            processes.append(service)
+            service_pid = service.pid
+            service_url = f"http://127.0.0.1:{service_port}"
+            await wait_ready(f"http://127.0.0.1:{mock_port}/v1/models")
+
+        await wait_ready(f"{service_url}/api/predict/stats")
+
+        results = []
+        timeout = aiohttp.ClientTimeout(total=None)
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            for batch_size in args.batch_sizes:
+                for concurrency in args.concurrency:
+                    result = await run_config(
+                        session, service_url, batch_size, concurrency, args.requests, args, rng, counter, service_pid
+                    )
+                    results.append(result)
+                    print(json.dumps(result, ensure_ascii=False), file=sys.stderr)
+
+        print_table(results)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+def parse_args(argv=None):
+    int_list = lambda value: [int(v) for v in value.split(",") if v]
+    parser = argparse.ArgumentParser(description="Нагрузочный тест /api/predict")
+    parser.add_argument("--service-url", default=None, help="URL уже запущенного сервиса; по умолчанию сервис и заглушка vLLM поднимаются локально")
+    parser.add_argument("--batch-sizes", type=int_list, default=[1, 50, 500])
+    parser.add_argument("--concurrency", type=int_list, default=[1, 8])
+    parser.add_argument("--requests", type=int, default=20, help="Запросов на каждую комбинацию")
+    parser.add_argument("--review-length", type=int, default=300, help="Средняя длина отзыва в символах")
+    parser.add_argument("--duplicate-rate", type=float, default=0.0, help="Доля повторяющихся текстов внутри батча")
+    parser.add_argument("--mock-args", default="--latency-mean 0.3 --latency-sigma 0.5", help="Аргументы для benchmarks.mock_vllm")
+    parser.add_argument("--service-env", action="append", default=[], help="Переменные окружения сервиса KEY=VALUE")
+    parser.add_argument("--quiet-service", action="store_true", help="Не выводить stdout сервиса и заглушки vLLM")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Сохранить результаты в JSON")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))